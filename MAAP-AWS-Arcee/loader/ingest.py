@@ -0,0 +1,403 @@
+import hashlib
+import os
+import random
+import threading
+import time
+import traceback
+from concurrent.futures import Executor, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Generator, Iterator, List, Optional, Set, Tuple
+
+import humanize
+from botocore.exceptions import ClientError
+from fastapi import UploadFile
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+
+import loader
+import utils
+import web
+from eventlogging import EventLogger
+from vector_encoding import encode_embedding
+
+logger = EventLogger.get_logger()
+
+EMBEDDING_WORKERS = int(os.getenv("LOADER_EMBEDDING_WORKERS", "8"))
+INSERT_BATCH_SIZE = int(os.getenv("LOADER_INSERT_BATCH_SIZE", "100"))
+MAX_RETRIES = int(os.getenv("LOADER_EMBEDDING_MAX_RETRIES", "8"))
+MAX_BACKOFF_SECONDS = 20.0
+PROGRESS_INTERVAL_SECONDS = 0.5
+QUERYABLE_TIMEOUT_SECONDS = float(os.getenv("LOADER_QUERYABLE_TIMEOUT_SECONDS", "120"))
+QUERYABLE_POLL_SECONDS = 0.5
+# How embeddings are stored: "float32" or "int8" packed BSON binary vectors, or "array" of doubles
+EMBEDDING_FORMAT = os.getenv("LOADER_EMBEDDING_FORMAT", "float32")
+
+
+def IsThrottled(error: Exception) -> bool:
+    # BedrockEmbeddings re-raises endpoint errors as ValueError, so fall back to the message
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") in (
+            "ThrottlingException",
+            "TooManyRequestsException",
+        )
+    return "ThrottlingException" in str(error) or "Too many requests" in str(error)
+
+
+class AdaptiveBackoff:
+    """Shared delay between Bedrock calls that doubles when throttled and decays on success."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.delay = 0.0
+        self.throttled = 0
+
+    def wait(self):
+        with self._lock:
+            delay = self.delay
+        if delay > 0:
+            time.sleep(delay * random.uniform(0.5, 1.0))
+
+    def on_success(self):
+        with self._lock:
+            self.delay = 0.0 if self.delay < 0.05 else self.delay / 2
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttled += 1
+            self.delay = min(MAX_BACKOFF_SECONDS, max(0.2, self.delay * 2))
+
+
+def EmbedDocument(doc: Document, embeddings: Embeddings, backoff: AdaptiveBackoff) -> List[float]:
+    for attempt in range(MAX_RETRIES):
+        backoff.wait()
+        try:
+            embedding = embeddings.embed_documents([doc.page_content])[0]
+            backoff.on_success()
+            return embedding
+        except Exception as e:
+            if not IsThrottled(e) or attempt == MAX_RETRIES - 1:
+                raise
+            backoff.on_throttle()
+
+
+def EncodeEmbedding(embedding: List[float]) -> Any:
+    return encode_embedding(embedding, EMBEDDING_FORMAT)
+
+
+def ContentHash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def EnsureIndexes(collection: Collection):
+    # Chunks written before content hashing have no content_hash and are left out of the unique index
+    collection.create_index(
+        [("userId", 1), ("content_hash", 1)],
+        unique=True,
+        partialFilterExpression={"content_hash": {"$exists": True}},
+    )
+    collection.create_index([("userId", 1), ("source_keys", 1)])
+
+
+def ChunkUpdate(doc: Document, fields: Dict[str, Any], sources: Set[str]) -> Dict[str, Any]:
+    # A chunk can be part of several sources, so its source keys are kept as a set instead of the
+    # single "source_key" of the document. Its other metadata ("source", "filename", pages...) belongs to
+    # the source that stored it first and is not overwritten by a later source with the same content.
+    metadata = {
+        key: value
+        for key, value in doc.metadata.items()
+        if key not in fields and key not in ("source_key", "userId", "content_hash")
+    }
+    update = {}
+    if fields:
+        update["$set"] = fields
+    if metadata:
+        update["$setOnInsert"] = metadata
+    if sources:
+        update["$addToSet"] = {"source_keys": {"$each": sorted(sources)}}
+    return update
+
+
+def ExistingHashes(collection: Collection, keys: List[Tuple[Any, str]]) -> Set[Tuple[Any, str]]:
+    existing = set()
+    for start in range(0, len(keys), INSERT_BATCH_SIZE):
+        batch = keys[start:start + INSERT_BATCH_SIZE]
+        cursor = collection.find(
+            {
+                "userId": {"$in": list({user for user, _ in batch})},
+                "content_hash": {"$in": [content_hash for _, content_hash in batch]},
+            },
+            {"_id": 0, "userId": 1, "content_hash": 1},
+        )
+        existing.update((result["userId"], result["content_hash"]) for result in cursor)
+    return existing
+
+
+def EmbedAndStoreEvents(
+    documents: List[Document],
+    collection: Collection,
+    embeddings: Embeddings,
+    text_key: str,
+    embedding_key: str,
+) -> Generator[Dict[str, Any], None, Dict[str, Any]]:
+    """
+    Store the documents by content: every chunk is keyed by its user and the hash of its text, chunks
+    that are already stored for the user only get the sources of this upload added, and the others are
+    embedded with a bounded pool of workers and upserted in batches with bulk_write as soon as enough
+    embeddings are ready. Every chunk records the sources it is part of (metadata "source_key") in
+    "source_keys", its other metadata is only set when it is inserted. A source that no longer contains a
+    chunk is removed from its set at the end, and chunks that are left without a source are deleted.
+    Yields progress events while it runs and returns throughput statistics of the run, along with the last
+    document written as a probe for index checks. Chunks stored before content hashing have no
+    content_hash and are not matched, run mongodb_backfill_content_hash.py once to hash them.
+    """
+    start = time.perf_counter()
+    backoff = AdaptiveBackoff()
+    num_bytes = sum(len(doc.page_content.encode("utf-8")) for doc in documents)
+    chunks: Dict[Tuple[Any, str], Document] = {}
+    chunk_sources: Dict[Tuple[Any, str], Set[str]] = {}
+    source_hashes: Dict[Tuple[Any, str], List[str]] = {}
+    for doc in documents:
+        content_hash = ContentHash(doc.page_content)
+        doc.metadata["content_hash"] = content_hash
+        key = (doc.metadata.get("userId"), content_hash)
+        chunks.setdefault(key, doc)
+        chunk_sources.setdefault(key, set())
+        if doc.metadata.get("source_key"):
+            chunk_sources[key].add(doc.metadata["source_key"])
+            source_hashes.setdefault((doc.metadata.get("userId"), doc.metadata["source_key"]), []).append(content_hash)
+
+    existing = ExistingHashes(collection, list(chunks))
+    to_embed = [doc for key, doc in chunks.items() if key not in existing]
+    # Stored chunks only gain the sources of this upload
+    batch = [
+        UpdateOne(
+            {"userId": user, "content_hash": content_hash},
+            {"$addToSet": {"source_keys": {"$each": sorted(chunk_sources[(user, content_hash)])}}},
+        )
+        for user, content_hash in existing
+    ]
+    embedded = 0
+    written = 0
+    probe = None
+    last_progress = start
+
+    with ThreadPoolExecutor(max_workers=EMBEDDING_WORKERS) as executor:
+        pending = {
+            executor.submit(EmbedDocument, doc, embeddings, backoff): doc
+            for doc in to_embed
+        }
+        try:
+            while pending or batch:
+                done = set()
+                if pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    doc = pending.pop(future)
+                    # The probe keeps the float embedding to use it as a query vector
+                    probe = {text_key: doc.page_content, embedding_key: future.result(), **doc.metadata}
+                    key = (doc.metadata.get("userId"), doc.metadata["content_hash"])
+                    batch.append(
+                        UpdateOne(
+                            {"userId": key[0], "content_hash": key[1]},
+                            ChunkUpdate(
+                                doc,
+                                {text_key: doc.page_content, embedding_key: EncodeEmbedding(probe[embedding_key])},
+                                chunk_sources[key],
+                            ),
+                            upsert=True,
+                        )
+                    )
+                embedded += len(done)
+                if done and (time.perf_counter() - last_progress >= PROGRESS_INTERVAL_SECONDS or not pending):
+                    last_progress = time.perf_counter()
+                    yield {"event": "chunks_embedded", "embedded": embedded, "total": len(to_embed)}
+                if len(batch) >= INSERT_BATCH_SIZE or (batch and not pending):
+                    collection.bulk_write(batch, ordered=False)
+                    written += len(batch)
+                    batch = []
+                    yield {"event": "chunks_written", "written": written, "total": len(chunks)}
+        finally:
+            for future in pending:
+                future.cancel()
+
+    deleted = 0
+    for (user, source_key), hashes in source_hashes.items():
+        stale = collection.find(
+            {"userId": user, "source_keys": source_key, "content_hash": {"$nin": hashes}}, {"_id": 1}
+        )
+        stale_ids = [result["_id"] for result in stale]
+        if not stale_ids:
+            continue
+        collection.update_many({"_id": {"$in": stale_ids}}, {"$pull": {"source_keys": source_key}})
+        # Chunks that are still part of another source are kept
+        deleted += collection.delete_many(
+            {"_id": {"$in": stale_ids}, "source_keys": {"$size": 0}}
+        ).deleted_count
+
+    seconds = time.perf_counter() - start
+    stats = {
+        "chunks": written,
+        "embedded": embedded,
+        "reused": len(existing),
+        "deleted": deleted,
+        "bytes": num_bytes,
+        "seconds": round(seconds, 3),
+        "chunks_per_s": round(written / seconds, 2) if seconds > 0 else 0.0,
+        "bytes_per_s": round(num_bytes / seconds, 2) if seconds > 0 else 0.0,
+        "throttled": backoff.throttled,
+    }
+    logger.info(f"Embedded and stored documents: {stats}")
+    return {"stats": stats, "probe": probe}
+
+
+def EmbedAndStore(
+    documents: List[Document],
+    collection: Collection,
+    embeddings: Embeddings,
+    text_key: str,
+    embedding_key: str,
+) -> Dict[str, Any]:
+    """Run EmbedAndStoreEvents to completion and return its throughput statistics."""
+    events = EmbedAndStoreEvents(documents, collection, embeddings, text_key, embedding_key)
+    while True:
+        try:
+            next(events)
+        except StopIteration as stop:
+            return stop.value["stats"]
+
+
+def IsQueryable(collection: Collection, inputs, probe) -> bool:
+    # Search with the probe's own embedding, it is found as soon as the index has caught up with it.
+    # Upserted chunks are matched by their content hash, the probe does not know their _id.
+    results = collection.aggregate(
+        [
+            {
+                "$vectorSearch": {
+                    "index": inputs["MongoDB_index_name"],
+                    "path": inputs["MongoDB_embedding_key"],
+                    "queryVector": probe[inputs["MongoDB_embedding_key"]],
+                    "numCandidates": 100,
+                    "limit": 10,
+                    "filter": {"userId": inputs["userId"]},
+                }
+            },
+            {"$project": {"_id": 0, "content_hash": 1}},
+        ]
+    )
+    return any(result.get("content_hash") == probe["content_hash"] for result in results)
+
+
+def WaitUntilQueryable(collection: Collection, inputs, probes: List[Dict[str, Any]]) -> bool:
+    start = time.perf_counter()
+    remaining = list(probes)
+    while remaining:
+        remaining = [probe for probe in remaining if not IsQueryable(collection, inputs, probe)]
+        if not remaining:
+            break
+        if time.perf_counter() - start > QUERYABLE_TIMEOUT_SECONDS:
+            logger.error(f"Search index did not pick up {len(remaining)} new document(s) in time")
+            return False
+        time.sleep(QUERYABLE_POLL_SECONDS)
+    return True
+
+
+def MergeStats(stats: List[Dict[str, Any]], seconds: float) -> Dict[str, Any]:
+    chunks = sum(item["chunks"] for item in stats)
+    num_bytes = sum(item["bytes"] for item in stats)
+    return {
+        "chunks": chunks,
+        "embedded": sum(item["embedded"] for item in stats),
+        "reused": sum(item["reused"] for item in stats),
+        "deleted": sum(item["deleted"] for item in stats),
+        "bytes": num_bytes,
+        "seconds": round(seconds, 3),
+        "chunks_per_s": round(chunks / seconds, 2) if seconds > 0 else 0.0,
+        "bytes_per_s": round(num_bytes / seconds, 2) if seconds > 0 else 0.0,
+        "throttled": sum(item["throttled"] for item in stats),
+    }
+
+
+def ErrorMessage(prefix: str, e: Exception) -> str:
+    return prefix + str(traceback.TracebackException.from_exception(e).stack.format())
+
+
+def SaveFiles(files: List[UploadFile]):
+    # Must run inside the request, FastAPI closes the uploaded files once the endpoint returns
+    new_files = utils.UploadFiles(files)
+    print(new_files)
+    msg=[" ".join([file.filename, humanize.naturalsize(file.size)]) for file in files]
+    return new_files, msg
+
+
+def IngestEvents(new_files: List[str], msg: List[str], inputs, executor: Optional[Executor] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Run an upload of saved files and web pages end to end and yield a progress event after each stage:
+    files saved, chunks parsed, chunks embedded, chunks written and index queryable. Files and pages
+    whose content hash did not change since their last upload are skipped with a "source_unchanged"
+    event or an "unchanged" count. The last event is either "done" or "error". Partitioning runs in
+    `executor` when one is given, and every file is embedded as soon as it has been partitioned while
+    the other files are still being partitioned.
+    """
+    yield {"event": "files_saved", "files": [os.path.basename(file) for file in new_files]}
+
+    collection = utils.MongoDBCollection_Obj(inputs)
+    EnsureIndexes(collection)
+    sources = utils.SourcesCollection(inputs)
+    embeddings = utils.get_embeddings_client()
+    throughput = {}
+    probes = []
+
+    try:
+        files_start = time.perf_counter()
+        files_stats = []
+        file_hashes = {file_name: utils.HashFile(file_name) for file_name in new_files}
+        known = utils.KnownSources(sources, inputs["userId"], [utils.SourceKey(file_name) for file_name in new_files])
+        changed_files = []
+        for file_name in new_files:
+            if known.get(utils.SourceKey(file_name), {}).get("contentHash") == file_hashes[file_name]:
+                yield {"event": "source_unchanged", "source": utils.SourceKey(file_name)}
+            else:
+                changed_files.append(file_name)
+
+        for file_name, documents in loader.IterFiles(changed_files, inputs["userId"], executor, inputs.get("PartitionStrategy")):
+            for doc in documents:
+                doc.metadata["source_key"] = utils.SourceKey(file_name)
+            yield {"event": "chunks_parsed", "source": os.path.basename(file_name), "chunks": len(documents)}
+            result = yield from EmbedAndStoreEvents(documents,collection,embeddings,inputs["MongoDB_text_key"],inputs["MongoDB_embedding_key"])
+            files_stats.append(result["stats"])
+            if result["probe"] is not None:
+                probes.append(result["probe"])
+            utils.SaveSources(sources, inputs["userId"], [{"source": utils.SourceKey(file_name), "contentHash": file_hashes[file_name]}])
+        throughput["files"] = MergeStats(files_stats, time.perf_counter() - files_start)
+    except Exception as e:
+        logger.error(e)
+        yield {"event": "error", "message": ErrorMessage("There was an error uploading the file(s)", e)}
+        return
+
+    WebPagesToIngest = inputs["WebPagesToIngest"]
+    try:
+        print(WebPagesToIngest)
+        documents, records = web.LoadWeb(WebPagesToIngest, inputs["userId"], executor, inputs.get("PartitionStrategy"), sources)
+        yield {
+            "event": "chunks_parsed",
+            "source": "web",
+            "chunks": len(documents),
+            "unchanged": sum(record["status"] == "unchanged" for record in records),
+            "failed": [record["source"] for record in records if record["status"] == "failed"],
+        }
+        result = yield from EmbedAndStoreEvents(documents,collection,embeddings,inputs["MongoDB_text_key"],inputs["MongoDB_embedding_key"])
+        throughput["web"] = result["stats"]
+        if result["probe"] is not None:
+            probes.append(result["probe"])
+        utils.SaveSources(sources, inputs["userId"], [record for record in records if record["status"] == "fetched"])
+    except Exception as e:
+        logger.error(e)
+        yield {"event": "error", "message": ErrorMessage("There was an error uploading the webpage(s)", e)}
+        return
+
+    utils.InvalidateSemanticCache(inputs)
+    logger.info(f"Embedding cache: {embeddings.stats()}")
+    queryable = WaitUntilQueryable(collection, inputs, probes)
+    yield {"event": "index_queryable", "queryable": queryable}
+    yield {"event": "done", "message": f"Successfully uploaded {msg}", "throughput": throughput}
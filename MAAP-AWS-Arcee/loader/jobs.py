@@ -0,0 +1,270 @@
+import asyncio
+import datetime
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+import ingest
+import utils
+import web
+from eventlogging import EventLogger
+
+logger = EventLogger.get_logger()
+
+JOBS_COLLECTION = os.getenv("LOADER_JOBS_COLLECTION", "maap_data_loader.ingest_jobs")
+JOB_WORKERS = int(os.getenv("LOADER_JOB_WORKERS", "2"))
+PROCESS_WORKERS = int(os.getenv("LOADER_PROCESS_WORKERS", str(os.cpu_count() or 1)))
+POLL_SECONDS = 1.0
+# A running job whose worker has not reported for this long is picked up again by another worker, and the
+# file jobs of a host that has not reported for this long are failed, their uploads are gone with its disk
+STALE_SECONDS = int(os.getenv("LOADER_JOB_STALE_SECONDS", "600"))
+# Interval at which a worker refreshes the heartbeat of its running job, independent of its progress
+HEARTBEAT_SECONDS = float(os.getenv("LOADER_JOB_HEARTBEAT_SECONDS", "30"))
+HOSTNAME = socket.gethostname()
+
+TERMINAL_STATES = ("succeeded", "failed", "cancelled")
+
+
+def Now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class JobStore:
+    """Ingest jobs persisted in MongoDB, so that they survive restarts and are shared by loader replicas."""
+
+    def __init__(self, uri: str, namespace: str = JOBS_COLLECTION):
+        database, collection = namespace.split(".", 1)
+        self.collection = utils.get_mongo_client(uri)[database][collection]
+        self.collection.create_index([("state", 1), ("createdAt", 1)])
+        # One heartbeat per loader host, file jobs can only run on the host that received the upload
+        self.hosts = utils.get_mongo_client(uri)[database][f"{collection}_hosts"]
+
+    def Enqueue(self, new_files: List[str], msg: List[str], inputs) -> str:
+        job_id = str(uuid.uuid4())
+        # The connection string holds credentials, workers use their own MONGODB_URI instead
+        stored_inputs = {key: value for key, value in inputs.items() if key != "MongoDB_URI"}
+        self.collection.insert_one(
+            {
+                "_id": job_id,
+                "state": "queued",
+                "inputs": stored_inputs,
+                "files": new_files,
+                "msg": msg,
+                # Uploaded files live on this host's disk, only its workers can process them
+                "host": HOSTNAME,
+                "events": [],
+                "timings": {},
+                "createdAt": Now(),
+            }
+        )
+        logger.info(f"Queued ingest job {job_id}")
+        return job_id
+
+    def Claim(self, owner: str) -> Optional[Dict[str, Any]]:
+        now = Now()
+        return self.collection.find_one_and_update(
+            {
+                "$and": [
+                    {
+                        "$or": [
+                            {"state": "queued"},
+                            {
+                                "state": "running",
+                                "heartbeat": {"$lt": now - datetime.timedelta(seconds=STALE_SECONDS)},
+                            },
+                        ]
+                    },
+                    {"$or": [{"files": []}, {"host": HOSTNAME}]},
+                ]
+            },
+            {
+                "$set": {"state": "running", "owner": owner, "startedAt": now, "heartbeat": now},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("createdAt", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def Record(self, job_id: str, owner: str, event: Dict[str, Any], seconds: float) -> bool:
+        """Record an event of a running job, returns False when the job was cancelled or taken over by another worker."""
+        update = {
+            "$push": {"events": event},
+            "$set": {
+                "heartbeat": Now(),
+                "stage": event["event"],
+                f"timings.{event['event']}": round(seconds, 3),
+            },
+        }
+        if event["event"] == "done":
+            update["$set"].update({"state": "succeeded", "result": event, "finishedAt": Now()})
+        elif event["event"] == "error":
+            update["$set"].update({"state": "failed", "error": event["message"], "finishedAt": Now()})
+        result = self.collection.update_one({"_id": job_id, "state": "running", "owner": owner}, update)
+        return result.matched_count == 1
+
+    def Heartbeat(self, job_id: str, owner: str) -> bool:
+        """Refresh the heartbeat of a running job, returns False when the job is no longer owned by the worker."""
+        result = self.collection.update_one(
+            {"_id": job_id, "state": "running", "owner": owner}, {"$set": {"heartbeat": Now()}}
+        )
+        return result.matched_count == 1
+
+    def HostHeartbeat(self):
+        self.hosts.update_one({"_id": HOSTNAME}, {"$set": {"heartbeat": Now()}}, upsert=True)
+
+    def FailOrphans(self) -> int:
+        """
+        Fail the queued and running file jobs of hosts that stopped reporting, e.g. a loader container that was
+        replaced by one with a new HOSTNAME. Returns the number of failed jobs.
+        """
+        now = Now()
+        live_hosts = self.hosts.distinct(
+            "_id", {"heartbeat": {"$gte": now - datetime.timedelta(seconds=STALE_SECONDS)}}
+        )
+        orphans = {
+            "state": {"$in": ["queued", "running"]},
+            "files": {"$ne": []},
+            "host": {"$nin": list(set(live_hosts) | {HOSTNAME})},
+        }
+        message = "The loader host that received the upload is gone, please upload the file(s) again"
+        result = self.collection.update_many(
+            orphans,
+            {
+                "$push": {"events": {"event": "error", "message": message}},
+                "$set": {"state": "failed", "stage": "error", "error": message, "finishedAt": now},
+            },
+        )
+        if result.modified_count:
+            logger.info(f"Failed {result.modified_count} ingest job(s) of loader hosts that are gone")
+        return result.modified_count
+
+    def Cancel(self, job_id: str) -> bool:
+        result = self.collection.update_one(
+            {"_id": job_id, "state": {"$in": ["queued", "running"]}},
+            {"$set": {"state": "cancelled", "finishedAt": Now()}},
+        )
+        if result.modified_count:
+            logger.info(f"Cancelled ingest job {job_id}")
+        return result.modified_count == 1
+
+    def Get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.collection.find_one({"_id": job_id})
+
+
+def JobStatus(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "job_id": job["_id"],
+        "state": job["state"],
+        "stage": job.get("stage"),
+        "timings": job.get("timings", {}),
+        "createdAt": job["createdAt"].isoformat(),
+        "startedAt": job["startedAt"].isoformat() if job.get("startedAt") else None,
+        "finishedAt": job["finishedAt"].isoformat() if job.get("finishedAt") else None,
+        "result": job.get("result"),
+        "error": job.get("error"),
+    }
+
+
+class JobRunner:
+    """
+    Runs queued ingest jobs. Up to LOADER_JOB_WORKERS jobs run at a time, and the CPU heavy partitioning
+    of their files and web pages runs in a pool of LOADER_PROCESS_WORKERS processes, outside of the
+    loader's web server process.
+    """
+
+    def __init__(self, store: JobStore):
+        self.store = store
+        self.owner = f"{HOSTNAME}:{os.getpid()}"
+        self.partition_executor = ProcessPoolExecutor(
+            max_workers=PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+        self.job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="ingest-job")
+        self.tasks = []
+
+    def Start(self):
+        # Report this host before accepting uploads, so that other hosts do not fail its first file jobs
+        self.store.HostHeartbeat()
+        self.tasks = [asyncio.create_task(self.Work()) for _ in range(JOB_WORKERS)]
+        self.tasks.append(asyncio.create_task(self.Reap()))
+
+    async def Stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.job_executor.shutdown(wait=False, cancel_futures=True)
+        self.partition_executor.shutdown(wait=False, cancel_futures=True)
+        web.CloseFetcher()
+
+    async def Work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                job = await loop.run_in_executor(self.job_executor, self.store.Claim, self.owner)
+                if job is None:
+                    await asyncio.sleep(POLL_SECONDS)
+                    continue
+                await loop.run_in_executor(self.job_executor, self.Run, job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(e)
+                await asyncio.sleep(POLL_SECONDS)
+
+    async def Reap(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            try:
+                # Not in the job executor, its threads may all be busy running jobs
+                await loop.run_in_executor(None, self.store.HostHeartbeat)
+                await loop.run_in_executor(None, self.store.FailOrphans)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(e)
+
+    def KeepAlive(self, job_id: str, stop: threading.Event):
+        # Partitioning a large file can take longer than LOADER_JOB_STALE_SECONDS without any event
+        while not stop.wait(HEARTBEAT_SECONDS):
+            try:
+                if not self.store.Heartbeat(job_id, self.owner):
+                    return
+            except Exception as e:
+                logger.error(e)
+
+    def Run(self, job: Dict[str, Any]):
+        logger.info(f"Running ingest job {job['_id']}")
+        inputs = dict(job["inputs"], MongoDB_URI=os.getenv("MONGODB_URI"))
+        start = time.perf_counter()
+        events = ingest.IngestEvents(job["files"], job["msg"], inputs, self.partition_executor)
+        stop = threading.Event()
+        keep_alive = threading.Thread(
+            target=self.KeepAlive, args=(job["_id"], stop), name="ingest-job-heartbeat", daemon=True
+        )
+        keep_alive.start()
+        try:
+            for event in events:
+                if not self.store.Record(job["_id"], self.owner, event, time.perf_counter() - start):
+                    # Closing the generator cancels its pending embeddings
+                    logger.info(f"Stopping ingest job {job['_id']}, it was cancelled or taken over")
+                    events.close()
+                    break
+        except Exception as e:
+            logger.error(e)
+            self.store.Record(
+                job["_id"],
+                self.owner,
+                {"event": "error", "message": ingest.ErrorMessage("There was an error ingesting the upload", e)},
+                time.perf_counter() - start,
+            )
+        finally:
+            stop.set()
+            keep_alive.join()
+        logger.info(f"Finished ingest job {job['_id']} in {time.perf_counter() - start:.1f}s")
@@ -1,56 +1,207 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, wait
 from langchain_unstructured import UnstructuredLoader
+from pypdf import PdfReader, PdfWriter
 from unstructured.cleaners.core import clean_extra_whitespace
-from typing import List
+from typing import Dict, Iterator, List, Optional, Tuple
 from langchain_core.documents import Document
 
+PDF_PAGES_PER_PART = int(os.getenv("LOADER_PDF_PAGES_PER_PART", "20"))
+# A PDF page with at least this many characters of extractable text counts as having a text layer
+PDF_TEXT_CHARS_PER_PAGE = int(os.getenv("LOADER_PDF_TEXT_CHARS_PER_PAGE", "100"))
+PDF_SAMPLE_PAGES = 10
 
-def LoadFiles(file_names: List[str],userId) -> List[Document]:
+STRATEGIES = ("fast", "hi_res", "ocr_only")
+# Formats that unstructured parses from their markup, a layout model adds nothing for them
+TEXT_EXTENSIONS = {
+    ".txt", ".text", ".md", ".markdown", ".rst", ".org", ".csv", ".tsv", ".html", ".htm",
+    ".xml", ".json", ".eml", ".msg", ".docx", ".doc", ".odt", ".rtf", ".pptx", ".ppt",
+    ".xlsx", ".xls", ".epub",
+}
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".heic"}
+
+
+def SniffPdf(file_name: str) -> Dict[str, int]:
+    # Looks at the first pages only, reading every page of a large PDF costs as much as parsing it
+    reader = PdfReader(file_name)
+    pages = reader.pages[:PDF_SAMPLE_PAGES]
+    text_pages = 0
+    images = 0
+    for page in pages:
+        if len((page.extract_text() or "").strip()) >= PDF_TEXT_CHARS_PER_PAGE:
+            text_pages += 1
+        images += len(page.images)
+    return {"pages": len(reader.pages), "sampled": len(pages), "text_pages": text_pages, "images": images}
+
+
+def PlanStrategy(file_name: str, override: Optional[str] = None) -> str:
+    """
+    Pick the cheapest partition strategy that keeps the content of the file: "fast" for text formats and
+    PDFs with a text layer and no images, "ocr_only" for scanned PDFs without any text layer and "hi_res"
+    for images and PDFs that mix text with images. `override` forces a strategy, unless it is "auto".
+    """
+    if override and override != "auto":
+        if override not in STRATEGIES:
+            raise ValueError(f"Unknown partition strategy {override}, expected auto or one of {STRATEGIES}")
+        return override
+
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension in TEXT_EXTENSIONS:
+        return "fast"
+    if extension != ".pdf":
+        return "hi_res"
+
+    try:
+        sniff = SniffPdf(file_name)
+    except Exception as e:
+        print("Could not inspect", file_name, e)
+        return "hi_res"
+    if sniff["text_pages"] == 0:
+        strategy = "ocr_only"
+    elif sniff["text_pages"] == sniff["sampled"] and sniff["images"] == 0:
+        strategy = "fast"
+    else:
+        strategy = "hi_res"
+    print(f"Planned {strategy} for {os.path.basename(file_name)}: {sniff}")
+    return strategy
+
+
+def SplitPdf(file_name: str) -> List[Tuple[str, int]]:
+    # Large PDFs are partitioned in page ranges, returns (part file, index of its first page) pairs
+    if not file_name.lower().endswith(".pdf"):
+        return [(file_name, 0)]
+    try:
+        reader = PdfReader(file_name)
+        num_pages = len(reader.pages)
+    except Exception as e:
+        print("Could not read pages of", file_name, e)
+        return [(file_name, 0)]
+    if num_pages <= PDF_PAGES_PER_PART:
+        return [(file_name, 0)]
+
+    parts = []
+    base, ext = os.path.splitext(file_name)
+    try:
+        for offset in range(0, num_pages, PDF_PAGES_PER_PART):
+            writer = PdfWriter()
+            for page in reader.pages[offset:offset + PDF_PAGES_PER_PART]:
+                writer.add_page(page)
+            part_name = f"{base}.part{offset // PDF_PAGES_PER_PART}{ext}"
+            parts.append((part_name, offset))
+            with open(part_name, "wb") as f:
+                writer.write(f)
+    except Exception:
+        RemoveParts(file_name, parts)
+        raise
+    return parts
+
+
+def RemoveParts(file_name: str, parts: List[Tuple[str, int]]) -> None:
+    # Deletes the part files split from a file, the ones already partitioned are gone
+    for part_name, _ in parts:
+        if part_name != file_name:
+            try:
+                os.remove(part_name)
+            except FileNotFoundError:
+                pass
+
+
+def PlanFile(file_name: str, override: Optional[str] = None) -> Tuple[str, List[Tuple[str, int]]]:
+    # Runs in the partition worker, sniffing and splitting a large PDF reads all of it
+    return PlanStrategy(file_name, override), SplitPdf(file_name)
+
+
+def PartitionPart(part_name: str, file_name: str, strategy: str) -> Tuple[List[Document], float]:
+    # Partitions a file or one of its parts, and deletes the part file once it is parsed
+    try:
+        return PartitionFile(part_name, strategy)
+    finally:
+        if part_name != file_name:
+            RemoveParts(file_name, [(part_name, 0)])
+
+
+def PartitionFile(file_name: str, strategy: str = "hi_res") -> Tuple[List[Document], float]:
+    start = time.perf_counter()
     loader = UnstructuredLoader(
-        file_path=file_names,
+        file_path=file_name,
         post_processors=[clean_extra_whitespace],
         chunking_strategy="basic",
         max_characters=10000,
         include_orig_elements=False,
-        strategy="hi_res",
+        strategy=strategy,
     )
-
     docs = loader.load()
+    return docs, time.perf_counter() - start
 
-    print("Number of LangChain documents in Files:", len(docs))
 
-    for doc in docs:
-        doc.metadata["userId"]=userId
+def IterFiles(
+    file_names: List[str], userId, executor: Optional[Executor] = None, strategy: Optional[str] = None
+) -> Iterator[Tuple[str, List[Document]]]:
+    """
+    Partition the files, and the page ranges of large PDFs, in parallel on `executor` and yield a
+    (file name, documents) pair for every file as soon as all of its parts are done. Without an
+    executor the files are partitioned one after another in this process. The partition strategy of
+    each file comes from PlanStrategy, `strategy` overrides it for all files. Planning and splitting a
+    file also run on `executor`, and the part files left over are deleted when the iteration stops.
+    """
+    start = time.perf_counter()
+    strategies: Dict[str, str] = {}
+    parts: Dict[str, List[Tuple[str, int]]] = {}
+    results: Dict[str, List[Tuple[int, List[Document]]]] = {file_name: [] for file_name in file_names}
+    cpu_seconds = {file_name: 0.0 for file_name in file_names}
 
-        print(doc)
-        print(doc.metadata)
-        print("Length of text in the file document:", len(doc.page_content))
+    def Completed() -> Iterator[Tuple[Tuple[str, str, int], Tuple[List[Document], float]]]:
+        if executor is None:
+            for file_name in file_names:
+                strategies[file_name], parts[file_name] = PlanFile(file_name, strategy)
+                for part_name, offset in parts[file_name]:
+                    yield (file_name, part_name, offset), PartitionPart(part_name, file_name, strategies[file_name])
+            return
 
-    return docs
+        # A future without a part name plans its file, the parts of a file are submitted once it is planned
+        pending = {executor.submit(PlanFile, file_name, strategy): (file_name, None, 0) for file_name in file_names}
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_name, part_name, offset = pending.pop(future)
+                    if part_name is not None:
+                        yield (file_name, part_name, offset), future.result()
+                        continue
+                    strategies[file_name], parts[file_name] = future.result()
+                    for part_name, offset in parts[file_name]:
+                        part_future = executor.submit(PartitionPart, part_name, file_name, strategies[file_name])
+                        pending[part_future] = (file_name, part_name, offset)
+        finally:
+            for future in pending:
+                future.cancel()
 
+    completed = Completed()
+    try:
+        for (file_name, part_name, offset), (docs, seconds) in completed:
+            if part_name != file_name:
+                for doc in docs:
+                    doc.metadata["source"] = file_name
+                    doc.metadata["filename"] = os.path.basename(file_name)
+                    if "page_number" in doc.metadata:
+                        doc.metadata["page_number"] += offset
+            results[file_name].append((offset, docs))
+            cpu_seconds[file_name] += seconds
+            if len(results[file_name]) < len(parts[file_name]):
+                continue
 
-def LoadWeb(urls: List[str],userId) -> List[Document]:
-    docs = []
-    print(urls)
-    if(len(urls)>0):
-        for url in urls:
-            
-            loader = UnstructuredLoader(
-                web_url=url,
-                post_processors=[clean_extra_whitespace],
-                chunking_strategy="basic",
-                max_characters=10000,
-                include_orig_elements=False,
-                strategy="hi_res",
+            file_docs = [doc for _, part_docs in sorted(results.pop(file_name), key=lambda part: part[0]) for doc in part_docs]
+            for doc in file_docs:
+                doc.metadata["userId"]=userId
+            print(
+                f"Partitioned {os.path.basename(file_name)} ({os.path.splitext(file_name)[1].lower() or 'no extension'}, "
+                f"{strategies[file_name]}, {len(parts[file_name])} part(s)) into {len(file_docs)} documents: "
+                f"{cpu_seconds[file_name]:.2f}s partitioning, done {time.perf_counter() - start:.2f}s after start"
             )
-
-            docs.extend(loader.load())
-
-        print("Number of LangChain documents in Web Urls:", len(docs))
-
-        for doc in docs:
-            doc.metadata["userId"]=userId
-            print(doc)
-            print(doc.metadata)
-            print("Length of text in the web document:", len(doc.page_content))
-
-    return docs
\ No newline at end of file
+            yield file_name, file_docs
+    finally:
+        completed.close()
+        # Parts of a failed or cancelled ingest, that no worker partitioned and deleted
+        for file_name, file_parts in parts.items():
+            RemoveParts(file_name, file_parts)
@@ -1,66 +1,119 @@
+import asyncio
 import json
+import os
 import traceback
+from contextlib import asynccontextmanager
 from typing import List
-import time
-import humanize
 from dotenv import load_dotenv
-from fastapi import FastAPI, File, Form, UploadFile
-from langchain_mongodb import MongoDBAtlasVectorSearch
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from typing_extensions import Annotated
 import uvicorn
-import loader
-import utils
-from eventlogging import EventLogger
 
+# The loader modules read their LOADER_* settings at import time, so the .env must be loaded first
 load_dotenv()
 
+import ingest
+import jobs
+from eventlogging import EventLogger
+
 logger = EventLogger.get_logger()
-app = FastAPI()
+TAIL_POLL_SECONDS = 0.5
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Jobs are stored in the loader's own MongoDB deployment and run by background workers
+    app.state.job_store = jobs.JobStore(os.getenv("MONGODB_URI"))
+    app.state.job_runner = jobs.JobRunner(app.state.job_store)
+    app.state.job_runner.Start()
+    yield
+    await app.state.job_runner.Stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def ParseInputs(json_input_params: str):
+    inputs = json.loads(json_input_params)
+    for key, value in inputs.items():
+        print(key," = ",value)
+    return inputs
+
+
+def Enqueue(files: List[UploadFile], json_input_params: str) -> str:
+    inputs = ParseInputs(json_input_params)
+    new_files, msg = ingest.SaveFiles(files)
+    return app.state.job_store.Enqueue(new_files, msg, inputs)
 
 
 @app.post("/upload")
-async def upload(
+def upload(
     files: Annotated[
         List[UploadFile], File(description="Multiple files upload.")
     ]=[]
     ,json_input_params: str = Form(description="Pass all input pamaraters as a Json string.")):
-    inputs = {}
+    """Queue the files and web pages for ingestion. Poll /jobs/{job_id} for the state of the job."""
     try:
-        inputs = json.loads(json_input_params)
-        for key, value in inputs.items():
-            print(key," = ",value)
-
-        new_files=utils.UploadFiles(files)
-        print(new_files)
-
-        vector_store = utils.MongoDBAtlasVectorSearch_Obj(inputs)
-
-        try:
-            documents = loader.LoadFiles(new_files,inputs["userId"])
-            MongoDBAtlasVectorSearch.add_documents(vector_store,documents)
-        except Exception as e:
-            logger.error(e)
-            return {"message": "There was an error uploading the file(s)" + str(traceback.TracebackException.from_exception(e).stack.format())}
-
-
-        WebPagesToIngest = []
-        WebPagesToIngest = inputs["WebPagesToIngest"]
-        try:
-            print(WebPagesToIngest)
-            documents = loader.LoadWeb(WebPagesToIngest,inputs["userId"])
-            MongoDBAtlasVectorSearch.add_documents(vector_store,documents)
-        except Exception as e:
-            logger.error(e)
-            return {"message": "There was an error uploading the webpage(s)" + str(traceback.TracebackException.from_exception(e).stack.format())}
-        msg=[" ".join([file.filename, humanize.naturalsize(file.size)]) for file in files]
-        time.sleep(5) # wait for search index build
-        return {"message": f"Successfully uploaded {msg}"}
+        job_id = Enqueue(files, json_input_params)
+        return {"message": "Upload queued", "job_id": job_id}
     except Exception as error:
         logger.error(error)
         print(error)
         return {"message": str(traceback.TracebackException.from_exception(error).stack.format())}
 
 
+@app.post("/upload/stream")
+def upload_stream(
+    files: Annotated[
+        List[UploadFile], File(description="Multiple files upload.")
+    ]=[]
+    ,json_input_params: str = Form(description="Pass all input pamaraters as a Json string.")):
+    """Same as /upload, but streams one NDJSON progress event per line until the job has finished."""
+    try:
+        job_id = Enqueue(files, json_input_params)
+    except Exception as error:
+        logger.error(error)
+        event = {"event": "error", "message": f"The upload could not be queued: {error}"}
+        return StreamingResponse(
+            iter([json.dumps(event) + "\n"]),
+            media_type="application/x-ndjson",
+        )
+
+    async def events():
+        yield json.dumps({"event": "queued", "job_id": job_id}) + "\n"
+        sent = 0
+        while True:
+            job = await run_in_threadpool(app.state.job_store.Get, job_id)
+            for event in job["events"][sent:]:
+                yield json.dumps(event) + "\n"
+            sent = len(job["events"])
+            if job["state"] in jobs.TERMINAL_STATES:
+                break
+            await asyncio.sleep(TAIL_POLL_SECONDS)
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = app.state.job_store.Get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return jobs.JobStatus(job)
+
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    """Cancel a queued or running job, a running job stops after its current step."""
+    app.state.job_store.Cancel(job_id)
+    job = app.state.job_store.Get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return jobs.JobStatus(job)
+
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# The loader modules import each other by their flat names, as in the image
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The event logger writes to ./applogs of the working directory, which is /code in the image
+os.chdir(tempfile.mkdtemp(prefix="loader-tests-"))
+os.makedirs("applogs", exist_ok=True)
@@ -0,0 +1,152 @@
+"""
+Tests of the web fetcher against a local HTTP server: conditional requests, content hash skips, failures
+and the per-host connection limit. Pages are not partitioned, ParseContent is replaced by a stub.
+
+    cd MAAP-AWS-Arcee/loader && python -m pytest tests
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from langchain_core.documents import Document
+
+import web
+
+PAGES = {
+    "/etag": (b"<html><body>Page with an ETag</body></html>", {"ETag": '"v1"'}),
+    "/plain": (b"<html><body>Page without validators</body></html>", {}),
+    "/slow": (b"<html><body>Slow page</body></html>", {}),
+}
+SLOW_SECONDS = 0.2
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        path = self.path.split("?")[0]
+        with server.lock:
+            server.requests.append((path, dict(self.headers)))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            if path.startswith("/slow"):
+                time.sleep(SLOW_SECONDS)
+            page = PAGES.get("/slow" if path.startswith("/slow") else path)
+            if page is None:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body, headers = page
+            if headers.get("ETag") and self.headers.get("If-None-Match") == headers["ETag"]:
+                self.send_response(304)
+                self.send_header("ETag", headers["ETag"])
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    httpd.in_flight = 0
+    httpd.max_in_flight = 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def base_url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+@pytest.fixture
+def web_fetcher(monkeypatch):
+    monkeypatch.setattr(web, "WEB_POLITENESS_SECONDS", 0.0)
+    monkeypatch.setattr(
+        web,
+        "ParseContent",
+        lambda content, content_type, url, userId, strategy=None: [
+            Document(page_content=content.decode("utf-8"), metadata={"source": url, "userId": userId})
+        ],
+    )
+    web_fetcher = web.WebFetcher()
+    previous = web.SetFetcher(web_fetcher)
+    yield web_fetcher
+    web.SetFetcher(previous)
+    web_fetcher.Close()
+
+
+def test_fetches_pages_and_records_validators(web_fetcher, base_url):
+    docs, records = web.LoadWeb([f"{base_url}/etag", f"{base_url}/plain"], "user@example.com")
+
+    assert [doc.metadata["source_key"] for doc in docs] == [f"{base_url}/etag", f"{base_url}/plain"]
+    assert [record["status"] for record in records] == ["fetched", "fetched"]
+    assert records[0]["etag"] == '"v1"'
+    assert records[1]["etag"] is None
+    assert len(records[1]["contentHash"]) == 64
+
+
+def test_skips_page_not_modified_since_its_etag(web_fetcher, server, base_url):
+    url = f"{base_url}/etag"
+    [(_, first)] = web_fetcher.Run(web_fetcher.LoadPages([url], "user@example.com", None, None, {}))
+    results = web_fetcher.Run(web_fetcher.LoadPages([url], "user@example.com", None, None, {url: first}))
+
+    assert results == [([], {"source": url, "status": "unchanged"})]
+    assert server.requests[-1][1].get("If-None-Match") == '"v1"'
+
+
+def test_skips_page_with_the_same_content_hash(web_fetcher, base_url):
+    url = f"{base_url}/plain"
+    [(_, first)] = web_fetcher.Run(web_fetcher.LoadPages([url], "user@example.com", None, None, {}))
+    known = {url: {"contentHash": first["contentHash"]}}
+    results = web_fetcher.Run(web_fetcher.LoadPages([url], "user@example.com", None, None, known))
+
+    assert results == [([], {"source": url, "status": "unchanged"})]
+
+
+def test_records_failed_pages_and_raises_when_all_fail(web_fetcher, base_url):
+    docs, records = web.LoadWeb([f"{base_url}/plain", f"{base_url}/missing"], "user@example.com")
+
+    assert len(docs) == 1
+    assert [record["status"] for record in records] == ["fetched", "failed"]
+    with pytest.raises(RuntimeError):
+        web.LoadWeb([f"{base_url}/missing"], "user@example.com")
+
+
+def test_limits_concurrent_requests_per_host(web_fetcher, server, base_url):
+    urls = [f"{base_url}/slow?page={i}" for i in range(3 * web.WEB_PER_HOST_CONNECTIONS)]
+    docs, records = web.LoadWeb(urls, "user@example.com")
+
+    assert len(docs) == len(urls)
+    assert all(record["status"] == "fetched" for record in records)
+    assert server.max_in_flight == web.WEB_PER_HOST_CONNECTIONS
+
+
+def test_set_fetcher_replaces_the_shared_fetcher(web_fetcher):
+    assert web.get_fetcher() is web_fetcher
+    replacement = web.WebFetcher()
+    try:
+        assert web.SetFetcher(replacement) is web_fetcher
+        assert web.get_fetcher() is replacement
+    finally:
+        web.SetFetcher(web_fetcher)
+        replacement.Close()
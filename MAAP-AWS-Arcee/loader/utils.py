@@ -1,18 +1,73 @@
 import datetime
+import hashlib
+import io
 import os
+import re
 import shutil
-from typing import List
+from typing import Any, Dict, List
 
 import boto3
 import pymongo
 from fastapi import UploadFile
 from langchain_aws import BedrockEmbeddings
-from langchain_mongodb import MongoDBAtlasVectorSearch
+from pymongo.collection import Collection
 
+from embedding_cache import CachedEmbeddings
 from eventlogging import EventLogger
 
 logger = EventLogger.get_logger()
 
+EMBEDDING_MODEL_ID = "amazon.titan-embed-text-v1"
+SOURCES_COLLECTION = os.getenv("LOADER_SOURCES_COLLECTION", "maap_data_loader.sources")
+HASH_BUFFER_SIZE = 1024 * 1024
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+embeddings_client = None
+mongo_clients = {}
+
+
+def CopyUpload(source, destination) -> int:
+    """
+    Copy an uploaded file to disk without passing its bytes through Python. Uploads larger than the
+    spooling threshold are already on disk, they are copied in the kernel with copy_file_range, or
+    sendfile where that is not available. Small, in-memory uploads are written directly.
+    """
+    if not getattr(source, "_rolled", True):
+        # Asking an in-memory SpooledTemporaryFile for its fileno would roll it over to disk first
+        source.seek(0)
+        shutil.copyfileobj(source, destination, COPY_BUFFER_SIZE)
+        return destination.tell()
+    try:
+        in_fd = source.fileno()
+        out_fd = destination.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        source.seek(0)
+        shutil.copyfileobj(source, destination, COPY_BUFFER_SIZE)
+        return destination.tell()
+
+    size = os.fstat(in_fd).st_size
+    copied = 0
+    kernel_copies = []
+    if hasattr(os, "copy_file_range"):
+        kernel_copies.append(lambda: os.copy_file_range(in_fd, out_fd, size - copied, offset_src=copied))
+    if hasattr(os, "sendfile"):
+        kernel_copies.append(lambda: os.sendfile(out_fd, in_fd, copied, size - copied))
+    for kernel_copy in kernel_copies:
+        try:
+            while copied < size:
+                sent = kernel_copy()
+                if sent == 0:
+                    break
+                copied += sent
+            break
+        except OSError:
+            # Not supported between these file systems, try the next way of copying the rest
+            continue
+    if copied < size:
+        source.seek(copied)
+        shutil.copyfileobj(source, destination, COPY_BUFFER_SIZE)
+        copied = destination.tell()
+    return copied
+
 
 def UploadFiles(files: List[UploadFile]) -> List[str]:
     strDatetime = datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
@@ -31,7 +86,7 @@ def UploadFiles(files: List[UploadFile]) -> List[str]:
             )
 
             with open(file_name, "wb") as f:
-                shutil.copyfileobj(file.file, f)
+                CopyUpload(file.file, f)
                 new_files.append(file_name)
         except Exception as e:
             logger.error(e)
@@ -41,29 +96,99 @@ def UploadFiles(files: List[UploadFile]) -> List[str]:
     return new_files
 
 
-# Setup AWS client
+def SourceKey(file_name: str) -> str:
+    # The name the file was uploaded with, without the timestamp UploadFiles adds to it
+    return re.sub(r"_\d{4}(_\d{2}){5}(?=\.[^.]*$|$)", "", os.path.basename(file_name))
+
+
+def HashFile(file_name: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BUFFER_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Setup AWS client, shared by all uploads so that the embedding cache outlives a single request
 def get_embeddings_client():
-    embedding_model_id = "amazon.titan-embed-text-v1"
-    bedrock_runtime = boto3.client("bedrock-runtime", region_name="us-east-1")
-    embeddings_client = BedrockEmbeddings(
-        client=bedrock_runtime,
-        model_id=embedding_model_id,
-    )
+    global embeddings_client
+    if embeddings_client is None:
+        bedrock_runtime = boto3.client("bedrock-runtime", region_name="us-east-1")
+        cache_collection = None
+        cache_namespace = os.getenv("EMBEDDING_CACHE_COLLECTION")
+        if cache_namespace and os.getenv("MONGODB_URI"):
+            database, collection = cache_namespace.split(".", 1)
+            cache_collection = pymongo.MongoClient(host=os.getenv("MONGODB_URI"))[database][collection]
+        embeddings_client = CachedEmbeddings(
+            BedrockEmbeddings(
+                client=bedrock_runtime,
+                model_id=EMBEDDING_MODEL_ID,
+            ),
+            model_id=EMBEDDING_MODEL_ID,
+            max_size=int(os.getenv("EMBEDDING_CACHE_SIZE", "1024")),
+            ttl_seconds=float(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", "3600")),
+            collection=cache_collection,
+            collection_ttl_seconds=int(
+                os.getenv("EMBEDDING_CACHE_COLLECTION_TTL_SECONDS", "604800")
+            ),
+        )
     return embeddings_client
 
 
-def MongoDBAtlasVectorSearch_Obj(inputs) -> MongoDBAtlasVectorSearch:
-    embeddings_client = get_embeddings_client()
-    # Connect to the MongoDB database
-    mongoDBClient = pymongo.MongoClient(host=inputs["MongoDB_URI"],w="majority",readConcernLevel="majority")
-    logger.info("Connected to MongoDB...")
+def get_mongo_client(uri) -> pymongo.MongoClient:
+    # One pooled client per connection string for the lifetime of the loader process
+    client = mongo_clients.get(uri)
+    if client is None:
+        client = pymongo.MongoClient(host=uri,w="majority",readConcernLevel="majority")
+        logger.info("Connected to MongoDB...")
+        mongo_clients[uri] = client
+    return client
+
+
+def MongoDBCollection_Obj(inputs) -> Collection:
+    mongoDBClient = get_mongo_client(inputs["MongoDB_URI"])
     database = mongoDBClient[inputs["MongoDB_database_name"]]
-    collection = database[inputs["MongoDB_collection_name"]]
-    vector_store = MongoDBAtlasVectorSearch(
-        text_key=inputs["MongoDB_text_key"],
-        embedding_key=inputs["MongoDB_embedding_key"],
-        index_name=inputs["MongoDB_index_name"],
-        embedding=embeddings_client,
-        collection=collection,
-    )
-    return vector_store
+    return database[inputs["MongoDB_collection_name"]]
+
+
+def InvalidateSemanticCache(inputs) -> int:
+    # Answers cached by the RAG service that used this user's uploads are stale after a new upload
+    cache_namespace = os.getenv("SEMANTIC_CACHE_COLLECTION")
+    if not cache_namespace:
+        return 0
+    database, collection = cache_namespace.split(".", 1)
+    cache = get_mongo_client(inputs["MongoDB_URI"])[database][collection]
+    deleted = cache.delete_many({"userId": inputs["userId"], "usesUserData": True}).deleted_count
+    logger.info(f"Invalidated {deleted} semantic cache entries for {inputs['userId']}")
+    return deleted
+
+
+def SourcesCollection(inputs) -> Collection:
+    # One record per user and ingested file or URL, with the hash of the content that was last stored
+    database, collection = SOURCES_COLLECTION.split(".", 1)
+    sources = get_mongo_client(inputs["MongoDB_URI"])[database][collection]
+    sources.create_index([("userId", 1), ("source", 1)], unique=True)
+    return sources
+
+
+def KnownSources(sources: Collection, userId, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+    return {record["source"]: record for record in sources.find({"userId": userId, "source": {"$in": keys}})}
+
+
+def SaveSources(sources: Collection, userId, records: List[Dict[str, Any]]):
+    # Saved only once the chunks of a source are stored, so that a failed ingest is not skipped next time
+    updates = [
+        pymongo.UpdateOne(
+            {"userId": userId, "source": record["source"]},
+            {
+                "$set": {
+                    **{key: value for key, value in record.items() if key not in ("source", "status", "error")},
+                    "updatedAt": datetime.datetime.now(datetime.timezone.utc),
+                }
+            },
+            upsert=True,
+        )
+        for record in records
+    ]
+    if updates:
+        sources.bulk_write(updates, ordered=False)
@@ -0,0 +1 @@
+../shared/vector_encoding.py
\ No newline at end of file
@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import io
+import mimetypes
+import os
+import threading
+import time
+from concurrent.futures import Executor
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+from langchain_core.documents import Document
+from pymongo.collection import Collection
+from unstructured.cleaners.core import clean_extra_whitespace
+
+import loader
+import utils
+from eventlogging import EventLogger
+
+logger = EventLogger.get_logger()
+
+WEB_MAX_CONNECTIONS = int(os.getenv("LOADER_WEB_MAX_CONNECTIONS", "20"))
+WEB_PER_HOST_CONNECTIONS = int(os.getenv("LOADER_WEB_PER_HOST_CONNECTIONS", "2"))
+# Minimum time between the starts of two requests to the same host
+WEB_POLITENESS_SECONDS = float(os.getenv("LOADER_WEB_POLITENESS_SECONDS", "0.5"))
+WEB_TIMEOUT_SECONDS = float(os.getenv("LOADER_WEB_TIMEOUT_SECONDS", "20"))
+USER_AGENT = "maap-data-loader"
+
+fetcher = None
+fetcher_lock = threading.Lock()
+
+
+def ParseContent(content: bytes, content_type: str, url: str, userId, strategy: Optional[str] = None) -> List[Document]:
+    # Runs in the partition process pool, away from the fetcher's event loop
+    from unstructured.partition.auto import partition
+
+    start = time.perf_counter()
+    extension = mimetypes.guess_extension(content_type) or ".html"
+    if not strategy or strategy == "auto":
+        # Without the file on disk there is nothing to sniff, only markup formats skip the layout model
+        strategy = "fast" if extension in loader.TEXT_EXTENSIONS else "hi_res"
+    elements = partition(
+        file=io.BytesIO(content),
+        content_type=content_type,
+        strategy=strategy,
+        chunking_strategy="basic",
+        max_characters=10000,
+        include_orig_elements=False,
+    )
+    docs = []
+    for element in elements:
+        element.apply(clean_extra_whitespace)
+        metadata = element.metadata.to_dict()
+        metadata.update(
+            {"source": url, "url": url, "category": element.category, "element_id": element.id, "userId": userId}
+        )
+        docs.append(Document(page_content=str(element), metadata=metadata))
+    print(f"Partitioned {url} ({content_type}, {strategy}) into {len(docs)} documents: {time.perf_counter() - start:.2f}s")
+    return docs
+
+
+class WebFetcher:
+    """
+    Fetches web pages for all ingest jobs on one event loop running in a background thread, with a single
+    pooled HTTP client. Requests to a host are limited to LOADER_WEB_PER_HOST_CONNECTIONS at a time and
+    start at least LOADER_WEB_POLITENESS_SECONDS apart. Pages are requested with the ETag and
+    Last-Modified validators of their previous ingest, and pages that are not modified or whose body
+    hashes to the same content as before are skipped.
+    """
+
+    def __init__(self, client: Optional[httpx.AsyncClient] = None):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="web-fetcher", daemon=True)
+        self.thread.start()
+        self.client = client or self.Run(self.CreateClient())
+        self.host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.host_locks: Dict[str, asyncio.Lock] = {}
+        self.next_request: Dict[str, float] = {}
+
+    def Run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def CreateClient(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(WEB_TIMEOUT_SECONDS),
+            limits=httpx.Limits(max_connections=WEB_MAX_CONNECTIONS, max_keepalive_connections=WEB_MAX_CONNECTIONS),
+            follow_redirects=True,
+            headers={"User-Agent": USER_AGENT},
+        )
+
+    async def WaitForTurn(self, host: str):
+        lock = self.host_locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            delay = self.next_request.get(host, 0.0) - self.loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_request[host] = self.loop.time() + WEB_POLITENESS_SECONDS
+
+    async def Fetch(self, url: str, known: Optional[Dict[str, Any]] = None) -> httpx.Response:
+        host = urlsplit(url).netloc
+        headers = {}
+        if known and known.get("etag"):
+            headers["If-None-Match"] = known["etag"]
+        if known and known.get("lastModified"):
+            headers["If-Modified-Since"] = known["lastModified"]
+        semaphore = self.host_semaphores.setdefault(host, asyncio.Semaphore(WEB_PER_HOST_CONNECTIONS))
+        async with semaphore:
+            await self.WaitForTurn(host)
+            response = await self.client.get(url, headers=headers)
+        if response.status_code != 304:
+            response.raise_for_status()
+        return response
+
+    async def LoadPage(
+        self, url: str, userId, executor: Optional[Executor], strategy: Optional[str], known: Optional[Dict[str, Any]]
+    ) -> Tuple[List[Document], Dict[str, Any]]:
+        start = time.perf_counter()
+        try:
+            response = await self.Fetch(url, known)
+        except Exception as e:
+            logger.error(f"Could not fetch {url}: {e}")
+            return [], {"source": url, "status": "failed", "error": str(e)}
+        fetch_seconds = time.perf_counter() - start
+        content_hash = None if response.status_code == 304 else hashlib.sha256(response.content).hexdigest()
+        if response.status_code == 304 or (known and known.get("contentHash") == content_hash):
+            print(f"Skipped unchanged {url}: {fetch_seconds:.2f}s")
+            return [], {"source": url, "status": "unchanged"}
+
+        content_type = response.headers.get("content-type", "text/html").split(";")[0].strip()
+        docs = await self.loop.run_in_executor(
+            executor, ParseContent, response.content, content_type, url, userId, strategy
+        )
+        for doc in docs:
+            doc.metadata["source_key"] = url
+        print(f"Fetched {url} ({len(response.content)} bytes) in {fetch_seconds:.2f}s")
+        page = {
+            "source": url,
+            "status": "fetched",
+            "contentHash": content_hash,
+            "etag": response.headers.get("etag"),
+            "lastModified": response.headers.get("last-modified"),
+        }
+        return docs, page
+
+    async def LoadPages(
+        self, urls: List[str], userId, executor: Optional[Executor], strategy: Optional[str], known: Dict[str, Dict[str, Any]]
+    ) -> List[Tuple[List[Document], Dict[str, Any]]]:
+        return await asyncio.gather(
+            *(self.LoadPage(url, userId, executor, strategy, known.get(url)) for url in urls)
+        )
+
+    def Close(self):
+        self.Run(self.client.aclose())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+def get_fetcher() -> WebFetcher:
+    global fetcher
+    with fetcher_lock:
+        if fetcher is None:
+            fetcher = WebFetcher()
+        return fetcher
+
+
+def SetFetcher(web_fetcher: Optional[WebFetcher]) -> Optional[WebFetcher]:
+    """
+    Replace the shared fetcher, e.g. with one built around a preconfigured client for tests, proxies or
+    custom transports. None resets it, so that the next get_fetcher() creates the default one. Returns the
+    previous fetcher, which is left open for the caller to close.
+    """
+    global fetcher
+    with fetcher_lock:
+        previous, fetcher = fetcher, web_fetcher
+        return previous
+
+
+def CloseFetcher():
+    global fetcher
+    with fetcher_lock:
+        if fetcher is not None:
+            fetcher.Close()
+            fetcher = None
+
+
+def LoadWeb(
+    urls: List[str], userId, executor: Optional[Executor] = None, strategy: Optional[str] = None, sources: Optional[Collection] = None
+) -> Tuple[List[Document], List[Dict[str, Any]]]:
+    """
+    Fetch and partition the web pages concurrently. Returns the documents of the new and changed pages and
+    a fetch record per URL with its status: fetched, unchanged or failed. Raises when no URL could be fetched.
+    """
+    if not urls:
+        return [], []
+    known = utils.KnownSources(sources, userId, urls) if sources is not None else {}
+
+    start = time.perf_counter()
+    web_fetcher = get_fetcher()
+    results = web_fetcher.Run(web_fetcher.LoadPages(urls, userId, executor, strategy, known))
+    docs = [doc for page_docs, _ in results for doc in page_docs]
+    records = [record for _, record in results]
+    print(f"Loaded {len(urls)} web page(s) into {len(docs)} documents in {time.perf_counter() - start:.2f}s")
+    if all(record["status"] == "failed" for record in records):
+        raise RuntimeError(f"Could not fetch any of {urls}: {[record['error'] for record in records]}")
+    return docs, records
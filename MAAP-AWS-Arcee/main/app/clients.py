@@ -0,0 +1,198 @@
+"""
+Process-wide client registry for the RAG service.
+
+Creating a `pymongo.MongoClient` or a boto3 client is expensive: every new MongoDB client performs
+server discovery and TLS handshakes, and every boto3 client builds its own connection pool. This
+module keeps a single instance of each per worker process so that they are reused across requests.
+
+The registry is started and stopped from the FastAPI lifespan in `server.py`. Clients are also created
+lazily on first use so the retriever keeps working when it is invoked outside of the web server.
+
+Besides the synchronous clients, the registry owns an `AsyncMongoClient` and an aiobotocore Bedrock
+runtime client for the async request path, so that retrieval never blocks the event loop.
+
+Configuration (environment variables):
+    - MONGODB_URI: Connection string for MongoDB Atlas.
+    - MONGODB_MAX_POOL_SIZE: Maximum number of pooled MongoDB connections per server (default: 100).
+    - MONGODB_MIN_POOL_SIZE: Minimum number of pooled MongoDB connections per server (default: 0).
+    - MONGODB_MAX_IDLE_TIME_MS: Idle time before a pooled MongoDB connection is closed (default: 300000).
+    - BEDROCK_REGION: AWS region of the Bedrock runtime (default: "us-east-1").
+    - BEDROCK_MAX_POOL_CONNECTIONS: Maximum number of pooled Bedrock HTTP connections (default: 50).
+    - EMBEDDING_CACHE_SIZE: Number of query embeddings cached in process (default: 1024).
+    - EMBEDDING_CACHE_TTL_SECONDS: Lifetime of an in-process cached embedding (default: 3600).
+    - EMBEDDING_CACHE_COLLECTION: "<database>.<collection>" shared by replicas as a second cache tier
+      (default: unset, disabled).
+    - EMBEDDING_CACHE_COLLECTION_TTL_SECONDS: Lifetime of a shared cached embedding (default: 604800).
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+from contextlib import AsyncExitStack
+from typing import List, Optional
+
+import boto3
+import pymongo
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+from botocore.config import Config
+from langchain_aws import BedrockEmbeddings
+
+from app.embedding_cache import CachedEmbeddings
+
+EMBEDDING_MODEL_ID = "amazon.titan-embed-text-v1"
+
+
+class ClientRegistry:
+    """
+    Holds the MongoDB clients, the Bedrock runtime clients and the cached embeddings model for the lifetime
+    of a worker process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._mongo_client: Optional[pymongo.MongoClient] = None
+        self._bedrock_client = None
+        self._embeddings: Optional[CachedEmbeddings] = None
+        self._async_mongo_client: Optional[pymongo.AsyncMongoClient] = None
+        self._async_bedrock_client = None
+        self._async_exit_stack: Optional[AsyncExitStack] = None
+        self._async_lock = asyncio.Lock()
+
+    def startup(self) -> None:
+        """Create all clients eagerly so the first request does not pay for the setup."""
+        with self._lock:
+            self._start()
+
+    async def astartup(self) -> None:
+        """Create the synchronous and the asynchronous clients."""
+        self.startup()
+        await self.async_bedrock_client()
+
+    async def ashutdown(self) -> None:
+        """Close the asynchronous clients, then the synchronous ones."""
+        async with self._async_lock:
+            if self._async_exit_stack is not None:
+                await self._async_exit_stack.aclose()
+                self._async_exit_stack = None
+                self._async_bedrock_client = None
+        if self._async_mongo_client is not None:
+            await self._async_mongo_client.close()
+            self._async_mongo_client = None
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        """Close all pooled connections. The registry can be started again afterwards."""
+        with self._lock:
+            self._embeddings = None
+            if self._bedrock_client is not None:
+                self._bedrock_client.close()
+                self._bedrock_client = None
+            if self._mongo_client is not None:
+                self._mongo_client.close()
+                self._mongo_client = None
+                logging.info("Closed MongoDB connection pool.")
+
+    def _start(self) -> None:
+        if self._mongo_client is None:
+            self._mongo_client = pymongo.MongoClient(
+                host=os.getenv("MONGODB_URI"),
+                maxPoolSize=int(os.getenv("MONGODB_MAX_POOL_SIZE", "100")),
+                minPoolSize=int(os.getenv("MONGODB_MIN_POOL_SIZE", "0")),
+                maxIdleTimeMS=int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000")),
+            )
+            logging.info("Connected to MongoDB...")
+        if self._bedrock_client is None:
+            self._bedrock_client = boto3.client(
+                "bedrock-runtime",
+                region_name=os.getenv("BEDROCK_REGION", "us-east-1"),
+                config=Config(
+                    max_pool_connections=int(
+                        os.getenv("BEDROCK_MAX_POOL_CONNECTIONS", "50")
+                    )
+                ),
+            )
+        if self._embeddings is None:
+            cache_collection = None
+            cache_namespace = os.getenv("EMBEDDING_CACHE_COLLECTION")
+            if cache_namespace:
+                database, collection = cache_namespace.split(".", 1)
+                cache_collection = self._mongo_client[database][collection]
+            self._embeddings = CachedEmbeddings(
+                BedrockEmbeddings(model_id=EMBEDDING_MODEL_ID, client=self._bedrock_client),
+                model_id=EMBEDDING_MODEL_ID,
+                max_size=int(os.getenv("EMBEDDING_CACHE_SIZE", "1024")),
+                ttl_seconds=float(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", "3600")),
+                collection=cache_collection,
+                collection_ttl_seconds=int(
+                    os.getenv("EMBEDDING_CACHE_COLLECTION_TTL_SECONDS", "604800")
+                ),
+                async_embed=self._aembed_titan,
+            )
+
+    def _ensure_started(self) -> None:
+        if self._embeddings is None:
+            with self._lock:
+                self._start()
+
+    @property
+    def mongo_client(self) -> pymongo.MongoClient:
+        self._ensure_started()
+        return self._mongo_client
+
+    @property
+    def bedrock_client(self):
+        self._ensure_started()
+        return self._bedrock_client
+
+    @property
+    def embeddings(self) -> CachedEmbeddings:
+        self._ensure_started()
+        return self._embeddings
+
+    @property
+    def async_mongo_client(self) -> pymongo.AsyncMongoClient:
+        if self._async_mongo_client is None:
+            self._async_mongo_client = pymongo.AsyncMongoClient(
+                host=os.getenv("MONGODB_URI"),
+                maxPoolSize=int(os.getenv("MONGODB_MAX_POOL_SIZE", "100")),
+                minPoolSize=int(os.getenv("MONGODB_MIN_POOL_SIZE", "0")),
+                maxIdleTimeMS=int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000")),
+            )
+        return self._async_mongo_client
+
+    async def async_bedrock_client(self):
+        """Return the aiobotocore Bedrock runtime client, creating it on first use."""
+        if self._async_bedrock_client is None:
+            async with self._async_lock:
+                if self._async_bedrock_client is None:
+                    exit_stack = AsyncExitStack()
+                    self._async_bedrock_client = await exit_stack.enter_async_context(
+                        get_session().create_client(
+                            "bedrock-runtime",
+                            region_name=os.getenv("BEDROCK_REGION", "us-east-1"),
+                            config=AioConfig(
+                                max_pool_connections=int(
+                                    os.getenv("BEDROCK_MAX_POOL_CONNECTIONS", "50")
+                                )
+                            ),
+                        )
+                    )
+                    self._async_exit_stack = exit_stack
+        return self._async_bedrock_client
+
+    async def _aembed_titan(self, text: str) -> List[float]:
+        client = await self.async_bedrock_client()
+        response = await client.invoke_model(
+            body=json.dumps({"inputText": text.replace(os.linesep, " ")}),
+            modelId=EMBEDDING_MODEL_ID,
+            accept="application/json",
+            contentType="application/json",
+        )
+        async with response["body"] as stream:
+            body = await stream.read()
+        return json.loads(body)["embedding"]
+
+
+registry = ClientRegistry()
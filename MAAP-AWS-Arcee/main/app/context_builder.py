@@ -0,0 +1,124 @@
+"""
+Token-budgeted context assembly for the RAG prompt.
+
+Retrieved chunks can be up to 10,000 characters each, so joining all of them can make the prompt very long,
+and prefill time on the model endpoint then dominates the latency. The context builder keeps the order of
+the retriever, which already ranks by score, rank fusion or MMR, drops chunks that are near duplicates of
+a higher ranked chunk and adds the remaining ones to the context until the token budget is used up.
+Tokens are estimated from the number of characters, which is cheap and close enough for budgeting.
+
+Configuration (environment variables, read by `server.py`):
+    - CONTEXT_TOKEN_BUDGET: Maximum estimated number of context tokens (default: 3000).
+    - CONTEXT_DUPLICATE_THRESHOLD: Jaccard similarity of word shingles above which a chunk is dropped as a
+      near duplicate (default: 0.9).
+    - CONTEXT_CHARS_PER_TOKEN: Characters per token used for the estimate (default: 4).
+"""
+import logging
+import re
+import threading
+from typing import Dict, FrozenSet, List
+
+from langchain_core.documents import Document
+
+SHINGLE_SIZE = 3
+SEPARATOR = "\n"
+
+
+def shingles(text: str) -> FrozenSet[int]:
+    """Return the hashed word trigrams of a text, used to compare chunks for near duplicates."""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return frozenset([hash(" ".join(words))])
+    return frozenset(
+        hash(" ".join(words[i : i + SHINGLE_SIZE])) for i in range(len(words) - SHINGLE_SIZE + 1)
+    )
+
+
+def jaccard(a: FrozenSet[int], b: FrozenSet[int]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ContextBuilder:
+    """
+    Builds the `{context}` of the prompt from retrieved documents within a token budget.
+
+    Attributes:
+        token_budget (int): Maximum estimated number of tokens of the context.
+        duplicate_threshold (float): Similarity above which a chunk counts as a near duplicate.
+        chars_per_token (float): Characters per token used to estimate token counts.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 3000,
+        duplicate_threshold: float = 0.9,
+        chars_per_token: float = 4.0,
+    ):
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+        self.chars_per_token = chars_per_token
+        self._lock = threading.Lock()
+        self._stats = {
+            "contexts": 0,
+            "tokens_retrieved": 0,
+            "tokens_used": 0,
+            "tokens_saved": 0,
+            "duplicates_dropped": 0,
+            "chunks_truncated": 0,
+        }
+
+    def estimate_tokens(self, text: str) -> int:
+        """Estimate the number of tokens of a text."""
+        return int(len(text) / self.chars_per_token) + 1
+
+    def build(self, documents: List[Document]) -> str:
+        """Return the context for the documents, in retriever order, within the token budget."""
+        ranked = [doc for doc in documents if doc.page_content]
+        retrieved = sum(self.estimate_tokens(doc.page_content) for doc in ranked)
+
+        kept: List[FrozenSet[int]] = []
+        parts: List[str] = []
+        used = 0
+        duplicates = 0
+        truncated = 0
+        for doc in ranked:
+            doc_shingles = shingles(doc.page_content)
+            if any(jaccard(doc_shingles, other) >= self.duplicate_threshold for other in kept):
+                duplicates += 1
+                continue
+            kept.append(doc_shingles)
+            tokens = self.estimate_tokens(doc.page_content)
+            remaining = self.token_budget - used
+            if tokens <= remaining:
+                parts.append(doc.page_content)
+                used += tokens
+                continue
+            # The highest ranked chunk that does not fit is cut to the rest of the budget, and the context is full
+            if remaining > 0:
+                parts.append(doc.page_content[: int(remaining * self.chars_per_token)])
+                used = self.token_budget
+                truncated += 1
+            break
+
+        self._record(retrieved, used, duplicates, truncated)
+        logging.info(
+            f"Built context of ~{used} tokens from {len(parts)}/{len(documents)} chunks "
+            f"(~{retrieved} tokens retrieved, ~{retrieved - used} saved, {duplicates} near duplicates dropped)."
+        )
+        return SEPARATOR.join(parts)
+
+    def _record(self, retrieved: int, used: int, duplicates: int, truncated: int) -> None:
+        with self._lock:
+            self._stats["contexts"] += 1
+            self._stats["tokens_retrieved"] += retrieved
+            self._stats["tokens_used"] += used
+            self._stats["tokens_saved"] += retrieved - used
+            self._stats["duplicates_dropped"] += duplicates
+            self._stats["chunks_truncated"] += truncated
+
+    def stats(self) -> Dict[str, int]:
+        """Return the cumulative token and chunk counters."""
+        with self._lock:
+            return dict(self._stats)
@@ -1,108 +1,734 @@
+import asyncio
+import hashlib
 import json
 import logging
-import os
-from typing import List
-
-import boto3
-import pymongo
-from langchain.retrievers.merger_retriever import MergerRetriever
-from langchain_aws import BedrockEmbeddings
-from langchain_core.callbacks.manager import CallbackManagerForRetrieverRun
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import bson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from langchain_core.callbacks.manager import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
 from langchain_core.documents import Document
 from langchain_core.retrievers import BaseRetriever
-from langchain_mongodb import MongoDBAtlasVectorSearch
-from pymongo.collection import Collection
 
+from app.clients import registry
+from app.reranker import EMBEDDING_FIELD, mmr_rerank
+
+# Constant of the reciprocal rank fusion formula 1 / (RRF_K + rank)
+RRF_K = 60
+# Largest numCandidates accepted by $vectorSearch
+MAX_NUM_CANDIDATES = 10000
+# Options of a data source's retrieval config and their expected types
+RETRIEVAL_OPTIONS = {"k": int, "numCandidates": int, "minScore": (int, float), "filter": dict}
+# Query operators supported in $vectorSearch pre-filters
+FIELD_OPERATORS = {"$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin", "$not", "$exists"}
+LOGICAL_OPERATORS = {"$and", "$or", "$nor"}
+
+search_executor = ThreadPoolExecutor(thread_name_prefix="vector-search")
+
+# Results are received as raw BSON so that their size and decode time can be measured
+RAW_BSON_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+
+@dataclass(frozen=True)
+class DataSource:
+    """Location and field names of a collection that can be searched by the retriever."""
+
+    database: str
+    collection: str
+    index_name: str
+    text_key: str
+    embedding_key: str
+    metadata_fields: Tuple[str, ...] = ()
+    text_index_name: Optional[str] = None
+    filter_fields: Tuple[str, ...] = ()
+
+
+@dataclass
+class SearchStats:
+    """Size of the search results received from MongoDB and the time spent decoding them."""
+
+    payload_bytes: int = 0
+    decode_ms: float = 0.0
+
+    def add(self, other: "SearchStats") -> None:
+        self.payload_bytes += other.payload_bytes
+        self.decode_ms += other.decode_ms
+
+
+@dataclass(frozen=True)
+class SourceSearch:
+    """
+    Search parameters of one data source for one query: the number of results, the number of ANN
+    candidates, the minimum vector search score and the `$vectorSearch` pre-filter.
+    """
+
+    name: str
+    k: int
+    num_candidates: int
+    min_score: Optional[float] = None
+    pre_filter: Optional[Dict[str, Any]] = None
+
+
+DATA_SOURCES = {
+    "Trip Recommendations": DataSource(
+        database="travel_agency",
+        collection="trip_recommendation",
+        index_name="vector_index",
+        text_key="About Place",
+        embedding_key="details_embedding",
+        text_index_name="text_index",
+    ),
+    "User Uploaded Data": DataSource(
+        database="maap_data_loader",
+        collection="document",
+        index_name="document_vector_index",
+        text_key="document_text",
+        embedding_key="document_embedding",
+        metadata_fields=("userId", "source", "filename", "page_number", "url"),
+        text_index_name="document_text_index",
+        filter_fields=("userId", "source"),
+    ),
+}
+
+
+def vector_search_pipeline(
+    source: DataSource,
+    query_vector: List[float],
+    k: int = 10,
+    pre_filter: Optional[Dict[str, Any]] = None,
+    include_embedding: bool = False,
+    num_candidates: Optional[int] = None,
+    min_score: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Build the `$vectorSearch` aggregation for a data source. Only the text, the score and the metadata
+    fields of the data source are returned, and the embedding only when `include_embedding` is set.
+    `num_candidates` defaults to 10 * k. Results scoring below `min_score` are dropped on the server.
+    """
+    vector_search = {
+        "index": source.index_name,
+        "path": source.embedding_key,
+        "queryVector": query_vector,
+        "numCandidates": num_candidates or k * 10,
+        "limit": k,
+    }
+    if pre_filter:
+        vector_search["filter"] = pre_filter
+    pipeline = [
+        {"$vectorSearch": vector_search},
+        {"$set": {"score": {"$meta": "vectorSearchScore"}}},
+    ]
+    if min_score is not None:
+        pipeline.append({"$match": {"score": {"$gte": min_score}}})
+    return pipeline + [
+        {
+            "$project": {
+                source.text_key: 1,
+                "score": 1,
+                **{field: 1 for field in source.metadata_fields},
+                **({source.embedding_key: 1} if include_embedding else {}),
+            }
+        },
+    ]
+
+
+def union_search_pipeline(
+    searches: List[SourceSearch],
+    query_vector: List[float],
+    k: int = 10,
+    include_embedding: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    Build a single aggregation that searches several data sources: `$vectorSearch` on the first one and a
+    `$unionWith` per additional one, followed by a server-side sort and limit on the vector search score.
+    Every result is tagged with the name of its data source in the `data_source` field.
+
+    `$unionWith` only reaches collections of the same database, so all data sources must share one.
+    """
+    pipelines = [
+        vector_search_pipeline(
+            DATA_SOURCES[search.name],
+            query_vector,
+            k=search.k,
+            pre_filter=search.pre_filter,
+            include_embedding=include_embedding,
+            num_candidates=search.num_candidates,
+            min_score=search.min_score,
+        )
+        + [{"$set": {"data_source": search.name}}]
+        for search in searches
+    ]
+    pipeline = pipelines[0]
+    for search, union_pipeline in zip(searches[1:], pipelines[1:]):
+        pipeline.append(
+            {
+                "$unionWith": {
+                    "coll": DATA_SOURCES[search.name].collection,
+                    "pipeline": union_pipeline,
+                }
+            }
+        )
+    pipeline.extend([{"$sort": {"score": -1}}, {"$limit": k}])
+    return pipeline
+
+
+def rank_stages(score_field: str) -> List[Dict[str, Any]]:
+    """Stages that set `score_field` of the sorted results to their reciprocal rank fusion score."""
+    return [
+        {"$group": {"_id": None, "docs": {"$push": "$$ROOT"}}},
+        {"$unwind": {"path": "$docs", "includeArrayIndex": "rank"}},
+        {
+            "$replaceWith": {
+                "$mergeObjects": [
+                    "$docs",
+                    {score_field: {"$divide": [1.0, {"$add": ["$rank", RRF_K + 1]}]}},
+                ]
+            }
+        },
+    ]
+
+
+def field_search_clauses(path: str, condition: Any) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+    """
+    Translate the MQL condition of one field to `compound` clauses of Atlas Search operators: `equals`,
+    `in`, `range` and `exists` in "filter", and their negations in "mustNot". None when it has no
+    equivalent.
+    """
+    if not isinstance(condition, dict):
+        condition = {"$eq": condition}
+    clauses = {"filter": [], "mustNot": []}
+    bounds = {}
+    for operator, value in condition.items():
+        if operator in ("$eq", "$ne"):
+            if value is None or isinstance(value, (dict, list)):
+                return None
+            clauses["filter" if operator == "$eq" else "mustNot"].append({"equals": {"path": path, "value": value}})
+        elif operator in ("$in", "$nin"):
+            if not isinstance(value, list) or not value or any(item is None for item in value):
+                return None
+            clauses["filter" if operator == "$in" else "mustNot"].append({"in": {"path": path, "value": value}})
+        elif operator in ("$gt", "$gte", "$lt", "$lte"):
+            bounds[operator[1:]] = value
+        elif operator == "$exists":
+            clauses["filter" if value else "mustNot"].append({"exists": {"path": path}})
+        else:
+            return None
+    if bounds:
+        clauses["filter"].append({"range": {"path": path, **bounds}})
+    return clauses
+
+
+def compound_operator(clauses: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Any]:
+    """The single operator of "filter" clauses, or their `compound`."""
+    if len(clauses["filter"]) == 1:
+        return clauses["filter"][0]
+    return {"compound": {"filter": clauses["filter"]}}
+
+
+def search_filter_clauses(pre_filter: Dict[str, Any]) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+    """
+    Translate a `$vectorSearch` pre-filter to the "filter" and "mustNot" clauses of a `$search` `compound`
+    operator, so that the full-text search only scores the documents the filter allows. `$or` and `$nor`
+    are translated when their clauses have no negation. None when the filter has no equivalent.
+    """
+    clauses = {"filter": [], "mustNot": []}
+    for key, value in pre_filter.items():
+        if key == "$and":
+            parts = [search_filter_clauses(clause) for clause in value]
+        elif key in ("$or", "$nor"):
+            parts = [search_filter_clauses(clause) for clause in value]
+            if any(part is None or part["mustNot"] or not part["filter"] for part in parts):
+                return None
+            operators = [compound_operator(part) for part in parts]
+            if key == "$or":
+                parts = [{"filter": [{"compound": {"should": operators, "minimumShouldMatch": 1}}], "mustNot": []}]
+            else:
+                parts = [{"filter": [], "mustNot": operators}]
+        else:
+            parts = [field_search_clauses(key, value)]
+        if any(part is None for part in parts):
+            return None
+        for part in parts:
+            clauses["filter"].extend(part["filter"])
+            clauses["mustNot"].extend(part["mustNot"])
+    return clauses
+
+
+def hybrid_search_pipeline(
+    source: DataSource,
+    query: str,
+    query_vector: List[float],
+    k: int = 10,
+    pre_filter: Optional[Dict[str, Any]] = None,
+    include_embedding: bool = False,
+    num_candidates: Optional[int] = None,
+    min_score: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Build a single aggregation that runs `$vectorSearch` and a full-text `$search` on a data source and
+    fuses the two rankings with reciprocal rank fusion on the server. The full-text leg runs in a
+    `$unionWith` on the same collection, each leg ranks its top k, and the results are grouped by `_id`
+    with the sum of their `vector_score` and `text_score` as `score`.
+
+    The full-text leg only searches the text field of the data source. `pre_filter` is applied inside its
+    `$search` as `compound` filter clauses, or with `$match` on the full-text matches when it uses
+    operators Atlas Search has no equivalent for. `min_score` only applies to the vector leg.
+    """
+    fields = {
+        source.text_key: 1,
+        **{field: 1 for field in source.metadata_fields},
+        **({source.embedding_key: 1} if include_embedding else {}),
+    }
+    vector_leg = vector_search_pipeline(
+        source,
+        query_vector,
+        k=k,
+        pre_filter=pre_filter,
+        include_embedding=include_embedding,
+        num_candidates=num_candidates,
+        min_score=min_score,
+    )
+    text_search = {"text": {"query": query, "path": source.text_key}}
+    filter_clauses = search_filter_clauses(pre_filter) if pre_filter else None
+    if filter_clauses:
+        compound = {"must": [text_search]}
+        compound.update({clause: operators for clause, operators in filter_clauses.items() if operators})
+        text_search = {"compound": compound}
+    text_leg = [{"$search": {"index": source.text_index_name, **text_search}}]
+    if pre_filter and filter_clauses is None:
+        text_leg.append({"$match": pre_filter})
+    text_leg.extend([{"$limit": k}, {"$project": fields}])
+    return (
+        vector_leg
+        + rank_stages("vector_score")
+        + [
+            {"$unionWith": {"coll": source.collection, "pipeline": text_leg + rank_stages("text_score")}},
+            {
+                "$group": {
+                    "_id": "$_id",
+                    "doc": {"$first": "$$ROOT"},
+                    "vector_score": {"$max": "$vector_score"},
+                    "text_score": {"$max": "$text_score"},
+                }
+            },
+            {
+                "$replaceWith": {
+                    "$mergeObjects": [
+                        "$doc",
+                        {
+                            "vector_score": {"$ifNull": ["$vector_score", 0]},
+                            "text_score": {"$ifNull": ["$text_score", 0]},
+                        },
+                    ]
+                }
+            },
+            {"$set": {"score": {"$add": ["$vector_score", "$text_score"]}}},
+            {"$sort": {"score": -1}},
+            {"$limit": k},
+        ]
+    )
+
+
+def decode_results(
+    raw_results: List[RawBSONDocument], stats: SearchStats
+) -> List[Dict[str, Any]]:
+    """Decode raw BSON search results, recording their size and the decode time in `stats`."""
+    start = time.perf_counter()
+    results = []
+    for raw_result in raw_results:
+        stats.payload_bytes += len(raw_result.raw)
+        results.append(bson.decode(raw_result.raw))
+    stats.decode_ms += (time.perf_counter() - start) * 1000
+    return results
+
+
+def to_document(result: Dict[str, Any], source: DataSource) -> Document:
+    """Convert an aggregation result to a LangChain document. A fetched embedding is kept in "embedding"."""
+    text = result.pop(source.text_key, None)
+    if source.embedding_key in result:
+        result[EMBEDDING_FIELD] = result.pop(source.embedding_key)
+    if "_id" in result:
+        result["_id"] = str(result["_id"])
+    return Document(page_content=text, metadata=result)
 
-# Setup AWS and Bedrock client
-def get_bedrock_client():
-    return boto3.client("bedrock-runtime", region_name="us-east-1")
 
+def valid_filter(pre_filter: Any, fields: Tuple[str, ...]) -> bool:
+    """Whether a filter only uses operators supported by `$vectorSearch` on indexed filter fields."""
+    if not isinstance(pre_filter, dict):
+        return False
+    for key, value in pre_filter.items():
+        if key in LOGICAL_OPERATORS:
+            if not isinstance(value, list) or not value:
+                return False
+            if not all(valid_filter(clause, fields) for clause in value):
+                return False
+        elif key not in fields:
+            return False
+        elif isinstance(value, dict) and not set(value) <= FIELD_OPERATORS:
+            return False
+    return True
 
-def create_embeddings(client):
-    return BedrockEmbeddings(model_id="amazon.titan-embed-text-v1", client=client)
 
+def valid_config(name: str, config: Any) -> Dict[str, Any]:
+    """Return the options of a retrieval config that have the expected type, the others are logged and ignored."""
+    if not isinstance(config, dict):
+        logging.warning(f"Ignoring retrieval config of {name}, it is not an object: {config!r}")
+        return {}
+    valid = {}
+    for option, value in config.items():
+        expected = RETRIEVAL_OPTIONS.get(option)
+        # bool is a subclass of int, but never a valid k, numCandidates or minScore
+        if expected is None or isinstance(value, bool) or not isinstance(value, expected):
+            logging.warning(f"Ignoring retrieval option {option}={value!r} of {name}.")
+            continue
+        if option == "filter" and not valid_filter(value, DATA_SOURCES[name].filter_fields):
+            logging.warning(
+                f"Ignoring filter {value!r} of {name}, it can only use the filter fields "
+                f"{DATA_SOURCES[name].filter_fields} of the vector index."
+            )
+            continue
+        valid[option] = value
+    return valid
+
+
+def source_search(
+    name: str,
+    k: int,
+    config: Optional[Dict[str, Any]] = None,
+    user_filter: Optional[Dict[str, Any]] = None,
+    max_k: int = 100,
+) -> SourceSearch:
+    """
+    Build the search parameters of a data source from its retrieval config, which can set "k",
+    "numCandidates", "minScore" and a "filter" in MQL. k is clamped to [1, max_k]. The filter is combined
+    with `user_filter`, so it can only narrow the documents a user is allowed to see.
+    """
+    config = valid_config(name, config)
+    source_k = min(max(config.get("k", k), 1), max_k)
+    num_candidates = config.get("numCandidates", source_k * 10)
+    # $vectorSearch rejects a limit above numCandidates and more than MAX_NUM_CANDIDATES candidates
+    num_candidates = min(max(num_candidates, source_k), MAX_NUM_CANDIDATES)
+    min_score = config.get("minScore")
+    filters = [f for f in (user_filter, config.get("filter")) if f]
+    if len(filters) > 1:
+        pre_filter = {"$and": filters}
+    else:
+        pre_filter = filters[0] if filters else None
+    return SourceSearch(
+        name=name,
+        k=source_k,
+        num_candidates=num_candidates,
+        min_score=float(min_score) if min_score is not None else None,
+        pre_filter=pre_filter,
+    )
+
+
+def merge_results(
+    results: List[List[Document]], k: int, strategy: str = "score"
+) -> List[Document]:
+    """
+    Merge the ranked results of several data sources into a single global top-k.
 
-# Initialize everything
-bedrock_client = get_bedrock_client()
-bedrock_embeddings = create_embeddings(bedrock_client)
+    With the "score" strategy documents are ordered by their vector search score. Atlas normalizes cosine
+    scores to [0, 1] for every index, so scores of different collections are directly comparable. With the
+    "rrf" strategy documents are ordered by their reciprocal rank fusion score, which only depends on the
+    rank of a document within its own data source. Documents with the same text are kept once.
+    """
+    fused: Dict[str, Tuple[float, Document]] = {}
+    for docs in results:
+        for rank, doc in enumerate(docs):
+            if strategy == "rrf":
+                score = 1.0 / (RRF_K + rank + 1)
+            else:
+                score = doc.metadata.get("score", 0.0)
+            key = hashlib.sha256((doc.page_content or "").encode("utf-8")).hexdigest()
+            if key in fused:
+                previous_score, previous_doc = fused[key]
+                # The same text found through several sources is more relevant under rank fusion
+                score = previous_score + score if strategy == "rrf" else max(previous_score, score)
+                doc = previous_doc
+            fused[key] = (score, doc)
+    ranked = sorted(fused.values(), key=lambda item: item[0], reverse=True)
+    return [doc for _, doc in ranked[:k]]
 
 
 class MongoDBAtlasCustomRetriever(BaseRetriever):
+    """
+    Retriever that fans a query out to the selected MongoDB Atlas collections in parallel and merges their
+    results into a single ranked list.
+
+    Attributes:
+        k (int): Number of documents fetched from every data source and returned after the merge, unless
+            the retrieval config of a data source sets its own k.
+        merge_strategy (str): "score" to merge by similarity score, "rrf" for reciprocal rank fusion.
+        source_timeout (float): Seconds to wait for the data sources. The results of the sources that
+            answered in time are returned when another one is late or fails.
+        search_mode (str): "fanout" to send one query per data source, "union" to search all data sources
+            with a single `$unionWith` aggregation. The union mode needs the data sources to live in the
+            same database and falls back to "fanout" otherwise. "hybrid" sends one query per data source
+            that fuses vector and full-text search results with reciprocal rank fusion, for data sources
+            with a text index, and ranks by vector search score alone for the others.
+        rerank (Optional[str]): "mmr" to fetch `candidate_k` candidates with their embeddings and rerank
+            them to k with maximal marginal relevance, None to return the ANN top-k.
+        candidate_k (int): Number of candidates fetched per data source and merged when reranking.
+        mmr_lambda (float): Weight of query relevance against diversity in the MMR score.
+        rerank_budget_ms (float): Latency budget of the reranking, the ANN order is used when it is exceeded.
+        source_config (Dict[str, Dict[str, Any]]): Default retrieval config per data source name, with the
+            optional keys "k", "numCandidates", "minScore" and "filter". A query can override it per data
+            source in its "retrieval" field.
+        max_k (int): Largest number of documents fetched from a data source, whatever k, candidate_k or a
+            retrieval config ask for.
+    """
+
+    k: int = 10
+    merge_strategy: str = "score"
+    source_timeout: float = 5.0
+    search_mode: str = "fanout"
+    rerank: Optional[str] = None
+    candidate_k: int = 100
+    mmr_lambda: float = 0.5
+    rerank_budget_ms: float = 20.0
+    source_config: Dict[str, Dict[str, Any]] = {}
+    max_k: int = 100
+
     @property
-    def collection(self) -> Collection:
-        return self.vectorstore._collection
+    def _fetch_k(self) -> int:
+        return max(self.k, self.candidate_k) if self.rerank == "mmr" else self.k
 
-    def _get_relevant_documents(
-        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
-    ) -> List[Document]:
-        """Retrieve documents that are highest scoring / most similar to query."""
-        MONGODB_URI = os.getenv("MONGODB_URI")
-        # Initialize everything
-        bedrock_client = get_bedrock_client()
-        bedrock_embeddings = create_embeddings(bedrock_client)
-        # Connect to the MongoDB database
-        mongoDBClient = pymongo.MongoClient(host=MONGODB_URI)
-        logging.info("Connected to MongoDB...")
-
-        database = mongoDBClient["travel_agency"]
-        collection = database["trip_recommendation"]
-
-        vector_store = MongoDBAtlasVectorSearch(
-            text_key="About Place",
-            embedding_key="details_embedding",
-            index_name="vector_index",
-            embedding=bedrock_embeddings,
-            collection=collection,
+    def _rerank(self, query_vector: List[float], documents: List[Document]) -> List[Document]:
+        if self.rerank != "mmr":
+            return documents
+        return mmr_rerank(
+            query_vector,
+            documents,
+            k=self.k,
+            mmr_lambda=self.mmr_lambda,
+            budget_ms=self.rerank_budget_ms,
         )
 
-        database_doc = mongoDBClient["maap_data_loader"]
-        collection_doc = database_doc["document"]
-        vector_store_documents = MongoDBAtlasVectorSearch(
-            text_key="document_text",
-            embedding_key="document_embedding",
-            index_name="document_vector_index",
-            embedding=bedrock_embeddings,
-            collection=collection_doc,
+    def _searches(self, inputs: Dict[str, Any]) -> List[SourceSearch]:
+        overrides = inputs.get("retrieval") or {}
+        if not isinstance(overrides, dict):
+            logging.warning(f"Ignoring retrieval config of the query, it is not an object: {overrides!r}")
+            overrides = {}
+        searches = []
+        for name in inputs["dataSource"]:
+            if name not in DATA_SOURCES:
+                continue
+            user_filter = None
+            if name == "User Uploaded Data" and len(inputs["userId"]) > 0:
+                user_filter = {"userId": inputs["userId"]}
+            config = {
+                **valid_config(name, self.source_config.get(name, {})),
+                **valid_config(name, overrides.get(name, {})),
+            }
+            searches.append(source_search(name, self._fetch_k, config, user_filter, self.max_k))
+        return searches
+
+    @staticmethod
+    def _merge_k(searches: List[SourceSearch]) -> int:
+        return max(search.k for search in searches)
+
+    def _use_union(self, searches: List[SourceSearch]) -> bool:
+        if self.search_mode != "union" or len(searches) < 2:
+            return False
+        databases = {DATA_SOURCES[search.name].database for search in searches}
+        if len(databases) > 1:
+            logging.warning("Data sources are in different databases, using fan-out search.")
+            return False
+        return True
+
+    def _union_documents(
+        self, raw_results: List[RawBSONDocument], k: int, stats: SearchStats
+    ) -> List[Document]:
+        docs = [
+            to_document(result, DATA_SOURCES[result["data_source"]])
+            for result in decode_results(raw_results, stats)
+        ]
+        return merge_results([docs], k=k)
+
+    def _pipeline(
+        self, search: SourceSearch, query: str, query_vector: List[float]
+    ) -> List[Dict[str, Any]]:
+        source = DATA_SOURCES[search.name]
+        options = {
+            "k": search.k,
+            "pre_filter": search.pre_filter,
+            "include_embedding": self.rerank == "mmr",
+            "num_candidates": search.num_candidates,
+            "min_score": search.min_score,
+        }
+        if self.search_mode == "hybrid" and source.text_index_name:
+            return hybrid_search_pipeline(source, query, query_vector, **options)
+        return vector_search_pipeline(source, query_vector, **options)
+
+    def _log_search(
+        self, documents: List[Document], start: float, use_union: bool, stats: SearchStats
+    ) -> None:
+        logging.info(
+            f"Retrieved {len(documents)} documents in {(time.perf_counter() - start) * 1000:.1f} ms "
+            f"({'union' if use_union else self.search_mode}), {stats.payload_bytes} bytes of results "
+            f"decoded in {stats.decode_ms:.2f} ms."
         )
 
-        retriever_travels = vector_store.as_retriever(
-            search_type="similarity",
-            search_kwargs={"score_threshold": 0.9, "k": 10},
+    def _search(
+        self,
+        search: SourceSearch,
+        query: str,
+        query_vector: List[float],
+        stats: SearchStats,
+    ) -> List[Document]:
+        source = DATA_SOURCES[search.name]
+        collection = registry.mongo_client[source.database].get_collection(
+            source.collection, codec_options=RAW_BSON_OPTIONS
         )
+        cursor = collection.aggregate(self._pipeline(search, query, query_vector))
+        return [to_document(result, source) for result in decode_results(list(cursor), stats)]
 
-        retriever_user_docs = vector_store_documents.as_retriever(
-            search_type="similarity",
-            search_kwargs={"score_threshold": 0.9, "k": 10},
+    async def _asearch(
+        self,
+        search: SourceSearch,
+        query: str,
+        query_vector: List[float],
+        stats: SearchStats,
+    ) -> List[Document]:
+        source = DATA_SOURCES[search.name]
+        collection = registry.async_mongo_client[source.database].get_collection(
+            source.collection, codec_options=RAW_BSON_OPTIONS
         )
+        cursor = await collection.aggregate(self._pipeline(search, query, query_vector))
+        raw_results = await cursor.to_list(None)
+        return [to_document(result, source) for result in decode_results(raw_results, stats)]
 
+    @staticmethod
+    def _source_results(searches: List[SourceSearch], futures: List[Any], done: Set[Any]) -> List[List[Document]]:
+        """
+        Results of the data sources whose search finished in time, from their futures or asyncio tasks. A data
+        source whose search failed is logged and left out like a late one, so that one failing source does not
+        fail the whole query.
+        """
+        results = []
+        failed = []
+        for search, future in zip(searches, futures):
+            if future not in done:
+                continue
+            error = future.exception()
+            if error is not None:
+                logging.error(f"Search of {search.name} failed, merging the other data sources: {error!r}")
+                failed.append(search.name)
+                continue
+            results.append(future.result())
+        if failed and not results:
+            logging.warning(f"All searched data sources failed: {failed}")
+        return results
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        """Retrieve documents that are highest scoring / most similar to query."""
         inputs = json.loads(query)
-        if len(inputs["userId"]) > 0:
-            retriever_user_docs = vector_store_documents.as_retriever(
-                search_type="similarity",
-                search_kwargs={
-                    "score_threshold": 0.9,
-                    "k": 10,
-                    "pre_filter": {"userId": inputs["userId"]},
-                },
-            )
+        searches = self._searches(inputs)
+        if not searches:
+            return []
 
-        retrievers = None
-        if (
-            len(inputs["dataSource"]) > 0
-        ):  # ["Trip Recommendations", "User Uploaded Data"]
-            if len(inputs["dataSource"]) == 1:
-                if inputs["dataSource"][0] == "Trip Recommendations":
-                    retrievers = retriever_travels
-                else:
-                    retrievers = retriever_user_docs
-            elif len(inputs["dataSource"]) > 1:
-                retrievers = MergerRetriever(
-                    retrievers=[retriever_user_docs, retriever_travels]
+        start = time.perf_counter()
+        stats = SearchStats()
+        query_vector = registry.embeddings.embed_query(inputs["query"])
+        use_union = self._use_union(searches)
+        if use_union:
+            source = DATA_SOURCES[searches[0].name]
+            collection = registry.mongo_client[source.database].get_collection(
+                source.collection, codec_options=RAW_BSON_OPTIONS
+            )
+            cursor = collection.aggregate(
+                union_search_pipeline(
+                    searches,
+                    query_vector,
+                    k=self._merge_k(searches),
+                    include_embedding=self.rerank == "mmr",
                 )
+            )
+            documents = self._union_documents(list(cursor), self._merge_k(searches), stats)
         else:
-            return ""
+            source_stats = [SearchStats() for _ in searches]
+            futures = [
+                search_executor.submit(
+                    self._search, search, inputs["query"], query_vector, search_stats
+                )
+                for search, search_stats in zip(searches, source_stats)
+            ]
+            done, not_done = wait(futures, timeout=self.source_timeout)
+            for future in not_done:
+                future.cancel()
+            if not_done:
+                logging.warning(f"{len(not_done)} data source(s) timed out, merging partial results.")
+            documents = merge_results(
+                self._source_results(searches, futures, done),
+                k=self._merge_k(searches),
+                strategy=self.merge_strategy,
+            )
+            for search_stats in source_stats:
+                stats.add(search_stats)
+        documents = self._rerank(query_vector, documents)
+        self._log_search(documents, start, use_union, stats)
+        return documents
 
-        documents = retrievers.invoke(inputs["query"])
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        """Asynchronously retrieve documents, searching all selected data sources concurrently."""
+        inputs = json.loads(query)
+        searches = self._searches(inputs)
+        if not searches:
+            return []
 
+        start = time.perf_counter()
+        stats = SearchStats()
+        query_vector = await registry.embeddings.aembed_query(inputs["query"])
+        use_union = self._use_union(searches)
+        if use_union:
+            source = DATA_SOURCES[searches[0].name]
+            collection = registry.async_mongo_client[source.database].get_collection(
+                source.collection, codec_options=RAW_BSON_OPTIONS
+            )
+            cursor = await collection.aggregate(
+                union_search_pipeline(
+                    searches,
+                    query_vector,
+                    k=self._merge_k(searches),
+                    include_embedding=self.rerank == "mmr",
+                )
+            )
+            documents = self._union_documents(
+                await cursor.to_list(None), self._merge_k(searches), stats
+            )
+        else:
+            source_stats = [SearchStats() for _ in searches]
+            tasks = [
+                asyncio.create_task(
+                    self._asearch(search, inputs["query"], query_vector, search_stats)
+                )
+                for search, search_stats in zip(searches, source_stats)
+            ]
+            done, pending = await asyncio.wait(tasks, timeout=self.source_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logging.warning(f"{len(pending)} data source(s) timed out, merging partial results.")
+            documents = merge_results(
+                self._source_results(searches, tasks, done),
+                k=self._merge_k(searches),
+                strategy=self.merge_strategy,
+            )
+            for search_stats in source_stats:
+                stats.add(search_stats)
+        documents = self._rerank(query_vector, documents)
+        self._log_search(documents, start, use_union, stats)
         return documents
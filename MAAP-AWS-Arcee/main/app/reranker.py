@@ -0,0 +1,104 @@
+"""
+Maximal marginal relevance (MMR) reranking of retrieved documents.
+
+The retriever can fetch a wider candidate set together with the candidates' embeddings and let this module
+pick the k documents to pass to the LLM. MMR balances the similarity of a document to the query against its
+similarity to the documents already picked, so near-identical chunks do not crowd out other relevant ones.
+The similarities are computed with NumPy, to the query in one batch and to each picked document as it is
+picked. When the embeddings are missing or reranking runs over its latency budget, the candidates are
+returned in their ANN order instead.
+
+Most of the reranking time goes to converting the embeddings decoded from the collection. With embeddings
+stored as arrays of doubles, each candidate costs about 60-70 µs, so about 250 candidates fit in the default
+20 ms budget. Embeddings stored as float32 or int8 BSON binary vectors (`mongodb_migrate_vectors.py`) are
+read in place, and about 1000 candidates fit. Measured with `benchmarks/rerank.py synthetic`, where a
+lambda of 0.7 kept the near-identical chunks of the ANN top-k and 0.5 with 100 candidates brought 10
+distinct topics into the top 10 instead of 2.
+
+Configuration (environment variables, read by `server.py`):
+    - RETRIEVER_RERANK: "mmr" to enable reranking (default: unset, disabled).
+    - RETRIEVER_CANDIDATE_K: Number of candidates fetched for reranking (default: 100).
+    - RETRIEVER_MMR_LAMBDA: Weight of query relevance against diversity, between 0 and 1 (default: 0.5).
+    - RETRIEVER_RERANK_BUDGET_MS: Latency budget of the reranking (default: 20).
+"""
+import logging
+import time
+from typing import Any, List, Optional
+
+import numpy as np
+from bson.binary import VECTOR_SUBTYPE, Binary, BinaryVectorDtype
+from langchain_core.documents import Document
+
+EMBEDDING_FIELD = "embedding"
+# NumPy types of the BSON binary vector formats that are read in place, after their 2 byte header
+BINARY_VECTOR_DTYPES = {BinaryVectorDtype.INT8.value[0]: np.int8, BinaryVectorDtype.FLOAT32.value[0]: np.dtype("<f4")}
+
+
+def unpack_embedding(embedding: Any) -> Any:
+    """Read a BSON binary vector as an array, int8 and float32 vectors without a copy. Arrays are returned as is."""
+    if not isinstance(embedding, Binary):
+        return embedding
+    dtype = BINARY_VECTOR_DTYPES.get(embedding[0]) if embedding.subtype == VECTOR_SUBTYPE else None
+    if dtype is None:
+        return embedding.as_vector().data
+    return np.frombuffer(embedding, dtype=dtype, offset=2)
+
+
+def pop_embeddings(documents: List[Document]) -> Optional[np.ndarray]:
+    """
+    Remove the embeddings from the documents' metadata and return them as a matrix, one row per document,
+    or None when a document has no embedding. Embeddings stored as BSON binary vectors are unpacked.
+    """
+    embeddings = [doc.metadata.pop(EMBEDDING_FIELD, None) for doc in documents]
+    if not embeddings or any(embedding is None for embedding in embeddings):
+        return None
+    return np.asarray([unpack_embedding(embedding) for embedding in embeddings], dtype=np.float32)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def mmr_rerank(
+    query_vector: List[float],
+    documents: List[Document],
+    k: int,
+    mmr_lambda: float = 0.5,
+    budget_ms: float = 20.0,
+) -> List[Document]:
+    """
+    Pick k of the documents by maximal marginal relevance. The documents must be in ANN order and carry
+    their embedding in the "embedding" metadata field, which is removed from every document.
+    """
+    start = time.perf_counter()
+    deadline = start + budget_ms / 1000
+    embeddings = pop_embeddings(documents)
+    if embeddings is None or len(documents) <= 1:
+        return documents[:k]
+
+    vectors = normalize(embeddings)
+    query = normalize(np.asarray(query_vector, dtype=np.float32))
+    relevance = vectors @ query
+
+    # Only the similarities to the k picked documents are needed, not the full candidate matrix
+    selected = [int(np.argmax(relevance))]
+    max_similarity = vectors @ vectors[selected[0]]
+    available = np.ones(len(documents), dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < min(k, len(documents)):
+        if time.perf_counter() > deadline:
+            logging.warning(f"MMR reranking exceeded its {budget_ms} ms budget, using ANN order.")
+            return documents[:k]
+        scores = mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, vectors @ vectors[best], out=max_similarity)
+
+    logging.info(
+        f"MMR reranked {len(documents)} candidates to {len(selected)} in "
+        f"{(time.perf_counter() - start) * 1000:.2f} ms."
+    )
+    return [documents[i] for i in selected]
@@ -3,13 +3,18 @@ AWS SageMaker LLM Wrapper for LangChain
 Author: Mohammad Daoud Farooqi
 
 This module provides a custom wrapper for integrating AWS SageMaker-hosted language models with LangChain's 
-LLM framework. It supports both synchronous and streaming responses for flexible usage.
+LLM framework. It supports both synchronous and streaming responses for flexible usage, and implements the
+async variants natively with aiobotocore, so that streams served from an event loop do not hold a thread.
 
 Classes:
     - SageMakerLLM: Represents the custom wrapper for a SageMaker endpoint.
+    - StreamDecoder: Incremental decoder of the JSON lines / server-sent events streamed by the endpoint.
+    - EventStreamReader: Incremental reader of the AWS event stream framing of the async response stream.
+    - StopSequenceFilter: Cuts streamed text at the first stop sequence, also when it spans tokens.
 
 Dependencies:
     - boto3: AWS SDK for Python to interact with SageMaker.
+    - aiobotocore: asyncio AWS client for the async calls.
     - langchain_core: Core LangChain components.
     - pydantic: Data validation and management.
 
@@ -19,14 +24,297 @@ Example:
     >>> response = llm.invoke("Tell me a joke.")
     >>> print(response)
 """
+import asyncio
+import binascii
 import json
+import logging
+import struct
+import time
+from contextlib import AsyncExitStack
 import boto3
-from typing import Any, Dict, Iterator, List, Optional
-from pydantic import PrivateAttr
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+from botocore.config import Config
+from botocore.eventstream import ChecksumMismatch
+from botocore.exceptions import EventStreamError
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from pydantic import Field, PrivateAttr
 from langchain_core.language_models.llms import LLM
-from langchain_core.callbacks.manager import CallbackManagerForLLMRun
+from langchain_core.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
 from langchain_core.outputs import GenerationChunk
 
+DEFAULT_STOP = ["<|endoftext|>", "</s>"]
+DEFAULT_SYSTEM_PROMPT = "You are a friendly and helpful AI assistant."
+
+
+class StreamDecoder:
+    """
+    Incremental decoder for the response stream of a SageMaker endpoint.
+
+    Complete lines are split off every payload part at once and only the unfinished last line is kept, so
+    multi-byte UTF-8 characters and JSON lines that are split across parts are handled. Lines may be plain
+    JSON lines or server-sent events ("data: {...}"). The text of every line is taken from
+    `choices[].delta.content`, falling back to `choices[].text` and `choices[].message.content`.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[str]:
+        """
+        Add a payload part and return the text of every line it completes.
+
+        Args:
+            data (bytes): Bytes of the payload part.
+
+        Returns:
+            List[str]: Text of the completed lines, in order.
+        """
+        end = data.rfind(b"\n")
+        if end == -1:
+            self._buffer += data
+            return []
+        if self._buffer:
+            # The unfinished line of the previous parts is only joined with this one when it completes
+            self._buffer += data[:end]
+            lines = self._buffer.split(b"\n")
+            self._buffer = bytearray(data[end + 1 :])
+        else:
+            lines = data[:end].split(b"\n")
+            self._buffer += data[end + 1 :]
+        return self._decode_lines(lines)
+
+    def flush(self) -> List[str]:
+        """
+        Decode what is left in the buffer once the stream has ended.
+
+        Returns:
+            List[str]: Text of the last line, when it was not terminated by a newline.
+        """
+        lines, self._buffer = [self._buffer], bytearray()
+        return self._decode_lines(lines)
+
+    def _decode_lines(self, lines: List[bytes]) -> List[str]:
+        documents = []
+        for line in lines:
+            # Skip the empty lines between server-sent events without a call
+            if len(line) > 1:
+                document = self._json_document(line)
+                if document:
+                    documents.append(document)
+        if not documents:
+            return []
+        # One parse for all the lines a part completed, line by line only when one of them is broken
+        try:
+            payloads = json.loads(documents[0]) if len(documents) == 1 else json.loads("[" + ",".join(documents) + "]")
+        except ValueError:
+            payloads = None
+        if len(documents) == 1:
+            payloads = [payloads] if payloads is not None else self._parse_documents(documents)
+        elif payloads is None or len(payloads) != len(documents):
+            payloads = self._parse_documents(documents)
+        texts = []
+        for payload in payloads:
+            text = self._payload_text(payload)
+            if text:
+                texts.append(text)
+        return texts
+
+    @staticmethod
+    def _json_document(line: bytes) -> Optional[str]:
+        line = line.strip()
+        if line.startswith(b"data:"):
+            line = line[5:].lstrip()
+        elif not line or line.startswith((b":", b"event:", b"id:", b"retry:")):
+            return None
+        if line == b"[DONE]":
+            return None
+        try:
+            # json.loads sniffs the encoding of bytes in Python, decoding first is cheaper
+            return line.decode("utf-8")
+        except UnicodeDecodeError:
+            logging.warning(f"Skipping undecodable stream line: {bytes(line[:200])!r}")
+            return None
+
+    @staticmethod
+    def _parse_documents(documents: List[str]) -> List[Any]:
+        payloads = []
+        for document in documents:
+            try:
+                payloads.append(json.loads(document))
+            except ValueError:
+                logging.warning(f"Skipping undecodable stream line: {document[:200]!r}")
+        return payloads
+
+    @classmethod
+    def _payload_text(cls, payload: Any) -> str:
+        choices = payload.get("choices") if isinstance(payload, dict) else None
+        if not choices:
+            return ""
+        if len(choices) == 1:
+            return cls._choice_text(choices[0])
+        return "".join(cls._choice_text(choice) for choice in choices)
+
+    @staticmethod
+    def _choice_text(choice: Dict[str, Any]) -> str:
+        if choice.get("delta") is not None:
+            return choice["delta"].get("content") or ""
+        if choice.get("text") is not None:
+            return choice["text"]
+        return (choice.get("message") or {}).get("content") or ""
+
+
+class EventStreamReader:
+    """
+    Incremental reader of the AWS event stream framing (application/vnd.amazon.eventstream) of a response.
+
+    botocore parses every message of the stream through the service model, which costs more than decoding
+    the token it carries and, in the async path, runs on the event loop once per token. This reader checks
+    the CRCs and reads the headers of the messages directly, and returns the payloads of every message that
+    a network read completed at once, so that a busy stream is decoded in batches. The headers of the
+    PayloadPart messages of a stream are all the same, so the last parsed ones are reused.
+    """
+
+    PRELUDE_LENGTH = 12
+    # Sizes of the fixed length header value types, by type id
+    HEADER_VALUE_SIZES = {0: 0, 1: 0, 2: 1, 3: 2, 4: 4, 5: 8, 8: 8, 9: 16}
+
+    def __init__(self, operation_name: str = "InvokeEndpointWithResponseStream"):
+        self.operation_name = operation_name
+        self._buffer = bytearray()
+        self._raw_headers = None
+        self._headers = {}
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """
+        Add bytes of the response and return the payloads of the PayloadPart events they complete.
+
+        Args:
+            data (bytes): Bytes read from the response.
+
+        Returns:
+            List[bytes]: Payloads of the completed PayloadPart events, in order.
+
+        Raises:
+            EventStreamError: When the endpoint sent an error or exception message.
+            ChecksumMismatch: When a message is corrupted.
+        """
+        buffer = self._buffer
+        buffer += data
+        payloads = []
+        offset = 0
+        while len(buffer) - offset >= self.PRELUDE_LENGTH:
+            total_length, headers_length, prelude_crc = struct.unpack_from("!III", buffer, offset)
+            if len(buffer) - offset < total_length:
+                break
+            message = bytes(buffer[offset : offset + total_length])
+            offset += total_length
+            self._check_crc(message[:8], prelude_crc)
+            self._check_crc(message[:-4], struct.unpack_from("!I", message, total_length - 4)[0])
+            headers_end = self.PRELUDE_LENGTH + headers_length
+            raw_headers = message[self.PRELUDE_LENGTH : headers_end]
+            if raw_headers != self._raw_headers:
+                self._raw_headers, self._headers = raw_headers, self._parse_headers(raw_headers)
+            headers = self._headers
+            message_type = headers.get(":message-type")
+            if message_type == "event":
+                if headers.get(":event-type") == "PayloadPart":
+                    payloads.append(message[headers_end:-4])
+            elif message_type in ("exception", "error"):
+                raise EventStreamError(self._error(message_type, headers, message[headers_end:-4]), self.operation_name)
+        if offset:
+            del buffer[:offset]
+        return payloads
+
+    @staticmethod
+    def _check_crc(data: bytes, expected: int) -> None:
+        calculated = binascii.crc32(data)
+        if calculated != expected:
+            raise ChecksumMismatch(expected, calculated)
+
+    def _parse_headers(self, data: bytes) -> Dict[str, Any]:
+        headers = {}
+        position = 0
+        while position < len(data):
+            name_length = data[position]
+            name = data[position + 1 : position + 1 + name_length].decode("utf-8")
+            value_type = data[position + 1 + name_length]
+            position += 2 + name_length
+            if value_type in (6, 7):
+                (value_length,) = struct.unpack_from("!H", data, position)
+                value = data[position + 2 : position + 2 + value_length]
+                headers[name] = value.decode("utf-8") if value_type == 7 else value
+                position += 2 + value_length
+            else:
+                position += self.HEADER_VALUE_SIZES[value_type]
+        return headers
+
+    @staticmethod
+    def _error(message_type: str, headers: Dict[str, Any], payload: bytes) -> Dict[str, Any]:
+        """Build the error response botocore would have parsed from an exception or error message."""
+        if message_type == "error":
+            return {"Error": {"Code": headers.get(":error-code", ""), "Message": headers.get(":error-message", "")}}
+        try:
+            body = json.loads(payload) if payload else {}
+        except ValueError:
+            body = {}
+        message = body.get("Message", body.get("message", "")) if isinstance(body, dict) else ""
+        return {"Error": {"Code": headers.get(":exception-type", ""), "Message": message}}
+
+
+class StopSequenceFilter:
+    """
+    Passes streamed text through until the first stop sequence.
+
+    The last few characters are held back until it is clear that they do not start a stop sequence, so
+    that a stop sequence split over several tokens is still found.
+    """
+
+    def __init__(self, stop: List[str]):
+        self.stop = [sequence for sequence in stop if sequence]
+        self.hold = max((len(sequence) for sequence in self.stop), default=1) - 1
+        self.pending = ""
+        self.stopped = False
+
+    def feed(self, text: str) -> str:
+        """
+        Add text and return the part of it that can be emitted.
+
+        Args:
+            text (str): Text of a token.
+
+        Returns:
+            str: Text that is certain not to be part of a stop sequence, empty once stopped.
+        """
+        if self.stopped:
+            return ""
+        pending = self.pending + text
+        stop_at = -1
+        for sequence in self.stop:
+            position = pending.find(sequence)
+            if position != -1 and (stop_at == -1 or position < stop_at):
+                stop_at = position
+        if stop_at != -1:
+            self.stopped = True
+            self.pending = ""
+            return pending[:stop_at]
+        cut = max(0, len(pending) - self.hold)
+        self.pending = pending[cut:]
+        return pending[:cut]
+
+    def flush(self) -> str:
+        """
+        Return the held back text once the stream has ended.
+
+        Returns:
+            str: The remaining text, empty once stopped.
+        """
+        text, self.pending = ("" if self.stopped else self.pending), ""
+        return text
+
 
 class SageMakerLLM(LLM):
     """
@@ -40,6 +328,17 @@ class SageMakerLLM(LLM):
         endpoint_name (str): Name of the SageMaker endpoint.
         region_name (str): AWS region where the SageMaker endpoint is deployed (default: "us-east-1").
         content_type (str): Content type for the payload sent to the SageMaker endpoint (default: "application/json").
+        max_pool_connections (int): Size of the HTTP connection pool to the endpoint (default: 50).
+        connect_timeout (float): Seconds to wait for a connection to the endpoint (default: 5).
+        read_timeout (float): Seconds to wait for data from the endpoint (default: 120).
+        max_attempts (int): Attempts per call, including the first one (default: 3).
+        retry_mode (str): botocore retry mode, "adaptive" also rate limits the client when throttled (default: "adaptive").
+        max_tokens (int): Maximum number of tokens to generate (default: 1024).
+        temperature (float): Sampling temperature (default: 0.7).
+        top_p (float): Nucleus sampling probability mass (default: 0.9).
+        system_prompt (str): System message sent before the prompt.
+        client (Any): Optional preconfigured SageMaker runtime client, e.g. a stubbed one in tests.
+        async_client (Any): Optional preconfigured aiobotocore SageMaker runtime client.
     """
 
     endpoint_name: str
@@ -51,9 +350,52 @@ class SageMakerLLM(LLM):
     content_type: str = "application/json"
     """Content type for the payload sent to the SageMaker endpoint."""
 
+    max_pool_connections: int = 50
+    """Size of the HTTP connection pool to the endpoint."""
+
+    connect_timeout: float = 5.0
+    """Seconds to wait for a connection to the endpoint."""
+
+    read_timeout: float = 120.0
+    """Seconds to wait for data from the endpoint."""
+
+    max_attempts: int = 3
+    """Attempts per call, including the first one."""
+
+    retry_mode: str = "adaptive"
+    """botocore retry mode."""
+
+    max_tokens: int = 1024
+    """Maximum number of tokens to generate."""
+
+    temperature: float = 0.7
+    """Sampling temperature."""
+
+    top_p: float = 0.9
+    """Nucleus sampling probability mass."""
+
+    system_prompt: str = DEFAULT_SYSTEM_PROMPT
+    """System message sent before the prompt."""
+
+    max_starts_per_tick: int = 1
+    """Async calls started per event loop iteration, the others start in the next iterations."""
+
+    client: Optional[Any] = Field(default=None, exclude=True)
+    """Optional preconfigured SageMaker runtime client."""
+
+    async_client: Optional[Any] = Field(default=None, exclude=True)
+    """Optional preconfigured aiobotocore SageMaker runtime client."""
+
     _sagemaker_runtime: boto3.client = PrivateAttr()
     """Private attribute to hold the SageMaker runtime client."""
 
+    _async_sagemaker_runtime: Any = PrivateAttr(default=None)
+    """Private attribute to hold the aiobotocore SageMaker runtime client, created on first use."""
+
+    _async_exit_stack: Optional[AsyncExitStack] = PrivateAttr(default=None)
+    _async_lock: asyncio.Lock = PrivateAttr(default_factory=asyncio.Lock)
+    _start_slots: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = PrivateAttr(default=None)
+
     def __init__(self, **data: Any):
         """
         Initialize the SageMakerLLM instance.
@@ -62,9 +404,67 @@ class SageMakerLLM(LLM):
             **data: Arbitrary keyword arguments for initialization.
         """
         super().__init__(**data)
-        self._sagemaker_runtime = boto3.client(
-            "sagemaker-runtime", region_name=self.region_name
+        self._sagemaker_runtime = self.client or boto3.client(
+            "sagemaker-runtime",
+            region_name=self.region_name,
+            config=Config(
+                max_pool_connections=self.max_pool_connections,
+                connect_timeout=self.connect_timeout,
+                read_timeout=self.read_timeout,
+                retries={"max_attempts": self.max_attempts, "mode": self.retry_mode},
+            ),
         )
+        self._async_sagemaker_runtime = self.async_client
+
+    async def _async_runtime(self):
+        """
+        Return the aiobotocore SageMaker runtime client, creating it on first use.
+
+        Returns:
+            The async client, configured like the synchronous one.
+        """
+        if self._async_sagemaker_runtime is None:
+            async with self._async_lock:
+                if self._async_sagemaker_runtime is None:
+                    exit_stack = AsyncExitStack()
+                    self._async_sagemaker_runtime = await exit_stack.enter_async_context(
+                        get_session().create_client(
+                            "sagemaker-runtime",
+                            region_name=self.region_name,
+                            config=AioConfig(
+                                max_pool_connections=self.max_pool_connections,
+                                connect_timeout=self.connect_timeout,
+                                read_timeout=self.read_timeout,
+                                retries={"max_attempts": self.max_attempts, "mode": self.retry_mode},
+                            ),
+                        )
+                    )
+                    self._async_exit_stack = exit_stack
+        return self._async_sagemaker_runtime
+
+    async def _start_slot(self) -> None:
+        """
+        Wait for a slot to start an async call.
+
+        aiobotocore takes a few milliseconds of CPU to build, sign and send a request, so hundreds of streams
+        started together would hold the event loop for as many milliseconds. A slot is handed back on the
+        next event loop iteration, so at most `max_starts_per_tick` calls start per iteration and a burst is
+        spread over several iterations, in arrival order, between which the running streams are served.
+        """
+        loop = asyncio.get_running_loop()
+        if self._start_slots is None or self._start_slots[0] is not loop:
+            self._start_slots = (loop, asyncio.Semaphore(self.max_starts_per_tick))
+        slots = self._start_slots[1]
+        await slots.acquire()
+        loop.call_soon(slots.release)
+
+    async def aclose(self) -> None:
+        """Close the aiobotocore client and its connection pool, if it was created."""
+        async with self._async_lock:
+            if self._async_exit_stack is not None:
+                await self._async_exit_stack.aclose()
+                self._async_exit_stack = None
+                self._async_sagemaker_runtime = self.async_client
 
     def _call(
         self,
@@ -84,25 +484,20 @@ class SageMakerLLM(LLM):
         Returns:
             str: The model's response as a string.
         """
-        input_data = {
-            "messages": [
-                {"role": "system", "content": "You are a friendly and helpful AI assistant."},
-                {"role": "user", "content": prompt},
-            ],
-            "max_tokens": 1024,
-            "temperature": 0.7,
-            "top_p": 0.9,
-            "stop": ["<|endoftext|>", "</s>"],
-        }
-        payload = json.dumps(input_data)
-
+        start = time.perf_counter()
         response = self._sagemaker_runtime.invoke_endpoint(
             EndpointName=self.endpoint_name,
             ContentType=self.content_type,
-            Body=payload,
+            Body=self._payload(prompt, stop, **kwargs),
         )
+        first_byte = time.perf_counter()
         result = json.loads(response["Body"].read().decode("utf-8"))
-        return result["choices"][0]["message"]["content"]
+        stop_filter = StopSequenceFilter(DEFAULT_STOP + (stop or []))
+        text = stop_filter.feed(result["choices"][0]["message"]["content"]) + stop_filter.flush()
+        self._log_metrics(
+            "invoke", start, first_byte, result.get("usage", {}).get("completion_tokens")
+        )
+        return text
 
     def _stream(
         self,
@@ -122,36 +517,194 @@ class SageMakerLLM(LLM):
         Yields:
             GenerationChunk: An object representing chunks of the response.
         """
-        input_data = {
-            "messages": [
-                {"role": "system", "content": "You are a friendly and helpful AI assistant."},
-                {"role": "user", "content": prompt},
-            ],
-            "max_tokens": 1024,
-            "temperature": 0.7,
-            "top_p": 0.9,
-            "stop": ["<|endoftext|>", "</s>"],
-        }
-        payload = json.dumps(input_data)
-
+        start = time.perf_counter()
         response = self._sagemaker_runtime.invoke_endpoint_with_response_stream(
             EndpointName=self.endpoint_name,
             ContentType=self.content_type,
-            Body=payload,
+            Body=self._payload(prompt, stop, **kwargs),
             Accept="application/jsonlines",
         )
 
+        decoder = StreamDecoder()
+        stop_filter = StopSequenceFilter(DEFAULT_STOP + (stop or []))
+        first_byte = None
+        tokens = 0
         try:
             for event in response["Body"]:
                 if "PayloadPart" in event:
-                    chunk_text = event["PayloadPart"]["Bytes"].decode("utf-8").strip()
-                    if chunk_text:
-                        chunk = GenerationChunk(text=chunk_text)
-                        if run_manager:
-                            run_manager.on_llm_new_token(chunk.text, chunk=chunk)
-                        yield chunk
+                    if first_byte is None:
+                        first_byte = time.perf_counter()
+                    for text in decoder.feed(event["PayloadPart"]["Bytes"]):
+                        tokens += 1
+                        yield from self._emit(stop_filter.feed(text), run_manager)
+                    if stop_filter.stopped:
+                        return
+            for text in decoder.flush():
+                tokens += 1
+                yield from self._emit(stop_filter.feed(text), run_manager)
+            yield from self._emit(stop_filter.flush(), run_manager)
         finally:
             response["Body"].close()
+            self._log_metrics("stream", start, first_byte, tokens)
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        """
+        Handle asynchronous interaction with the SageMaker endpoint.
+
+        Args:
+            prompt (str): Input prompt for the language model.
+            stop (Optional[List[str]]): List of stop words for text generation.
+            run_manager (Optional[AsyncCallbackManagerForLLMRun]): Callback manager for tracking runs.
+
+        Returns:
+            str: The model's response as a string.
+        """
+        client = await self._async_runtime()
+        await self._start_slot()
+        start = time.perf_counter()
+        response = await client.invoke_endpoint(
+            EndpointName=self.endpoint_name,
+            ContentType=self.content_type,
+            Body=self._payload(prompt, stop, **kwargs),
+        )
+        first_byte = time.perf_counter()
+        async with response["Body"] as stream:
+            result = json.loads(await stream.read())
+        stop_filter = StopSequenceFilter(DEFAULT_STOP + (stop or []))
+        text = stop_filter.feed(result["choices"][0]["message"]["content"]) + stop_filter.flush()
+        self._log_metrics(
+            "invoke", start, first_byte, result.get("usage", {}).get("completion_tokens")
+        )
+        return text
+
+    async def _astream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[GenerationChunk]:
+        """
+        Handle asynchronous streaming interaction with the SageMaker endpoint.
+
+        Args:
+            prompt (str): Input prompt for the language model.
+            stop (Optional[List[str]]): List of stop words for text generation.
+            run_manager (Optional[AsyncCallbackManagerForLLMRun]): Callback manager for tracking runs.
+
+        Yields:
+            GenerationChunk: An object representing chunks of the response.
+        """
+        client = await self._async_runtime()
+        await self._start_slot()
+        start = time.perf_counter()
+        response = await client.invoke_endpoint_with_response_stream(
+            EndpointName=self.endpoint_name,
+            ContentType=self.content_type,
+            Body=self._payload(prompt, stop, **kwargs),
+            Accept="application/jsonlines",
+        )
+
+        # The event stream is read from the aiohttp response under it, the one aiobotocore reads, so that all
+        # the events received since the last read are decoded and emitted as one chunk instead of one event
+        # loop step each: the busier the loop, the larger the batches
+        raw_stream = response["Body"]._raw_stream
+        reader = EventStreamReader()
+        decoder = StreamDecoder()
+        stop_filter = StopSequenceFilter(DEFAULT_STOP + (stop or []))
+        first_byte = None
+        tokens = 0
+        try:
+            async for data in raw_stream.content.iter_any():
+                texts = [text for part in reader.feed(data) for text in decoder.feed(part)]
+                if first_byte is None and texts:
+                    first_byte = time.perf_counter()
+                tokens += len(texts)
+                chunk = await self._aemit(stop_filter.feed("".join(texts)), run_manager)
+                if chunk:
+                    yield chunk
+                if stop_filter.stopped:
+                    return
+            texts = list(decoder.flush())
+            tokens += len(texts)
+            chunk = await self._aemit(stop_filter.feed("".join(texts)) + stop_filter.flush(), run_manager)
+            if chunk:
+                yield chunk
+        finally:
+            # Once the body is read to the end aiohttp has already released the connection to the pool, so
+            # this only closes connections left with unread events, e.g. after a stop sequence
+            if not raw_stream.content.at_eof():
+                raw_stream.close()
+            self._log_metrics("stream", start, first_byte, tokens)
+
+    def _payload(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        """
+        Build the request body for the SageMaker endpoint.
+
+        Args:
+            prompt (str): Input prompt for the language model.
+            stop (Optional[List[str]]): Stop sequences in addition to the default ones.
+            **kwargs: Per call overrides of max_tokens, temperature, top_p and system_prompt.
+
+        Returns:
+            str: The JSON encoded request body.
+        """
+        input_data = {
+            "messages": [
+                {"role": "system", "content": kwargs.get("system_prompt", self.system_prompt)},
+                {"role": "user", "content": prompt},
+            ],
+            "max_tokens": kwargs.get("max_tokens", self.max_tokens),
+            "temperature": kwargs.get("temperature", self.temperature),
+            "top_p": kwargs.get("top_p", self.top_p),
+            "stop": DEFAULT_STOP + (stop or []),
+        }
+        return json.dumps(input_data)
+
+    @staticmethod
+    async def _aemit(
+        text: str, run_manager: Optional[AsyncCallbackManagerForLLMRun]
+    ) -> Optional[GenerationChunk]:
+        if not text:
+            return None
+        chunk = GenerationChunk(text=text)
+        if run_manager:
+            await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+        return chunk
+
+    def _log_metrics(
+        self, mode: str, start: float, first_byte: Optional[float], tokens: Optional[int]
+    ) -> None:
+        """
+        Log the latency of a call to the endpoint.
+
+        Args:
+            mode (str): "invoke" or "stream".
+            start (float): perf_counter value when the call was made.
+            first_byte (Optional[float]): perf_counter value when the first response bytes arrived.
+            tokens (Optional[int]): Number of tokens received, when known.
+        """
+        ttfb = f"{(first_byte - start) * 1000:.0f}ms" if first_byte else "n/a"
+        logging.info(
+            f"SageMaker {mode} on {self.endpoint_name}: time to first byte {ttfb}, "
+            f"total {(time.perf_counter() - start) * 1000:.0f}ms, tokens out {tokens if tokens is not None else 'n/a'}"
+        )
+
+    @staticmethod
+    def _emit(
+        text: str, run_manager: Optional[CallbackManagerForLLMRun]
+    ) -> Iterator[GenerationChunk]:
+        if text:
+            chunk = GenerationChunk(text=text)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
 
     @property
     def _identifying_params(self) -> Dict[str, Any]:
@@ -165,6 +718,9 @@ class SageMakerLLM(LLM):
             "endpoint_name": self.endpoint_name,
             "region_name": self.region_name,
             "content_type": self.content_type,
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
         }
 
     @property
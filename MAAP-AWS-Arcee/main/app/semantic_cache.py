@@ -0,0 +1,212 @@
+"""
+Semantic response cache for the RAG chain.
+
+Answers are stored in a MongoDB Atlas collection together with the embedding of the question that produced
+them. A new question is answered from the cache when a stored question of the same user and the same data
+sources is similar enough, which skips retrieval and the LLM call entirely. Entries expire through a TTL
+index, and the loader deletes a user's entries that depend on uploaded data whenever that user uploads new
+documents.
+
+The collection needs an Atlas Vector Search index (created by `mongodb_create_vectorindex.py`) on the
+`embedding` field with `userId` and `dataSource` as filter fields.
+
+Configuration (environment variables):
+    - SEMANTIC_CACHE_COLLECTION: "<database>.<collection>" of the cache (default: unset, disabled).
+    - SEMANTIC_CACHE_INDEX_NAME: Name of the vector search index (default: "semantic_cache_vector_index").
+    - SEMANTIC_CACHE_THRESHOLD: Minimum Atlas vector search score of a hit (default: 0.97).
+    - SEMANTIC_CACHE_TTL_SECONDS: Lifetime of a cached answer (default: 86400).
+"""
+import datetime
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+from pymongo.errors import PyMongoError
+
+from app.clients import registry
+
+USER_DATA_SOURCE = "User Uploaded Data"
+
+
+def data_source_key(data_sources: List[str]) -> str:
+    """Build an order independent key for a selection of data sources."""
+    return "|".join(sorted(data_sources))
+
+
+def stream_answer(answer: str) -> Iterator[str]:
+    """Split a cached answer into word sized chunks, so that it is streamed like a generated one."""
+    for chunk in re.findall(r"\S+\s*|\s+", answer):
+        yield chunk
+
+
+class SemanticCache:
+    """
+    Looks up and stores answers by question similarity.
+
+    Attributes:
+        database (str): Database of the cache collection.
+        collection (str): Name of the cache collection.
+        index_name (str): Name of the vector search index on the cache collection.
+        threshold (float): Minimum vector search score for a stored answer to be reused.
+        ttl_seconds (int): Time after which MongoDB removes a stored answer.
+    """
+
+    def __init__(
+        self,
+        database: str,
+        collection: str,
+        index_name: str = "semantic_cache_vector_index",
+        threshold: float = 0.97,
+        ttl_seconds: int = 86400,
+    ):
+        self.database = database
+        self.collection = collection
+        self.index_name = index_name
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self._ttl_index_ready = False
+        # Lookups are recorded from the event loop and from the threads of sync requests
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _pipeline(
+        self, query_vector: List[float], user_id: str, data_sources: List[str]
+    ) -> List[Dict[str, Any]]:
+        return [
+            {
+                "$vectorSearch": {
+                    "index": self.index_name,
+                    "path": "embedding",
+                    "queryVector": query_vector,
+                    "numCandidates": 20,
+                    "limit": 1,
+                    "filter": {
+                        "userId": user_id,
+                        "dataSource": data_source_key(data_sources),
+                    },
+                }
+            },
+            {"$project": {"answer": 1, "score": {"$meta": "vectorSearchScore"}}},
+            {"$match": {"score": {"$gte": self.threshold}}},
+        ]
+
+    def _entry(
+        self,
+        query: str,
+        query_vector: List[float],
+        user_id: str,
+        data_sources: List[str],
+        answer: str,
+    ) -> Dict[str, Any]:
+        return {
+            "query": query,
+            "embedding": query_vector,
+            "userId": user_id,
+            "dataSource": data_source_key(data_sources),
+            "usesUserData": USER_DATA_SOURCE in data_sources,
+            "answer": answer,
+            "createdAt": datetime.datetime.now(datetime.timezone.utc),
+        }
+
+    def _record(self, answer: Optional[str]) -> Optional[str]:
+        with self._stats_lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return answer
+
+    async def alookup(
+        self, query_vector: List[float], user_id: str, data_sources: List[str]
+    ) -> Optional[str]:
+        """Return a cached answer for a similar question, or None."""
+        collection = registry.async_mongo_client[self.database][self.collection]
+        try:
+            cursor = await collection.aggregate(
+                self._pipeline(query_vector, user_id, data_sources)
+            )
+            results = await cursor.to_list(1)
+        except PyMongoError as e:
+            logging.warning(f"Semantic cache lookup failed: {e}")
+            return None
+        return self._record(results[0]["answer"] if results else None)
+
+    def lookup(
+        self, query_vector: List[float], user_id: str, data_sources: List[str]
+    ) -> Optional[str]:
+        """Return a cached answer for a similar question, or None."""
+        collection = registry.mongo_client[self.database][self.collection]
+        try:
+            results = list(
+                collection.aggregate(self._pipeline(query_vector, user_id, data_sources))
+            )
+        except PyMongoError as e:
+            logging.warning(f"Semantic cache lookup failed: {e}")
+            return None
+        return self._record(results[0]["answer"] if results else None)
+
+    async def astore(
+        self,
+        query: str,
+        query_vector: List[float],
+        user_id: str,
+        data_sources: List[str],
+        answer: str,
+    ) -> None:
+        """Store the answer to a question."""
+        collection = registry.async_mongo_client[self.database][self.collection]
+        try:
+            if not self._ttl_index_ready:
+                await collection.create_index("createdAt", expireAfterSeconds=self.ttl_seconds)
+                self._ttl_index_ready = True
+            await collection.insert_one(
+                self._entry(query, query_vector, user_id, data_sources, answer)
+            )
+        except PyMongoError as e:
+            logging.warning(f"Semantic cache write failed: {e}")
+
+    def store(
+        self,
+        query: str,
+        query_vector: List[float],
+        user_id: str,
+        data_sources: List[str],
+        answer: str,
+    ) -> None:
+        """Store the answer to a question."""
+        collection = registry.mongo_client[self.database][self.collection]
+        try:
+            if not self._ttl_index_ready:
+                collection.create_index("createdAt", expireAfterSeconds=self.ttl_seconds)
+                self._ttl_index_ready = True
+            collection.insert_one(self._entry(query, query_vector, user_id, data_sources, answer))
+        except PyMongoError as e:
+            logging.warning(f"Semantic cache write failed: {e}")
+
+    def invalidate(self, user_id: str) -> int:
+        """Delete the cached answers of a user that depend on the user's uploaded data."""
+        collection = registry.mongo_client[self.database][self.collection]
+        return collection.delete_many({"userId": user_id, "usesUserData": True}).deleted_count
+
+    def stats(self) -> Dict[str, int]:
+        """Return the hit and miss counters."""
+        with self._stats_lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+def from_env() -> Optional[SemanticCache]:
+    """Create the semantic cache from the environment, or return None when it is disabled."""
+    namespace = os.getenv("SEMANTIC_CACHE_COLLECTION")
+    if not namespace:
+        return None
+    database, collection = namespace.split(".", 1)
+    return SemanticCache(
+        database=database,
+        collection=collection,
+        index_name=os.getenv("SEMANTIC_CACHE_INDEX_NAME", "semantic_cache_vector_index"),
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.97")),
+        ttl_seconds=int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "86400")),
+    )
@@ -1,15 +1,20 @@
 import json
 import os
+from contextlib import asynccontextmanager
+
 import uvicorn
 from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
 from langchain.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableGenerator, RunnablePassthrough
 from langchain_openai import ChatOpenAI
 from langserve import add_routes
+from app.clients import registry
+from app.context_builder import ContextBuilder
 from app.mongodb_atlas_retriever_tools import MongoDBAtlasCustomRetriever
-from app.sagemaker_llm import SageMakerLLM
+from app.sagemaker_llm import DEFAULT_SYSTEM_PROMPT, SageMakerLLM
+from app.semantic_cache import from_env as semantic_cache_from_env, stream_answer
 
 load_dotenv()
 
@@ -18,11 +23,37 @@ OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.supernova.arcee.ai/v
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 SAGEMAKER_ENDPOINT_NAME = os.getenv("SAGEMAKER_ENDPOINT_NAME")
 AWS_REGION = os.getenv("AWS_REGION")
+RETRIEVER_TOP_K = int(os.getenv("RETRIEVER_TOP_K", "10"))
+RETRIEVER_MERGE_STRATEGY = os.getenv("RETRIEVER_MERGE_STRATEGY", "score")
+RETRIEVER_SOURCE_TIMEOUT_SECONDS = float(os.getenv("RETRIEVER_SOURCE_TIMEOUT_SECONDS", "5"))
+RETRIEVER_SEARCH_MODE = os.getenv("RETRIEVER_SEARCH_MODE", "fanout")
+RETRIEVER_RERANK = os.getenv("RETRIEVER_RERANK") or None
+RETRIEVER_CANDIDATE_K = int(os.getenv("RETRIEVER_CANDIDATE_K", "100"))
+RETRIEVER_MMR_LAMBDA = float(os.getenv("RETRIEVER_MMR_LAMBDA", "0.5"))
+RETRIEVER_RERANK_BUDGET_MS = float(os.getenv("RETRIEVER_RERANK_BUDGET_MS", "20"))
+# Default retrieval config per data source, e.g. {"Trip Recommendations": {"k": 5, "minScore": 0.75}}
+RETRIEVER_SOURCE_CONFIG = json.loads(os.getenv("RETRIEVER_SOURCE_CONFIG") or "{}")
+RETRIEVER_MAX_K = int(os.getenv("RETRIEVER_MAX_K", "100"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.9"))
+CONTEXT_CHARS_PER_TOKEN = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "4"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create the pooled MongoDB and Bedrock clients once per worker and reuse them across requests
+    await registry.astartup()
+    yield
+    if isinstance(llm, SageMakerLLM):
+        await llm.aclose()
+    await registry.ashutdown()
+
 
 app = FastAPI(
     title="MAAP - MongoDB AI Applications Program",
     version="1.0",
     description="MongoDB AI Applications Program",
+    lifespan=lifespan,
 )
 
 
@@ -31,8 +62,48 @@ async def redirect_root_to_docs():
     return RedirectResponse("/docs")
 
 
+@app.get("/embedding-cache/stats")
+async def embedding_cache_stats():
+    return registry.embeddings.stats()
+
+
+semantic_cache = semantic_cache_from_env()
+context_builder = ContextBuilder(
+    token_budget=CONTEXT_TOKEN_BUDGET,
+    duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD,
+    chars_per_token=CONTEXT_CHARS_PER_TOKEN,
+)
+
+
+@app.get("/semantic-cache/stats")
+async def semantic_cache_stats():
+    return semantic_cache.stats() if semantic_cache else {}
+
+
+@app.get("/context-builder/stats")
+async def context_builder_stats():
+    return context_builder.stats()
+
+
+@app.delete("/semantic-cache/{user_id}")
+def invalidate_semantic_cache(user_id: str):
+    deleted = semantic_cache.invalidate(user_id) if semantic_cache else 0
+    return {"deleted": deleted}
+
+
 if SAGEMAKER_ENDPOINT_NAME:
-    llm = SageMakerLLM(endpoint_name=SAGEMAKER_ENDPOINT_NAME, region_name=AWS_REGION)
+    llm = SageMakerLLM(
+        endpoint_name=SAGEMAKER_ENDPOINT_NAME,
+        region_name=AWS_REGION,
+        max_pool_connections=int(os.getenv("SAGEMAKER_MAX_POOL_CONNECTIONS", "50")),
+        connect_timeout=float(os.getenv("SAGEMAKER_CONNECT_TIMEOUT_SECONDS", "5")),
+        read_timeout=float(os.getenv("SAGEMAKER_READ_TIMEOUT_SECONDS", "120")),
+        max_attempts=int(os.getenv("SAGEMAKER_MAX_ATTEMPTS", "3")),
+        max_tokens=int(os.getenv("SAGEMAKER_MAX_TOKENS", "1024")),
+        temperature=float(os.getenv("SAGEMAKER_TEMPERATURE", "0.7")),
+        top_p=float(os.getenv("SAGEMAKER_TOP_P", "0.9")),
+        system_prompt=os.getenv("SAGEMAKER_SYSTEM_PROMPT", DEFAULT_SYSTEM_PROMPT),
+    )
 else:
     llm = ChatOpenAI(
         model="arcee_pipeline.Arcee-SuperNova-v1",
@@ -58,23 +129,91 @@ Answer:"""
 prompt = ChatPromptTemplate.from_template(prompt_template)
 
 
-def format_documents(documents):
-    return [doc.page_content for doc in documents if doc.page_content is not None]
-
-
 def format_query(rpt):
     input = json.loads(rpt)
     return input["query"]
 
 
-chain = (
+rag_chain = (
     {
-        "context": MongoDBAtlasCustomRetriever()| format_documents | "\n".join,
+        "context": MongoDBAtlasCustomRetriever(
+            k=RETRIEVER_TOP_K,
+            merge_strategy=RETRIEVER_MERGE_STRATEGY,
+            source_timeout=RETRIEVER_SOURCE_TIMEOUT_SECONDS,
+            search_mode=RETRIEVER_SEARCH_MODE,
+            rerank=RETRIEVER_RERANK,
+            candidate_k=RETRIEVER_CANDIDATE_K,
+            mmr_lambda=RETRIEVER_MMR_LAMBDA,
+            rerank_budget_ms=RETRIEVER_RERANK_BUDGET_MS,
+            source_config=RETRIEVER_SOURCE_CONFIG,
+            max_k=RETRIEVER_MAX_K,
+        )
+        | context_builder.build,
         "question": RunnablePassthrough() | format_query,
     }
     | prompt
     | llm
 )
+
+
+def chunk_text(chunk):
+    return chunk.content if hasattr(chunk, "content") else chunk
+
+
+# The cached chain streams text chunks, whether the answer comes from the cache, a chat model or an LLM
+def cached_chain(input_stream):
+    rpt = "".join(input_stream)
+    inputs = json.loads(rpt)
+    if inputs.get("retrieval"):
+        # Answers cached under the default retrieval config do not apply to a tuned request
+        for chunk in rag_chain.stream(rpt):
+            yield chunk_text(chunk)
+        return
+    query_vector = registry.embeddings.embed_query(inputs["query"])
+    answer = semantic_cache.lookup(query_vector, inputs["userId"], inputs["dataSource"])
+    if answer is not None:
+        yield from stream_answer(answer)
+        return
+    answer = ""
+    for chunk in rag_chain.stream(rpt):
+        text = chunk_text(chunk)
+        answer += text
+        yield text
+    if answer:
+        semantic_cache.store(
+            inputs["query"], query_vector, inputs["userId"], inputs["dataSource"], answer
+        )
+
+
+async def acached_chain(input_stream):
+    rpt = "".join([chunk async for chunk in input_stream])
+    inputs = json.loads(rpt)
+    if inputs.get("retrieval"):
+        async for chunk in rag_chain.astream(rpt):
+            yield chunk_text(chunk)
+        return
+    query_vector = await registry.embeddings.aembed_query(inputs["query"])
+    answer = await semantic_cache.alookup(query_vector, inputs["userId"], inputs["dataSource"])
+    if answer is not None:
+        for chunk in stream_answer(answer):
+            yield chunk
+        return
+    answer = ""
+    async for chunk in rag_chain.astream(rpt):
+        text = chunk_text(chunk)
+        answer += text
+        yield text
+    if answer:
+        await semantic_cache.astore(
+            inputs["query"], query_vector, inputs["userId"], inputs["dataSource"], answer
+        )
+
+
+# Serve similar questions from the semantic cache, without retrieval or an LLM call
+if semantic_cache:
+    chain = RunnableGenerator(cached_chain, acached_chain).with_types(input_type=str, output_type=str)
+else:
+    chain = rag_chain
 add_routes(app, chain, path="/rag", playground_type="default")
 
 
@@ -0,0 +1,233 @@
+"""
+Embedding cache for Bedrock Titan embeddings.
+
+Wraps any LangChain `Embeddings` model with a bounded in-process LRU cache whose entries expire after a
+TTL, and optionally with a second tier stored in a MongoDB collection so that replicas share the
+embeddings they have already paid for. Cache hits never reach the Bedrock runtime.
+
+Query texts are normalized before they are used as a cache key (surrounding whitespace removed, inner
+whitespace collapsed and case folded), so repeated questions that only differ in spacing or case
+share a single entry. Document texts are cached as they are. In process, embeddings are kept as packed
+float32 arrays, about 6 KiB per 1536-dimension Titan embedding instead of about 48 KiB as a list.
+
+Classes:
+    - CachedEmbeddings: Caching wrapper around an `Embeddings` model.
+"""
+import asyncio
+import datetime
+import hashlib
+import logging
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+from pymongo.collection import Collection
+from pymongo.errors import PyMongoError
+
+
+def normalize_text(text: str) -> str:
+    """Normalize a text so that trivially different inputs share the same cache key."""
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    An `Embeddings` implementation that serves repeated texts from a cache.
+
+    Attributes:
+        embeddings (Embeddings): The wrapped embeddings model.
+        model_id (str): Identifier of the embeddings model, part of every cache key.
+        max_size (int): Maximum number of entries kept in process.
+        ttl_seconds (float): Time after which an in-process entry expires.
+        collection (Optional[Collection]): MongoDB collection used as the shared second tier.
+        collection_ttl_seconds (int): Time after which MongoDB removes a shared entry.
+        async_embed (Optional[Callable]): Native async embedding function used by `aembed_query`. When it
+            is not set, the wrapped model's own `aembed_query` is used.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model_id: str,
+        max_size: int = 1024,
+        ttl_seconds: float = 3600,
+        collection: Optional[Collection] = None,
+        collection_ttl_seconds: int = 7 * 24 * 3600,
+        async_embed: Optional[Callable[[str], Awaitable[List[float]]]] = None,
+    ):
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.collection = collection
+        self.collection_ttl_seconds = collection_ttl_seconds
+        self.async_embed = async_embed
+        self._entries: "OrderedDict[str, Tuple[float, array]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._ttl_index_ready = False
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def _key(self, text: str, normalize: bool = False) -> str:
+        if normalize:
+            text = normalize_text(text)
+        return hashlib.sha256(f"{self.model_id}:{text}".encode("utf-8")).hexdigest()
+
+    def _get_local(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, embedding = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return embedding.tolist()
+
+    def _put_local(self, key: str, embedding: List[float]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, array("f", embedding))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _get_shared(self, keys: List[str]) -> Dict[str, List[float]]:
+        if self.collection is None or not keys:
+            return {}
+        try:
+            cursor = self.collection.find(
+                {"_id": {"$in": keys}}, {"embedding": 1}
+            )
+            return {doc["_id"]: doc["embedding"] for doc in cursor}
+        except PyMongoError as e:
+            logging.warning(f"Embedding cache lookup failed: {e}")
+            return {}
+
+    def _put_shared(self, entries: Dict[str, List[float]]) -> None:
+        if self.collection is None or not entries:
+            return
+        try:
+            if not self._ttl_index_ready:
+                self.collection.create_index(
+                    "createdAt", expireAfterSeconds=self.collection_ttl_seconds
+                )
+                self._ttl_index_ready = True
+            now = datetime.datetime.now(datetime.timezone.utc)
+            for key, embedding in entries.items():
+                self.collection.update_one(
+                    {"_id": key},
+                    {
+                        "$setOnInsert": {
+                            "embedding": embedding,
+                            "model": self.model_id,
+                            "createdAt": now,
+                        }
+                    },
+                    upsert=True,
+                )
+        except PyMongoError as e:
+            logging.warning(f"Embedding cache write failed: {e}")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts, calling the wrapped model only for the texts that are not cached."""
+        keys = [self._key(text) for text in texts]
+        found: Dict[str, List[float]] = {}
+        for key in keys:
+            embedding = self._get_local(key)
+            if embedding is not None:
+                found[key] = embedding
+        local_hits = len(found)
+
+        shared = self._get_shared([key for key in set(keys) if key not in found])
+        for key, embedding in shared.items():
+            self._put_local(key, embedding)
+        found.update(shared)
+
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            computed = dict(
+                zip(missing.keys(), self.embeddings.embed_documents(list(missing.values())))
+            )
+            for key, embedding in computed.items():
+                self._put_local(key, embedding)
+            self._put_shared(computed)
+            found.update(computed)
+
+        with self._lock:
+            self.hits += local_hits
+            self.shared_hits += len(shared)
+            self.misses += len(missing)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query text, serving it from the cache when possible."""
+        key = self._key(text, normalize=True)
+        embedding = self._get_local(key)
+        if embedding is not None:
+            with self._lock:
+                self.hits += 1
+            return embedding
+
+        embedding = self._get_shared([key]).get(key)
+        if embedding is not None:
+            self._put_local(key, embedding)
+            with self._lock:
+                self.shared_hits += 1
+            return embedding
+
+        embedding = self.embeddings.embed_query(text)
+        self._put_local(key, embedding)
+        self._put_shared({key: embedding})
+        with self._lock:
+            self.misses += 1
+        return embedding
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Embed a query text without blocking the event loop, serving it from the cache when possible."""
+        key = self._key(text, normalize=True)
+        embedding = self._get_local(key)
+        if embedding is not None:
+            with self._lock:
+                self.hits += 1
+            return embedding
+
+        if self.collection is not None:
+            embedding = (await asyncio.to_thread(self._get_shared, [key])).get(key)
+            if embedding is not None:
+                self._put_local(key, embedding)
+                with self._lock:
+                    self.shared_hits += 1
+                return embedding
+
+        if self.async_embed is not None:
+            embedding = await self.async_embed(text)
+        else:
+            embedding = await self.embeddings.aembed_query(text)
+        self._put_local(key, embedding)
+        if self.collection is not None:
+            # Write-behind: the caller does not wait for the shared tier
+            asyncio.get_running_loop().run_in_executor(
+                None, self._put_shared, {key: embedding}
+            )
+        with self._lock:
+            self.misses += 1
+        return embedding
+
+    def stats(self) -> Dict[str, int]:
+        """Return the hit and miss counters and the current number of in-process entries."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+            }
@@ -0,0 +1,27 @@
+"""
+Encoding of embeddings as packed BSON binary vectors.
+
+Shared by the loader, which stores the embeddings of new chunks in the format set by
+LOADER_EMBEDDING_FORMAT, and by `mongodb_migrate_vectors.py`, which converts the chunks stored by
+earlier versions, so that both write the same vectors.
+"""
+from typing import Any, List
+
+from bson.binary import Binary, BinaryVectorDtype
+
+EMBEDDING_FORMATS = ("array", "float32", "int8")
+
+
+def encode_embedding(embedding: List[float], embedding_format: str) -> Any:
+    """
+    Pack an embedding as a "float32" or "int8" BSON binary vector, or return it as is for "array".
+    int8 vectors are scaled per vector to the full int8 range, which keeps cosine similarity intact.
+    """
+    if embedding_format == "float32":
+        return Binary.from_vector(embedding, BinaryVectorDtype.FLOAT32)
+    if embedding_format == "int8":
+        scale = 127 / max(max(abs(value) for value in embedding), 1e-12)
+        return Binary.from_vector([round(value * scale) for value in embedding], BinaryVectorDtype.INT8)
+    if embedding_format == "array":
+        return embedding
+    raise ValueError(f"Unknown embedding format {embedding_format}, expected one of {EMBEDDING_FORMATS}")
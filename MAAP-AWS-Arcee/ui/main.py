@@ -2,91 +2,188 @@ import json
 import mimetypes
 import os
 import re
+import time
 
 import gradio as gr
-import requests
+import httpx
 from dotenv import load_dotenv
 from gradio import Markdown as m
 from langserve import RemoteRunnable
 import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 import uvicorn
 
 load_dotenv()
 
 MONGODB_URI = os.getenv("MONGODB_URI")
+LOADER_URL = "http://loader:8001"
+RAG_URL = "http://main:8000/rag"
+HTTP_MAX_CONNECTIONS = int(os.getenv("UI_HTTP_MAX_CONNECTIONS", "100"))
+STREAM_FRAME_SECONDS = float(os.getenv("UI_STREAM_FRAME_MS", "30")) / 1000
+
+# Shared by all chat sessions, so that uploads reuse pooled connections to the loader
+http_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(None, connect=10.0),
+    limits=httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+    ),
+)
+# RemoteRunnable keeps its own pooled client to the RAG service, one instance serves every session
+rag = RemoteRunnable(RAG_URL)
+# Cancellation requests sent after their chat session went away
+background_tasks = set()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await http_client.aclose()
+
 
 app = FastAPI(
     title="MAAP - MongoDB AI Applications Program",
     version="1.0",
     description="MongoDB AI Applications Program",
+    lifespan=lifespan,
 )
 
 
+class TurnStream:
+    """
+    Text of one chat turn as it is sent to the browser. Gradio sends every yielded message as a diff
+    against the previous one, so only the changed bytes go over the wire. Status messages are sent right
+    away, answer tokens are coalesced into at most one frame per UI_STREAM_FRAME_MS. Time to first token
+    and the bytes sent are logged per turn.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.text = ""
+        self.sent_text = ""
+        self.last_frame = 0.0
+        self.request_start = None
+        self.first_token = None
+        self.frames = 0
+        self.bytes = 0
+
+    def frame(self):
+        common = len(os.path.commonprefix([self.sent_text, self.text]))
+        self.bytes += len(self.text[common:].encode("utf-8"))
+        self.frames += 1
+        self.sent_text = self.text
+        self.last_frame = time.perf_counter()
+        return self.text
+
+    def status(self, text):
+        self.text = text
+        return self.frame()
+
+    def begin_answer(self):
+        # The answer replaces the status messages, it is sent with its first token
+        self.text = ""
+        self.request_start = time.perf_counter()
+
+    def add(self, token):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        self.text += token
+
+    def pending(self):
+        return self.text != self.sent_text
+
+    def time_to_frame(self):
+        return max(0.0, self.last_frame + STREAM_FRAME_SECONDS - time.perf_counter())
+
+    def log(self, userId):
+        ttft = (
+            f"{(self.first_token - self.request_start) * 1000:.0f}ms"
+            if self.first_token and self.request_start
+            else "n/a"
+        )
+        print(
+            f"Turn of {userId}: first token {ttft}, total {(time.perf_counter() - self.start) * 1000:.0f}ms, "
+            f"{self.frames} frames, {self.bytes} bytes sent"
+        )
+
+
+def message_text(msg):
+    if isinstance(msg, str):
+        return msg
+    if hasattr(msg, "content"):
+        return msg.content
+    raise TypeError(f"Unexpected message type: {type(msg)}")
+
+
+async def stream_answer(messages, stream):
+    """Add the streamed messages to the turn and yield a frame whenever the frame budget has passed."""
+    iterator = messages.__aiter__()
+    next_message = asyncio.ensure_future(iterator.__anext__())
+    try:
+        while True:
+            timeout = stream.time_to_frame() if stream.pending() else None
+            done, _ = await asyncio.wait({next_message}, timeout=timeout)
+            if not done:
+                yield stream.frame()
+                continue
+            try:
+                msg = next_message.result()
+            except StopAsyncIteration:
+                break
+            stream.add(message_text(msg))
+            next_message = asyncio.ensure_future(iterator.__anext__())
+        if stream.pending():
+            yield stream.frame()
+    finally:
+        next_message.cancel()
+
+
 async def process_request(message, history, userId, dataSource):
+    stream = TurnStream()
     try:
         print(userId, dataSource)
-        url = "http://main:8000/rag"
         print(message, history)
         if message and len(message) > 0:
             query = message["text"].strip()
             urls = extract_urls(query)
             print(urls)
             num_files = len(message["files"])
-            strTempResponse = ""
             if num_files > 0 or len(urls) > 0:
-                strTempResponse = ""
-                for i in re.split(
-                    r"(\s)",
-                    "Initiating upload and content vectorization. \nPlease wait....",
-                ):
-                    strTempResponse += i
-                    await asyncio.sleep(0.025)
-                    yield strTempResponse
-                    await asyncio.sleep(0.050)
-
-                # Wait for the upload task to complete
-                uploadResult = await ingest_data(userId, urls, message["files"])
-                if uploadResult:
-                    for i in re.split(
-                        r"(\s)",
-                        "\nFile(s)/URL(s) uploaded  and ingested successfully. \nGiving time for Indexes to Update....",
+                strTempResponse = "Initiating upload and content vectorization. \nPlease wait...."
+                yield stream.status(strTempResponse)
+
+                # Show the loader's progress while the upload runs
+                uploadResult = False
+                status_lines = []
+                last_event = None
+                async for event in ingest_data(userId, urls, message["files"]):
+                    line = describe_ingest_event(event)
+                    if event["event"] == last_event and event["event"] in (
+                        "chunks_embedded",
+                        "chunks_written",
                     ):
-                        strTempResponse += i
-                        await asyncio.sleep(0.025)
-                        yield strTempResponse
-                    await asyncio.sleep(5)
+                        status_lines[-1] = line
+                    elif line:
+                        status_lines.append(line)
+                    last_event = event["event"]
+                    if event["event"] == "done":
+                        uploadResult = "Successfully uploaded" in event["message"]
+                    yield stream.status(strTempResponse + "".join(status_lines))
+                strTempResponse += "".join(status_lines)
+                if uploadResult:
+                    strTempResponse += "\nFile(s)/URL(s) uploaded  and ingested successfully.\n"
                 else:
-                    for i in re.split(
-                        r"(\s)", "\nFile(s)/URL(s) upload exited with error...."
-                    ):
-                        strTempResponse += i
-                        await asyncio.sleep(0.025)
-                        yield strTempResponse
+                    strTempResponse += "\nFile(s)/URL(s) upload exited with error...."
+                yield stream.status(strTempResponse)
 
             if len(query) > 0:
                 prompt = json.dumps(
                     {"query": query, "userId": userId, "dataSource": dataSource}
                 )
-                strResponse = ""
-                llm = RemoteRunnable(url)
-                async for msg in llm.astream(prompt):
-                    if isinstance(msg, str):
-                        strResponse += msg
-                    elif hasattr(msg, "content"):
-                        strResponse += msg.content
-                    else:
-                        raise TypeError(f"Unexpected message type: {type(msg)}")
-                    yield strResponse
-                try:
-                    response_dict = json.loads(strResponse)
-                    yield (
-                        response_dict.get("choices", [{}])[0]
-                        .get("message", {})
-                        .get("content", "")
-                    )
-                except json.JSONDecodeError:
-                    pass
+                stream.begin_answer()
+                async for frame in stream_answer(rag.astream(prompt), stream):
+                    yield frame
             else:
                 yield "Hi, how may I help you?"
         else:
@@ -94,6 +191,8 @@ async def process_request(message, history, userId, dataSource):
     except Exception as error:
         print(error)
         yield "There was an error.\n" + str(error)
+    finally:
+        stream.log(userId)
 
 
 def extract_urls(string):
@@ -102,8 +201,38 @@ def extract_urls(string):
     return [x[0] for x in url]
 
 
+def describe_ingest_event(event):
+    if event["event"] == "files_saved":
+        return f"\nSaved {len(event['files'])} file(s)."
+    if event["event"] == "chunks_parsed":
+        line = f"\nParsed {event['chunks']} chunk(s) from {event['source']}."
+        if event.get("unchanged"):
+            line += f" {event['unchanged']} page(s) unchanged since the last upload."
+        if event.get("failed"):
+            line += f" Could not fetch {', '.join(event['failed'])}."
+        return line
+    if event["event"] == "source_unchanged":
+        return f"\nSkipped {event['source']}, unchanged since the last upload."
+    if event["event"] == "chunks_embedded":
+        return f"\nEmbedded {event['embedded']}/{event['total']} chunk(s)."
+    if event["event"] == "chunks_written":
+        return f"\nStored {event['written']}/{event['total']} chunk(s) in MongoDB."
+    if event["event"] == "index_queryable":
+        if event["queryable"]:
+            return "\nSearch index is up to date."
+        return "\nSearch index is still updating."
+    if event["event"] == "error":
+        print(event["message"])
+        return f"\n{event['message']}"
+    return ""
+
+
 async def ingest_data(userId, urls, new_files):
-    url = "http://loader:8001/upload"
+    """
+    Upload the files and URLs to the loader and yield its progress events as they arrive. The files are
+    streamed from disk. When the chat session stops listening before the upload is done, the loader job
+    is cancelled.
+    """
 
     inputs = {
         "userId": userId,
@@ -157,14 +286,44 @@ async def ingest_data(userId, urls, new_files):
         ]
         if file_ext in file_types:
             files.append(("files", (file_name, open(file, "rb"), mime_type)))
-    headers = {}
-    response = requests.request("POST", url, headers=headers, data=payload, files=files)
-
-    print(response.text)
-    if "Successfully uploaded" in response.text:
-        return True
-    else:
-        return False
+    job_id = None
+    finished = False
+    try:
+        async with http_client.stream(
+            "POST", f"{LOADER_URL}/upload/stream", data=payload, files=files
+        ) as response:
+            if response.is_error:
+                # The loader rejected the upload before streaming any progress, e.g. an invalid request
+                body = (await response.aread()).decode("utf-8", errors="replace")
+                finished = True
+                yield {
+                    "event": "error",
+                    "message": f"The loader returned HTTP {response.status_code}: {body[:500]}",
+                }
+                return
+            async for line in response.aiter_lines():
+                if line:
+                    event = json.loads(line)
+                    print(event)
+                    job_id = event.get("job_id", job_id)
+                    finished = event["event"] in ("done", "error")
+                    yield event
+    finally:
+        for _, (_, file, _) in files:
+            file.close()
+        if job_id and not finished:
+            # Must not await here, the generator may be closing because its task was cancelled
+            task = asyncio.get_running_loop().create_task(cancel_ingest(job_id))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+
+
+async def cancel_ingest(job_id):
+    try:
+        response = await http_client.post(f"{LOADER_URL}/jobs/{job_id}/cancel")
+        print("Cancelled ingest job", job_id, response.status_code)
+    except httpx.HTTPError as error:
+        print("Could not cancel ingest job", job_id, error)
 
 
 def print_like_dislike(x: gr.LikeData):
@@ -0,0 +1,113 @@
+"""
+Helpers shared by the benchmark scripts: paths of the services, latency summaries and result tables.
+
+The scripts import the services' own modules, so run them with the dependencies of the service they
+measure installed, from the repository root, e.g. `python benchmarks/retrieval_sweep.py --help`.
+"""
+import json
+import math
+import os
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN_DIR = os.path.join(ROOT_DIR, "MAAP-AWS-Arcee", "main")
+LOADER_DIR = os.path.join(ROOT_DIR, "MAAP-AWS-Arcee", "loader")
+UI_DIR = os.path.join(ROOT_DIR, "MAAP-AWS-Arcee", "ui")
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+QUERIES_FILE = os.path.join(FIXTURES_DIR, "queries.json")
+POLL_INTERVAL = 5  # seconds
+
+
+def use_service(directory: str) -> None:
+    """Make the modules of a service importable the way its Dockerfile lays them out."""
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+
+def load_queries(path: str = QUERIES_FILE) -> List[str]:
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile, q between 0 and 100."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(values_ms: Sequence[float]) -> Dict[str, float]:
+    """Count, mean, p50, p95, p99 and max of a list of latencies in milliseconds."""
+    return {
+        "n": len(values_ms),
+        "mean_ms": round(sum(values_ms) / len(values_ms), 2) if values_ms else float("nan"),
+        "p50_ms": round(percentile(values_ms, 50), 2),
+        "p95_ms": round(percentile(values_ms, 95), 2),
+        "p99_ms": round(percentile(values_ms, 99), 2),
+        "max_ms": round(max(values_ms), 2) if values_ms else float("nan"),
+    }
+
+
+class Timer:
+    """Context manager measuring the wall time of a block in milliseconds."""
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.ms = (time.perf_counter() - self.start) * 1000
+
+
+def print_table(rows: List[Dict[str, Any]], columns: Optional[Iterable[str]] = None) -> None:
+    """Print rows of results as an aligned text table."""
+    if not rows:
+        print("(no results)")
+        return
+    columns = list(columns or rows[0].keys())
+    cells = [[str(row.get(column, "")) for column in columns] for row in rows]
+    widths = [max(len(column), *(len(cell[i]) for cell in cells)) for i, column in enumerate(columns)]
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+    for cell in cells:
+        print("  ".join(value.rjust(width) for value, width in zip(cell, widths)))
+
+
+def write_results(path: Optional[str], results: Any) -> None:
+    """Write the results as JSON when an output path is given."""
+    if not path:
+        return
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2, default=str)
+    print(f"Results written to {path}")
+
+
+def copy_sample(source, target, size: int, match: Optional[Dict[str, Any]] = None, batch_size: int = 500) -> int:
+    """Copy a random sample of the documents of a collection into another one, returning their number."""
+    pipeline = [{"$match": match or {}}, {"$sample": {"size": size}}]
+    batch = []
+    copied = 0
+    for document in source.aggregate(pipeline):
+        batch.append(document)
+        if len(batch) >= batch_size:
+            target.insert_many(batch)
+            copied += len(batch)
+            batch = []
+    if batch:
+        target.insert_many(batch)
+        copied += len(batch)
+    return copied
+
+
+def wait_for_search_index(collection, name: str, timeout: float = 600) -> bool:
+    """Poll until a search index of the collection is queryable."""
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        indices = list(collection.list_search_indexes(name))
+        if indices and indices[0].get("queryable"):
+            return True
+        time.sleep(POLL_INTERVAL)
+    return False
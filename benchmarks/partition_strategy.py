@@ -0,0 +1,115 @@
+"""
+Benchmark of the loader's partition strategy planning against partitioning every file with "hi_res".
+
+The script generates text, Markdown, CSV and HTML samples and takes any other files, e.g. PDFs with and
+without a text layer, as arguments. For every file it partitions it with the strategy PlanStrategy picks
+and with "hi_res", and reports the partition time of both per file type together with the share of the
+words found by "hi_res" that the planned strategy also finds.
+
+    python benchmarks/partition_strategy.py
+    python benchmarks/partition_strategy.py --no-samples report.pdf scan.pdf --repeat 1
+"""
+import os
+import re
+import sys
+import tempfile
+
+import click
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common  # noqa: E402
+
+common.use_service(common.LOADER_DIR)
+load_dotenv()
+
+from loader import PartitionFile, PlanStrategy  # noqa: E402
+
+
+def sample_paragraphs(count):
+    queries = common.load_queries()
+    return [
+        " ".join(f"{queries[(i + j) % len(queries)]}." for j in range(6)) + f" Paragraph {i + 1}."
+        for i in range(count)
+    ]
+
+
+def write_samples(directory, paragraphs):
+    """Write the paragraphs as a text, a Markdown, a CSV and an HTML file, returning their paths."""
+    samples = {
+        "sample.txt": "\n\n".join(paragraphs),
+        "sample.md": "\n\n".join(
+            f"## Section {i + 1}\n\n{paragraph}" if i % 5 == 0 else paragraph for i, paragraph in enumerate(paragraphs)
+        ),
+        "sample.csv": "id,text\n" + "\n".join(f'{i},"{paragraph}"' for i, paragraph in enumerate(paragraphs)),
+        "sample.html": "<html><body>"
+        + "".join(
+            (f"<h2>Section {i + 1}</h2>" if i % 5 == 0 else "") + f"<p>{paragraph}</p>"
+            for i, paragraph in enumerate(paragraphs)
+        )
+        + "</body></html>",
+    }
+    paths = []
+    for name, content in samples.items():
+        path = os.path.join(directory, name)
+        with open(path, "w") as file:
+            file.write(content)
+        paths.append(path)
+    return paths
+
+
+def words(docs):
+    return set(re.findall(r"\w+", " ".join(doc.page_content for doc in docs).lower()))
+
+
+def time_partition(file_name, strategy, repeat):
+    seconds = []
+    for _ in range(repeat):
+        docs, elapsed = PartitionFile(file_name, strategy)
+        seconds.append(elapsed)
+    return docs, min(seconds)
+
+
+@click.command()
+@click.argument("files", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option("--samples/--no-samples", default=True, show_default=True, help="Include the generated samples.")
+@click.option("--paragraphs", default=200, show_default=True, help="Paragraphs of the generated samples.")
+@click.option("--repeat", default=3, show_default=True, help="Partitions per file and strategy, the fastest counts.")
+@click.option("--output", default=None, help="Write the results as JSON.")
+def cli(files, samples, paragraphs, repeat, output):
+    """
+    Compare the planned partition strategy with "hi_res" for the generated samples and FILES.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        file_names = (write_samples(directory, sample_paragraphs(paragraphs)) if samples else []) + list(files)
+        rows = []
+        for file_name in file_names:
+            planned = PlanStrategy(file_name)
+            hi_res_docs, hi_res_seconds = time_partition(file_name, "hi_res", repeat)
+            if planned == "hi_res":
+                planned_docs, planned_seconds = hi_res_docs, hi_res_seconds
+            else:
+                planned_docs, planned_seconds = time_partition(file_name, planned, repeat)
+            hi_res_words = words(hi_res_docs)
+            rows.append(
+                {
+                    "file": os.path.basename(file_name),
+                    "type": os.path.splitext(file_name)[1].lower() or "-",
+                    "KB": round(os.path.getsize(file_name) / 1024, 1),
+                    "planned": planned,
+                    "planned_s": round(planned_seconds, 3),
+                    "hi_res_s": round(hi_res_seconds, 3),
+                    "speedup": round(hi_res_seconds / planned_seconds, 1) if planned_seconds else "-",
+                    "planned_docs": len(planned_docs),
+                    "hi_res_docs": len(hi_res_docs),
+                    "word_recall": round(len(words(planned_docs) & hi_res_words) / len(hi_res_words), 3)
+                    if hi_res_words
+                    else "-",
+                }
+            )
+    common.print_table(rows)
+    common.write_results(output, rows)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,226 @@
+"""
+Benchmark of the MMR reranking stage: its latency, and the relevance and diversity of the documents it
+passes to the LLM compared with the ANN top-k.
+
+`atlas` embeds the fixed query set, fetches `--candidate-k` candidates with their embeddings from a data
+source and reranks them to k, and reports the search latency of the wider fetch against a plain top-k
+search next to the reranking latency. `synthetic` needs no Atlas cluster: it generates candidate sets of
+topics with near-duplicate chunks with NumPy, and also reports how many distinct topics reach the top-k.
+Relevance is the mean cosine similarity of the top-k to the query, redundancy the mean cosine similarity
+between the top-k documents.
+
+    python benchmarks/rerank.py atlas --candidate-k 30 --candidate-k 100 --lambda 0.5 --lambda 0.7
+    python benchmarks/rerank.py synthetic --candidates 30 --candidates 300
+    python benchmarks/rerank.py synthetic --candidates 300 --candidates 1000 --embedding-format float32
+"""
+import logging
+import os
+import sys
+
+import click
+import numpy as np
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common  # noqa: E402
+
+common.use_service(common.MAIN_DIR)
+sys.path.insert(0, common.ROOT_DIR)
+load_dotenv()
+
+from langchain_core.documents import Document  # noqa: E402
+
+from app.reranker import EMBEDDING_FIELD, mmr_rerank, normalize, pop_embeddings  # noqa: E402
+from mongodb_migrate_vectors import encode_embedding  # noqa: E402
+
+EMBEDDING_FORMATS = ["array", "float32", "int8"]
+
+
+def selection_metrics(vectors, query, indices):
+    """Mean relevance to the query and mean pairwise similarity of the selected unit vectors."""
+    selected = vectors[indices]
+    relevance = float(np.mean(selected @ query))
+    if len(indices) < 2:
+        return relevance, 0.0
+    similarity = selected @ selected.T
+    redundancy = float((similarity.sum() - np.trace(similarity)) / (len(indices) * (len(indices) - 1)))
+    return relevance, redundancy
+
+
+def timed_rerank(query_vector, documents, k, mmr_lambda, budget_ms):
+    """Rerank copies of the documents, returning the indices of the picked ones and the time taken."""
+    copies = [Document(page_content=doc.page_content, metadata=dict(doc.metadata)) for doc in documents]
+    positions = {id(doc): i for i, doc in enumerate(copies)}
+    with common.Timer() as timer:
+        picked = mmr_rerank(query_vector, copies, k=k, mmr_lambda=mmr_lambda, budget_ms=budget_ms)
+    return [positions[id(doc)] for doc in picked], timer.ms
+
+
+def summary_row(rows, budget_ms):
+    latencies = [row["rerank_ms"] for row in rows]
+    summary = common.summarize(latencies)
+    return {
+        "rerank_p50_ms": summary["p50_ms"],
+        "rerank_p95_ms": summary["p95_ms"],
+        "over_budget": sum(latency >= budget_ms for latency in latencies),
+        "ann_relevance": round(float(np.mean([row["ann_relevance"] for row in rows])), 4),
+        "mmr_relevance": round(float(np.mean([row["mmr_relevance"] for row in rows])), 4),
+        "ann_redundancy": round(float(np.mean([row["ann_redundancy"] for row in rows])), 4),
+        "mmr_redundancy": round(float(np.mean([row["mmr_redundancy"] for row in rows])), 4),
+    }
+
+
+def compare(query_vector, documents, k, mmr_lambda, budget_ms):
+    """Metrics of the ANN top-k and of the MMR top-k of candidates in ANN order."""
+    copies = [Document(page_content=doc.page_content, metadata=dict(doc.metadata)) for doc in documents]
+    vectors = normalize(pop_embeddings(copies))
+    query = normalize(np.asarray(query_vector, dtype=np.float32))
+    picked, rerank_ms = timed_rerank(query_vector, documents, k, mmr_lambda, budget_ms)
+    ann = list(range(min(k, len(documents))))
+    ann_relevance, ann_redundancy = selection_metrics(vectors, query, ann)
+    mmr_relevance, mmr_redundancy = selection_metrics(vectors, query, picked)
+    return {
+        "picked": picked,
+        "rerank_ms": rerank_ms,
+        "ann_relevance": ann_relevance,
+        "ann_redundancy": ann_redundancy,
+        "mmr_relevance": mmr_relevance,
+        "mmr_redundancy": mmr_redundancy,
+    }
+
+
+def synthetic_candidates(rng, dim, candidates, duplicates, noise, embedding_format="array"):
+    """
+    A query and candidates in ANN order: topics at decreasing similarity to the query, each one with
+    `duplicates` near-identical chunks. The embeddings are stored in `embedding_format`, as they are
+    decoded from the collection. Returns the query, the documents and the topic of every document.
+    """
+    query = normalize(rng.standard_normal(dim).astype(np.float32))
+    topics = -(-candidates // duplicates)
+    closeness = np.linspace(0.9, 0.3, topics, dtype=np.float32)[:, None]
+    centers = normalize(closeness * query + (1 - closeness) * normalize(rng.standard_normal((topics, dim)).astype(np.float32)))
+    topic_of = np.repeat(np.arange(topics), duplicates)[:candidates]
+    spread = noise / np.sqrt(dim) * rng.standard_normal((candidates, dim)).astype(np.float32)
+    vectors = normalize(centers[topic_of] + spread)
+    order = np.argsort(-(vectors @ query))
+    documents = [
+        Document(page_content=f"chunk {i}", metadata={EMBEDDING_FIELD: stored_embedding(vectors[i].tolist(), embedding_format)})
+        for i in order
+    ]
+    return query.tolist(), documents, topic_of[order]
+
+
+def stored_embedding(embedding, embedding_format):
+    return embedding if embedding_format == "array" else encode_embedding(embedding, embedding_format)
+
+
+@click.group()
+def cli():
+    """Benchmark of the MMR reranking stage against the ANN top-k."""
+    # Reranks over their budget are counted in the results instead of logged one by one
+    logging.getLogger().setLevel(logging.ERROR)
+
+
+@cli.command()
+@click.option("--source", "source_name", default="Trip Recommendations", show_default=True)
+@click.option("--user-id", default=None, help="userId pre-filter, for User Uploaded Data.")
+@click.option("--queries", "queries_file", default=common.QUERIES_FILE, show_default=True)
+@click.option("--k", default=10, show_default=True, help="Documents passed to the LLM.")
+@click.option("--candidate-k", "candidate_values", multiple=True, type=int, default=(30, 100, 250), show_default=True)
+@click.option("--lambda", "lambda_values", multiple=True, type=float, default=(0.3, 0.5, 0.7), show_default=True)
+@click.option("--budget-ms", default=20.0, show_default=True)
+@click.option("--output", default=None, help="Write the results as JSON.")
+def atlas(source_name, user_id, queries_file, k, candidate_values, lambda_values, budget_ms, output):
+    """
+    Rerank candidates fetched from a data source for the fixed query set.
+    """
+    from app.clients import registry
+    from app.mongodb_atlas_retriever_tools import DATA_SOURCES, to_document, vector_search_pipeline
+
+    source = DATA_SOURCES[source_name]
+    collection = registry.mongo_client[source.database][source.collection]
+    pre_filter = {"userId": user_id} if user_id else None
+    vectors = [registry.embeddings.embed_query(query) for query in common.load_queries(queries_file)]
+
+    def search(vector, limit, include_embedding):
+        with common.Timer() as timer:
+            results = list(
+                collection.aggregate(
+                    vector_search_pipeline(source, vector, k=limit, pre_filter=pre_filter, include_embedding=include_embedding)
+                )
+            )
+        return [to_document(result, source) for result in results], timer.ms
+
+    # Warm up the connection pool and the index before measuring
+    for vector in vectors:
+        search(vector, k, False)
+    top_k_ms = [search(vector, k, False)[1] for vector in vectors]
+
+    rows = []
+    for candidate_k in candidate_values:
+        fetched = [search(vector, candidate_k, True) for vector in vectors]
+        for mmr_lambda in lambda_values:
+            results = [
+                compare(vector, documents, k, mmr_lambda, budget_ms)
+                for vector, (documents, _) in zip(vectors, fetched)
+                if documents
+            ]
+            rows.append(
+                {
+                    "candidate_k": candidate_k,
+                    "lambda": mmr_lambda,
+                    "top_k_search_p50_ms": round(common.percentile(top_k_ms, 50), 2),
+                    "candidate_search_p50_ms": round(common.percentile([ms for _, ms in fetched], 50), 2),
+                    **summary_row(results, budget_ms),
+                }
+            )
+    print(f"{len(vectors)} queries on {source_name}, k={k}")
+    common.print_table(rows)
+    common.write_results(output, rows)
+    registry.shutdown()
+
+
+@cli.command()
+@click.option("--queries", "num_queries", default=200, show_default=True, help="Generated candidate sets.")
+@click.option("--k", default=10, show_default=True, help="Documents passed to the LLM.")
+@click.option("--candidates", "candidate_values", multiple=True, type=int, default=(30, 100, 300), show_default=True)
+@click.option("--lambda", "lambda_values", multiple=True, type=float, default=(0.3, 0.5, 0.7), show_default=True)
+@click.option("--dim", default=1536, show_default=True, help="Dimensions of the embeddings.")
+@click.option("--duplicates", default=5, show_default=True, help="Near-identical chunks per topic.")
+@click.option("--noise", default=0.2, show_default=True, help="Distance of the chunks to their topic, relative to its norm.")
+@click.option("--budget-ms", default=20.0, show_default=True)
+@click.option("--embedding-format", type=click.Choice(EMBEDDING_FORMATS), default="array", show_default=True,
+              help="Storage format of the embeddings, see mongodb_migrate_vectors.py.")
+@click.option("--seed", default=0, show_default=True)
+@click.option("--output", default=None, help="Write the results as JSON.")
+def synthetic(num_queries, k, candidate_values, lambda_values, dim, duplicates, noise, budget_ms, embedding_format, seed, output):
+    """
+    Rerank generated candidate sets of near-duplicate chunks.
+    """
+    rows = []
+    for candidates in candidate_values:
+        rng = np.random.default_rng(seed)
+        sets = [synthetic_candidates(rng, dim, candidates, duplicates, noise, embedding_format) for _ in range(num_queries)]
+        for mmr_lambda in lambda_values:
+            results = []
+            for query, documents, topics in sets:
+                result = compare(query, documents, k, mmr_lambda, budget_ms)
+                result["ann_topics"] = len(set(topics[:k].tolist()))
+                result["mmr_topics"] = len(set(topics[result["picked"]].tolist()))
+                results.append(result)
+            rows.append(
+                {
+                    "candidates": candidates,
+                    "lambda": mmr_lambda,
+                    **summary_row(results, budget_ms),
+                    "ann_topics": round(float(np.mean([result["ann_topics"] for result in results])), 2),
+                    "mmr_topics": round(float(np.mean([result["mmr_topics"] for result in results])), 2),
+                }
+            )
+    print(f"{num_queries} generated queries, k={k}, {duplicates} near-identical chunks per topic, {embedding_format} embeddings")
+    common.print_table(rows)
+    common.write_results(output, rows)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,154 @@
+"""
+Recall/latency sweep of the per-source vector search settings: k, numCandidates and minScore.
+
+`record` embeds the fixed query set once and stores, for every query, its vector and the exact nearest
+neighbours found by an exhaustive (ENN) `$vectorSearch`. `sweep` replays the recorded queries with
+approximate search for every combination of k, numCandidates and minScore, and reports recall@k against
+the recorded neighbours together with the latency percentiles. Replaying does not call Bedrock.
+
+    python benchmarks/retrieval_sweep.py record --output ground_truth.json
+    python benchmarks/retrieval_sweep.py sweep ground_truth.json --k 5 --k 10 --candidates 50 --candidates 200
+"""
+import json
+import os
+import sys
+
+import click
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common  # noqa: E402
+
+common.use_service(common.MAIN_DIR)
+load_dotenv()
+
+from app.clients import registry  # noqa: E402
+from app.mongodb_atlas_retriever_tools import DATA_SOURCES, vector_search_pipeline  # noqa: E402
+
+
+def source_collection(source):
+    return registry.mongo_client[source.database][source.collection]
+
+
+@click.group()
+def cli():
+    """Recall/latency sweep of the vector search settings against a recorded ground truth."""
+    pass
+
+
+@cli.command()
+@click.option("--source", "source_name", default="Trip Recommendations", show_default=True)
+@click.option("--user-id", default=None, help="userId pre-filter, for User Uploaded Data.")
+@click.option("--queries", "queries_file", default=common.QUERIES_FILE, show_default=True)
+@click.option("--k", "max_k", default=50, show_default=True, help="Number of exact neighbours recorded per query.")
+@click.option("--output", default="ground_truth.json", show_default=True)
+def record(source_name, user_id, queries_file, max_k, output):
+    """
+    Record the exact nearest neighbours of the fixed query set.
+    """
+    source = DATA_SOURCES[source_name]
+    pre_filter = {"userId": user_id} if user_id else None
+    collection = source_collection(source)
+    queries = []
+    for query in common.load_queries(queries_file):
+        vector = registry.embeddings.embed_query(query)
+        pipeline = vector_search_pipeline(source, vector, k=max_k, pre_filter=pre_filter)
+        vector_search = pipeline[0]["$vectorSearch"]
+        del vector_search["numCandidates"]
+        vector_search["exact"] = True
+        with common.Timer() as timer:
+            results = list(collection.aggregate(pipeline))
+        queries.append(
+            {
+                "query": query,
+                "vector": vector,
+                "ids": [str(result["_id"]) for result in results],
+                "scores": [result["score"] for result in results],
+                "exact_ms": round(timer.ms, 2),
+            }
+        )
+        print(f"Recorded {len(results)} neighbours in {timer.ms:.1f} ms: {query}")
+    with open(output, "w") as file:
+        json.dump({"source": source_name, "pre_filter": pre_filter, "k": max_k, "queries": queries}, file)
+    print(f"Ground truth of {len(queries)} queries written to {output}")
+
+
+@cli.command()
+@click.argument("ground_truth", type=click.Path(exists=True))
+@click.option("--k", "k_values", multiple=True, type=int, default=(5, 10, 20), show_default=True)
+@click.option(
+    "--candidates", "candidate_values", multiple=True, type=int, default=(50, 100, 200, 500, 1000), show_default=True
+)
+@click.option("--min-score", "min_scores", multiple=True, type=float, help="Score cut-offs to sweep (default: none).")
+@click.option("--repeat", default=3, show_default=True, help="Runs of every query per setting.")
+@click.option("--output", default=None, help="Write the results as JSON.")
+def sweep(ground_truth, k_values, candidate_values, min_scores, repeat, output):
+    """
+    Replay the recorded queries for every combination of k, numCandidates and minScore.
+    """
+    with open(ground_truth, "r") as file:
+        truth = json.load(file)
+    source = DATA_SOURCES[truth["source"]]
+    collection = source_collection(source)
+    queries = truth["queries"]
+
+    # Warm up the connection pool and the index before measuring
+    for query in queries:
+        list(collection.aggregate(vector_search_pipeline(source, query["vector"], k=10, pre_filter=truth["pre_filter"])))
+
+    rows = []
+    for k in k_values:
+        if k > truth["k"]:
+            print(f"Skipping k={k}, the ground truth only has {truth['k']} neighbours per query.")
+            continue
+        for num_candidates in candidate_values:
+            if num_candidates < k:
+                continue
+            for min_score in min_scores or (None,):
+                latencies = []
+                recalls = []
+                returned = 0
+                for query in queries:
+                    expected = {
+                        doc_id
+                        for doc_id, score in zip(query["ids"][:k], query["scores"][:k])
+                        if min_score is None or score >= min_score
+                    }
+                    pipeline = vector_search_pipeline(
+                        source,
+                        query["vector"],
+                        k=k,
+                        pre_filter=truth["pre_filter"],
+                        num_candidates=num_candidates,
+                        min_score=min_score,
+                    )
+                    for _ in range(repeat):
+                        with common.Timer() as timer:
+                            results = list(collection.aggregate(pipeline))
+                        latencies.append(timer.ms)
+                    returned += len(results)
+                    if expected:
+                        found = {str(result["_id"]) for result in results}
+                        recalls.append(len(found & expected) / len(expected))
+                summary = common.summarize(latencies)
+                rows.append(
+                    {
+                        "k": k,
+                        "numCandidates": num_candidates,
+                        "minScore": min_score if min_score is not None else "-",
+                        "recall": round(sum(recalls) / len(recalls), 4) if recalls else "-",
+                        "results": round(returned / len(queries), 1),
+                        "p50_ms": summary["p50_ms"],
+                        "p95_ms": summary["p95_ms"],
+                        "mean_ms": summary["mean_ms"],
+                    }
+                )
+    exact = [query["exact_ms"] for query in queries]
+    print(f"{len(queries)} queries on {truth['source']}, exact search p50 {common.percentile(exact, 50):.1f} ms")
+    common.print_table(rows)
+    common.write_results(output, rows)
+    registry.shutdown()
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,235 @@
+"""
+Concurrency benchmark of the native async SageMaker streaming against the threaded sync streaming.
+
+`run` starts a stub SageMaker runtime endpoint in a separate process. It answers
+`InvokeEndpointWithResponseStream` with the AWS event stream encoding of `PayloadPart` messages, each
+holding one server-sent event of the TGI messages API, one token every `--token-ms`. It then streams as
+many answers concurrently on one event loop with `astream` in two modes:
+
+- `async`: `SageMakerLLM._astream` and its aiobotocore client, what the RAG service uses now.
+- `threaded`: LangChain's default `_astream`, which runs the sync `_stream` and every `next()` of it in
+  the event loop's default thread pool, what the RAG service did before.
+
+It reports the wall time, the time to the first token, the streams and tokens per second, the event loop
+lag and the largest number of threads of the process.
+
+    python benchmarks/sagemaker_concurrency.py run --concurrency 10 --concurrency 100 --concurrency 1000
+"""
+import asyncio
+import binascii
+import json
+import logging
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from typing import List
+
+import click
+import httpx
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common  # noqa: E402
+
+common.use_service(common.MAIN_DIR)
+load_dotenv()
+
+import boto3  # noqa: E402
+from aiobotocore.config import AioConfig  # noqa: E402
+from aiobotocore.session import get_session  # noqa: E402
+from botocore.config import Config  # noqa: E402
+from langchain_core.language_models.llms import BaseLLM  # noqa: E402
+
+from app.sagemaker_llm import SageMakerLLM  # noqa: E402
+
+MODES = ["async", "threaded"]
+ENDPOINT_NAME = "benchmark-endpoint"
+LAG_INTERVAL = 0.005  # seconds
+# The stub endpoint does not check the request signatures
+CREDENTIALS = {"aws_access_key_id": "benchmark", "aws_secret_access_key": "benchmark", "region_name": "us-east-1"}
+
+
+class ThreadedSageMakerLLM(SageMakerLLM):
+    """SageMakerLLM without its native async streaming, streamed by LangChain through a thread pool."""
+
+    _astream = BaseLLM._astream
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def event_stream_message(headers, payload):
+    """Encode a message of the AWS event stream format (application/vnd.amazon.eventstream)."""
+    encoded_headers = b"".join(
+        struct.pack("!B", len(name)) + name.encode() + struct.pack("!BH", 7, len(value)) + value.encode()
+        for name, value in headers.items()
+    )
+    total_length = 16 + len(encoded_headers) + len(payload)
+    prelude = struct.pack("!II", total_length, len(encoded_headers))
+    prelude += struct.pack("!I", binascii.crc32(prelude))
+    message = prelude + encoded_headers + payload
+    return message + struct.pack("!I", binascii.crc32(message))
+
+
+def payload_part(data):
+    return event_stream_message(
+        {":event-type": "PayloadPart", ":content-type": "application/octet-stream", ":message-type": "event"},
+        data,
+    )
+
+
+def start_stub(port, tokens, token_ms):
+    process = subprocess.Popen(
+        [
+            sys.executable, os.path.abspath(__file__), "serve-stub", "--port", str(port),
+            "--tokens", str(tokens), "--token-ms", str(token_ms),
+        ]
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/ping").raise_for_status()
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise click.ClickException("The stub endpoint did not start.")
+
+
+async def measure_lag(lags, threads, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append((time.perf_counter() - start - LAG_INTERVAL) * 1000)
+        threads.append(threading.active_count())
+
+
+async def timed_stream(llm, prompt):
+    start = time.perf_counter()
+    first_token = None
+    tokens = 0
+    async for text in llm.astream(prompt):
+        if first_token is None:
+            first_token = time.perf_counter()
+        # The async path emits all the tokens of a network read as one chunk, every stub token is a word
+        tokens += len(text.split())
+    return {"first_token_ms": ((first_token or time.perf_counter()) - start) * 1000, "tokens": tokens}
+
+
+async def run_streams(mode, endpoint_url, concurrency, queries):
+    config = {"max_pool_connections": concurrency, "connect_timeout": 10, "read_timeout": 300, "retries": {"max_attempts": 1}}
+    sync_client = boto3.client("sagemaker-runtime", endpoint_url=endpoint_url, config=Config(**config), **CREDENTIALS)
+    async with get_session().create_client(
+        "sagemaker-runtime", endpoint_url=endpoint_url, config=AioConfig(**config), **CREDENTIALS
+    ) as async_client:
+        llm_class = SageMakerLLM if mode == "async" else ThreadedSageMakerLLM
+        llm = llm_class(endpoint_name=ENDPOINT_NAME, client=sync_client, async_client=async_client)
+        lags: List[float] = []
+        threads: List[int] = []
+        stop = asyncio.Event()
+        monitor = asyncio.create_task(measure_lag(lags, threads, stop))
+        start = time.perf_counter()
+        results = await asyncio.gather(*(timed_stream(llm, queries[i % len(queries)]) for i in range(concurrency)))
+        wall = time.perf_counter() - start
+        stop.set()
+        await monitor
+    sync_client.close()
+    return wall, results, lags, threads
+
+
+@click.group()
+def cli():
+    """Concurrency benchmark of the async and threaded SageMaker streaming against a stub endpoint."""
+    pass
+
+
+@cli.command()
+@click.option("--concurrency", "concurrency_values", multiple=True, type=int, default=(10, 100, 500), show_default=True)
+@click.option("--tokens", default=100, show_default=True, help="Tokens of every answer.")
+@click.option("--token-ms", default=20.0, show_default=True, help="Time between two tokens of the stub endpoint.")
+@click.option("--mode", "modes", multiple=True, type=click.Choice(MODES), default=MODES, show_default=True)
+@click.option("--output", default=None, help="Write the results as JSON.")
+def run(concurrency_values, tokens, token_ms, modes, output):
+    """
+    Stream concurrent answers from the stub endpoint with every mode and report the throughput and latencies.
+    """
+    logging.getLogger().setLevel(logging.WARNING)
+    port = free_port()
+    stub = start_stub(port, tokens, token_ms)
+    queries = common.load_queries()
+    rows = []
+    try:
+        for concurrency in concurrency_values:
+            for mode in modes:
+                wall, results, lags, threads = asyncio.run(
+                    run_streams(mode, f"http://127.0.0.1:{port}", concurrency, queries)
+                )
+                first_token = common.summarize([result["first_token_ms"] for result in results])
+                lag = common.summarize(lags)
+                total_tokens = sum(result["tokens"] for result in results)
+                rows.append(
+                    {
+                        "mode": mode,
+                        "concurrency": concurrency,
+                        "wall_s": round(wall, 2),
+                        "ttft_p50_ms": first_token["p50_ms"],
+                        "ttft_p95_ms": first_token["p95_ms"],
+                        "streams_per_s": round(concurrency / wall, 1),
+                        "tokens_per_s": round(total_tokens / wall),
+                        "lag_p99_ms": lag["p99_ms"],
+                        "max_threads": max(threads, default=threading.active_count()),
+                    }
+                )
+    finally:
+        stub.terminate()
+        stub.wait()
+    print(f"{tokens} tokens per answer every {token_ms} ms, one answer takes at least {tokens * token_ms / 1000:.1f}s")
+    common.print_table(rows)
+    common.write_results(output, rows)
+
+
+@cli.command("serve-stub", hidden=True)
+@click.option("--port", type=int, required=True)
+@click.option("--tokens", type=int, required=True)
+@click.option("--token-ms", type=float, required=True)
+def serve_stub(port, tokens, token_ms):
+    """
+    Serve a stub of the SageMaker runtime's InvokeEndpointWithResponseStream.
+    """
+    import uvicorn
+    from fastapi import FastAPI
+    from fastapi.responses import StreamingResponse
+
+    app = FastAPI()
+
+    @app.get("/ping")
+    def ping():
+        return {"status": "ok"}
+
+    @app.post("/endpoints/{endpoint_name}/invocations-response-stream")
+    async def invoke_stream(endpoint_name: str):
+        async def parts():
+            for i in range(tokens):
+                await asyncio.sleep(token_ms / 1000)
+                frame = {"choices": [{"index": 0, "delta": {"content": f"token{i} "}}]}
+                yield payload_part(f"data: {json.dumps(frame)}\n\n".encode("utf-8"))
+            yield payload_part(b"data: [DONE]\n\n")
+
+        return StreamingResponse(
+            parts(),
+            media_type="application/vnd.amazon.eventstream",
+            headers={"X-Amzn-Invoked-Production-Variant": "AllTraffic"},
+        )
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", backlog=4096)
+
+
+if __name__ == "__main__":
+    cli()
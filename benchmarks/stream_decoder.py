@@ -0,0 +1,198 @@
+"""
+Benchmark of the SageMaker response stream decoding over stream fixtures.
+
+Every fixture in `fixtures/sagemaker_stream` holds the payload parts of one streamed answer (base64, as
+the parts can end inside a UTF-8 character), the extra stop sequences of the call and the text the
+stream must decode to. The committed fixtures are synthetic: answers in the formats of the TGI messages
+API, cut into payload parts to cover the edge cases of the decoder, and their description says so.
+
+`run` feeds the parts through `StreamDecoder` and `StopSequenceFilter` the way `SageMakerLLM._stream`
+does, checks the decoded text and reports the decoding time per stream, per part and per token, next to
+a naive decoder that concatenates and re-splits immutable bytes per part. Both are timed in alternating
+rounds and the fastest round of each is kept, to discount the noise of a shared machine. `record`
+captures a real fixture from a live endpoint.
+
+    python benchmarks/stream_decoder.py run
+    python benchmarks/stream_decoder.py record --endpoint-name my-endpoint --prompt "Tell me about Kyoto" --name kyoto
+"""
+import base64
+import glob
+import json
+import os
+import sys
+import timeit
+
+import click
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common  # noqa: E402
+
+common.use_service(common.MAIN_DIR)
+load_dotenv()
+
+from app.sagemaker_llm import DEFAULT_STOP, SageMakerLLM, StopSequenceFilter, StreamDecoder  # noqa: E402
+
+STREAM_FIXTURES_DIR = os.path.join(common.FIXTURES_DIR, "sagemaker_stream")
+
+
+def decode(parts, stop):
+    """Decode the payload parts like SageMakerLLM._stream, returning the text and the number of tokens."""
+    decoder = StreamDecoder()
+    stop_filter = StopSequenceFilter(DEFAULT_STOP + stop)
+    out = []
+    tokens = 0
+    for part in parts:
+        for text in decoder.feed(part):
+            tokens += 1
+            out.append(stop_filter.feed(text))
+        if stop_filter.stopped:
+            return "".join(out), tokens
+    for text in decoder.flush():
+        tokens += 1
+        out.append(stop_filter.feed(text))
+    out.append(stop_filter.flush())
+    return "".join(out), tokens
+
+
+def naive_line_text(line):
+    line = line.strip()
+    if not line or line.startswith(b":") or line.startswith((b"event:", b"id:", b"retry:")):
+        return ""
+    if line.startswith(b"data:"):
+        line = line[5:].strip()
+    if line == b"[DONE]":
+        return ""
+    payload = json.loads(line.decode("utf-8"))
+    return "".join(StreamDecoder._choice_text(choice) for choice in payload.get("choices", []))
+
+
+def naive_decode(parts, stop):
+    """Reference decoder: immutable bytes concatenation, re-splitting and a stop search over all text per part."""
+    stops = [sequence for sequence in DEFAULT_STOP + stop if sequence]
+    buffer = b""
+    text = ""
+    for part in parts:
+        buffer = buffer + part
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            text += naive_line_text(line)
+        positions = [text.find(sequence) for sequence in stops if sequence in text]
+        if positions:
+            return text[: min(positions)]
+    text += naive_line_text(buffer)
+    positions = [text.find(sequence) for sequence in stops if sequence in text]
+    return text[: min(positions)] if positions else text
+
+
+def load_fixture(path):
+    with open(path, "r") as file:
+        fixture = json.load(file)
+    fixture["name"] = os.path.splitext(os.path.basename(path))[0]
+    fixture["parts"] = [base64.b64decode(part) for part in fixture["parts"]]
+    return fixture
+
+
+def time_us(functions, parts, stop, repeat, rounds):
+    """Mean time of a decode over `repeat` runs of every function, in alternating rounds, the fastest round of each."""
+    timings = [[] for _ in functions]
+    for _ in range(rounds):
+        for function, function_timings in zip(functions, timings):
+            function_timings.append(timeit.timeit(lambda: function(parts, stop), number=repeat))
+    return [min(function_timings) / repeat * 1e6 for function_timings in timings]
+
+
+@click.group()
+def cli():
+    """Benchmark of the SageMaker stream decoder over stream fixtures."""
+    pass
+
+
+@cli.command()
+@click.option("--fixtures", "fixtures_dir", default=STREAM_FIXTURES_DIR, show_default=True)
+@click.option("--repeat", default=50, show_default=True, help="Decodes of every fixture per timing round.")
+@click.option("--rounds", default=10, show_default=True, help="Timing rounds, the fastest one is reported.")
+@click.option("--output", default=None, help="Write the results as JSON.")
+def run(fixtures_dir, repeat, rounds, output):
+    """
+    Check and time the decoding of every fixture.
+    """
+    rows = []
+    failures = 0
+    for path in sorted(glob.glob(os.path.join(fixtures_dir, "*.json"))):
+        fixture = load_fixture(path)
+        stop = fixture.get("stop", [])
+        parts = fixture["parts"]
+        text, tokens = decode(parts, stop)
+        correct = text == fixture["expected"]
+        try:
+            naive_correct = naive_decode(parts, stop) == fixture["expected"]
+        except (UnicodeDecodeError, ValueError):
+            naive_correct = False
+        if not correct:
+            failures += 1
+            print(f"{fixture['name']}: decoded {text[:80]!r}..., expected {fixture['expected'][:80]!r}...")
+        if naive_correct:
+            decode_us, naive_us = time_us([decode, naive_decode], parts, stop, repeat, rounds)
+        else:
+            (decode_us,) = time_us([decode], parts, stop, repeat, rounds)
+            naive_us = float("nan")
+        num_bytes = sum(len(part) for part in parts)
+        rows.append(
+            {
+                "fixture": fixture["name"],
+                "parts": len(parts),
+                "bytes": num_bytes,
+                "tokens": tokens,
+                "ok": "yes" if correct else "NO",
+                "stream_us": round(decode_us, 1),
+                "us_per_part": round(decode_us / len(parts), 2),
+                "us_per_token": round(decode_us / max(tokens, 1), 2),
+                "MB_per_s": round(num_bytes / decode_us, 1),
+                "naive_ok": "yes" if naive_correct else "NO",
+                "naive_us": round(naive_us, 1),
+            }
+        )
+    common.print_table(rows)
+    common.write_results(output, rows)
+    if failures:
+        sys.exit(f"{failures} fixture(s) did not decode to their expected text.")
+
+
+@cli.command()
+@click.option("--endpoint-name", default=lambda: os.getenv("SAGEMAKER_ENDPOINT_NAME"), required=True)
+@click.option("--region", default=lambda: os.getenv("AWS_REGION", "us-east-1"))
+@click.option("--prompt", required=True)
+@click.option("--stop", multiple=True, help="Extra stop sequences of the call.")
+@click.option("--name", required=True, help="Name of the fixture file.")
+@click.option("--fixtures", "fixtures_dir", default=STREAM_FIXTURES_DIR, show_default=True)
+def record(endpoint_name, region, prompt, stop, name, fixtures_dir):
+    """
+    Record the payload parts of a streamed answer from a live endpoint as a new fixture.
+    The expected text is what the current decoder makes of it, review it before committing the fixture.
+    """
+    llm = SageMakerLLM(endpoint_name=endpoint_name, region_name=region)
+    response = llm._sagemaker_runtime.invoke_endpoint_with_response_stream(
+        EndpointName=endpoint_name,
+        ContentType=llm.content_type,
+        Body=llm._payload(prompt, list(stop)),
+        Accept="application/jsonlines",
+    )
+    parts = [event["PayloadPart"]["Bytes"] for event in response["Body"] if "PayloadPart" in event]
+    text, tokens = decode(parts, list(stop))
+    fixture = {
+        "description": f"Recorded from {endpoint_name}: {prompt}",
+        "stop": list(stop),
+        "expected": text,
+        "tokens": tokens,
+        "parts": [base64.b64encode(part).decode("ascii") for part in parts],
+    }
+    path = os.path.join(fixtures_dir, f"{name}.json")
+    with open(path, "w") as file:
+        json.dump(fixture, file, indent=1, ensure_ascii=False)
+        file.write("\n")
+    print(f"Recorded {len(parts)} payload parts ({tokens} tokens) to {path}:\n{text}")
+
+
+if __name__ == "__main__":
+    cli()
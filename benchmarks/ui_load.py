@@ -0,0 +1,263 @@
+"""
+Load test of the Gradio UI's chat handler with many concurrent chat sessions against stub backends.
+
+`run` starts a stub of the loader and of the RAG service in a separate process: the loader streams the
+progress events of an upload, and the RAG service streams the tokens of an answer at a fixed pace, like
+the real services do. It then runs `process_request` of the UI for many concurrent chat sessions on one
+event loop, as Gradio does, some of them uploading a file before asking their question, and reports:
+
+- the event loop lag, measured by a task that wakes up every few milliseconds,
+- the time to the first frame of a turn, for the sessions that only chat and for those that upload,
+- the duration of a turn and the number of frames sent.
+
+The `blocking` client replays the previous ingest client of the UI, a blocking `requests.post` on the
+event loop, to compare with the current streamed `httpx` client.
+
+    python benchmarks/ui_load.py run --sessions 10 --sessions 100 --upload-ratio 0.2
+"""
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+import click
+import httpx
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common  # noqa: E402
+
+common.use_service(common.UI_DIR)
+load_dotenv()
+
+CLIENTS = ["httpx", "blocking"]
+LAG_INTERVAL = 0.005  # seconds
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stubs(port, tokens, token_ms, ingest_ms):
+    process = subprocess.Popen(
+        [
+            sys.executable, os.path.abspath(__file__), "serve-stubs", "--port", str(port),
+            "--tokens", str(tokens), "--token-ms", str(token_ms), "--ingest-ms", str(ingest_ms),
+        ]
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/health").raise_for_status()
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise click.ClickException("The stub backends did not start.")
+
+
+def use_stubs(ui, port):
+    """Point the UI at the stub backends, with new clients as they are bound to the event loop they ran on."""
+    from langserve import RemoteRunnable
+
+    ui.LOADER_URL = f"http://127.0.0.1:{port}"
+    ui.rag = RemoteRunnable(f"http://127.0.0.1:{port}/rag")
+    ui.http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(None, connect=10.0),
+        limits=httpx.Limits(
+            max_connections=ui.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=ui.HTTP_MAX_CONNECTIONS,
+        ),
+    )
+
+
+async def blocking_ingest_data(userId, urls, new_files):
+    """The previous ingest client of the UI: a blocking requests call on the event loop."""
+    import requests
+
+    import main as ui
+
+    payload = {"json_input_params": json.dumps({"userId": userId, "WebPagesToIngest": urls})}
+    files = [("files", (os.path.basename(file), open(file, "rb"))) for file in new_files]
+    try:
+        response = requests.post(f"{ui.LOADER_URL}/upload/stream", data=payload, files=files)
+    finally:
+        for _, (_, file) in files:
+            file.close()
+    for line in response.text.splitlines():
+        if line:
+            yield json.loads(line)
+
+
+async def measure_lag(lags, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append((time.perf_counter() - start - LAG_INTERVAL) * 1000)
+
+
+async def chat_session(ui, session, upload_file, query):
+    message = {"text": query, "files": [upload_file] if upload_file else []}
+    start = time.perf_counter()
+    first_frame = None
+    frames = 0
+    async for _ in ui.process_request(message, [], f"user{session}@example.com", ["Trip Recommendations"]):
+        frames += 1
+        if first_frame is None:
+            first_frame = time.perf_counter()
+    return {
+        "upload": bool(upload_file),
+        "first_frame_ms": ((first_frame or time.perf_counter()) - start) * 1000,
+        "turn_ms": (time.perf_counter() - start) * 1000,
+        "frames": frames,
+    }
+
+
+async def run_sessions(ui, sessions, upload_ratio, upload_file, queries):
+    lags: List[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(measure_lag(lags, stop))
+    uploads = round(sessions * upload_ratio)
+    results = await asyncio.gather(
+        *(
+            chat_session(ui, session, upload_file if session < uploads else None, queries[session % len(queries)])
+            for session in range(sessions)
+        )
+    )
+    stop.set()
+    await monitor
+    return lags, results
+
+
+@click.group()
+def cli():
+    """Load test of the UI's chat handler against stub backends."""
+    pass
+
+
+@cli.command()
+@click.option("--sessions", "session_values", multiple=True, type=int, default=(10, 50, 200), show_default=True)
+@click.option("--upload-ratio", default=0.2, show_default=True, help="Share of the sessions that upload a file.")
+@click.option("--upload-mb", default=20, show_default=True, help="Size of the uploaded file.")
+@click.option("--tokens", default=200, show_default=True, help="Tokens of every answer.")
+@click.option("--token-ms", default=10.0, show_default=True, help="Time between two answer tokens.")
+@click.option("--ingest-ms", default=500.0, show_default=True, help="Time the stub loader takes per ingest stage.")
+@click.option("--client", "clients", multiple=True, type=click.Choice(CLIENTS), default=CLIENTS, show_default=True)
+@click.option("--output", default=None, help="Write the results as JSON.")
+def run(session_values, upload_ratio, upload_mb, tokens, token_ms, ingest_ms, clients, output):
+    """
+    Run concurrent chat sessions against the stub backends and report the event loop lag and the latencies.
+    """
+    import main as ui
+
+    port = free_port()
+    stubs = start_stubs(port, tokens, token_ms, ingest_ms)
+    ingest_data = ui.ingest_data
+    queries = common.load_queries()
+    rows = []
+    try:
+        with tempfile.NamedTemporaryFile(suffix=".txt") as upload_file:
+            upload_file.write(b"MongoDB Atlas Vector Search.\n" * (upload_mb * 1024 * 1024 // 29))
+            upload_file.flush()
+            for client in clients:
+                ui.ingest_data = ingest_data if client == "httpx" else blocking_ingest_data
+                for sessions in session_values:
+                    use_stubs(ui, port)
+                    lags, results = asyncio.run(run_sessions(ui, sessions, upload_ratio, upload_file.name, queries))
+                    lag = common.summarize(lags)
+                    chats = [result for result in results if not result["upload"]]
+                    uploads = [result for result in results if result["upload"]]
+                    rows.append(
+                        {
+                            "client": client,
+                            "sessions": sessions,
+                            "lag_p50_ms": lag["p50_ms"],
+                            "lag_p99_ms": lag["p99_ms"],
+                            "lag_max_ms": lag["max_ms"],
+                            # Without an upload the first frame of a turn is the first frame of its answer
+                            "chat_first_frame_p95_ms": common.summarize([r["first_frame_ms"] for r in chats])["p95_ms"],
+                            "upload_first_frame_p95_ms": common.summarize([r["first_frame_ms"] for r in uploads])["p95_ms"],
+                            "turn_p95_ms": common.summarize([r["turn_ms"] for r in results])["p95_ms"],
+                            "frames_mean": round(sum(r["frames"] for r in results) / len(results), 1),
+                        }
+                    )
+    finally:
+        stubs.terminate()
+        stubs.wait()
+    print(f"{tokens} tokens per answer every {token_ms} ms, {upload_ratio:.0%} of the sessions upload {upload_mb} MB")
+    common.print_table(rows)
+    common.write_results(output, rows)
+
+
+@cli.command("serve-stubs", hidden=True)
+@click.option("--port", type=int, required=True)
+@click.option("--tokens", type=int, required=True)
+@click.option("--token-ms", type=float, required=True)
+@click.option("--ingest-ms", type=float, required=True)
+def serve_stubs(port, tokens, token_ms, ingest_ms):
+    """
+    Serve stubs of the loader's /upload/stream and /jobs/{job_id}/cancel and of the RAG service's /rag/stream.
+    """
+    import uuid
+
+    import uvicorn
+    from fastapi import FastAPI, File, Form, UploadFile
+    from fastapi.responses import StreamingResponse
+
+    app = FastAPI()
+    answer = [f"token{i} " for i in range(tokens)]
+
+    @app.get("/health")
+    def health():
+        return {"status": "ok"}
+
+    @app.post("/upload/stream")
+    async def upload_stream(files: List[UploadFile] = File([]), json_input_params: str = Form(...)):
+        names = [file.filename for file in files]
+        for file in files:
+            await file.close()
+
+        async def events():
+            yield json.dumps({"event": "queued", "job_id": uuid.uuid4().hex}) + "\n"
+            yield json.dumps({"event": "files_saved", "files": names}) + "\n"
+            stages = [
+                {"event": "chunks_parsed", "source": name, "chunks": 100} for name in names
+            ] + [
+                {"event": "chunks_embedded", "embedded": 100, "total": 100},
+                {"event": "chunks_written", "written": 100, "total": 100},
+                {"event": "index_queryable", "queryable": True},
+            ]
+            for stage in stages:
+                await asyncio.sleep(ingest_ms / 1000)
+                yield json.dumps(stage) + "\n"
+            yield json.dumps({"event": "done", "message": "Successfully uploaded the file(s)"}) + "\n"
+
+        return StreamingResponse(events(), media_type="application/x-ndjson")
+
+    @app.post("/jobs/{job_id}/cancel")
+    def cancel(job_id: str):
+        return {"job_id": job_id, "state": "cancelled"}
+
+    @app.post("/rag/stream")
+    async def rag_stream():
+        async def events():
+            yield f"event: metadata\ndata: {json.dumps({'run_id': str(uuid.uuid4())})}\n\n"
+            for token in answer:
+                await asyncio.sleep(token_ms / 1000)
+                yield f"event: data\ndata: {json.dumps(token)}\n\n"
+            yield "event: end\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    cli()
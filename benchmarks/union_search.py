@@ -0,0 +1,200 @@
+"""
+Benchmark of the retriever's "union" search mode against its "fanout" mode.
+
+`$unionWith` only reaches collections of the same database, and the trip recommendations and the uploaded
+documents live in different ones, so `setup` copies a sample of both collections into a scratch database
+together with their vector search indexes. `run` points the data sources at the scratch database and
+retrieves the fixed query set from both of them with each mode, one query at a time and under concurrent
+load, and reports the latencies and how many of the top-k documents both modes agree on. The queries
+are embedded once during a warm-up pass and then served from the in-process embedding cache, so the
+latencies compare the searches alone. `teardown` drops the scratch database.
+
+    python benchmarks/union_search.py setup --user-id alice@example.com
+    python benchmarks/union_search.py run --user-id alice@example.com --concurrency 1 --concurrency 16
+    python benchmarks/union_search.py teardown
+"""
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+
+import click
+from dotenv import load_dotenv
+from pymongo.operations import SearchIndexModel
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common  # noqa: E402
+
+common.use_service(common.MAIN_DIR)
+load_dotenv()
+
+from app.clients import registry  # noqa: E402
+from app.mongodb_atlas_retriever_tools import DATA_SOURCES, MongoDBAtlasCustomRetriever  # noqa: E402
+
+SOURCE_NAMES = ["Trip Recommendations", "User Uploaded Data"]
+MODES = ["fanout", "union"]
+SOURCE_DATABASES = {DATA_SOURCES[name].database for name in SOURCE_NAMES}
+
+
+def copy_search_indexes(source, target):
+    """Create the vector search indexes of a collection on another one and wait until they are queryable."""
+    names = []
+    for index in source.list_search_indexes():
+        if index.get("type") != "vectorSearch":
+            continue
+        target.create_search_index(
+            SearchIndexModel(definition=index["latestDefinition"], name=index["name"], type="vectorSearch")
+        )
+        names.append(index["name"])
+    for name in names:
+        if not common.wait_for_search_index(target, name):
+            raise click.ClickException(f"Search index {name} of {target.full_name} is not queryable.")
+    return names
+
+
+def use_database(database):
+    """Point the data sources at the scratch database."""
+    for name in SOURCE_NAMES:
+        DATA_SOURCES[name] = replace(DATA_SOURCES[name], database=database)
+
+
+def query_inputs(queries, user_id):
+    return [json.dumps({"query": query, "dataSource": SOURCE_NAMES, "userId": user_id}) for query in queries]
+
+
+def retrieve_all(retriever, inputs):
+    return [retriever.invoke(query) for query in inputs]
+
+
+def timed_invoke(retriever, inputs):
+    with common.Timer() as timer:
+        documents = retriever.invoke(inputs)
+    return timer.ms, documents
+
+
+async def timed_ainvoke(retriever, inputs):
+    with common.Timer() as timer:
+        documents = await retriever.ainvoke(inputs)
+    return timer.ms, documents
+
+
+def run_load(retriever, inputs, concurrency, repeat):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda query: timed_invoke(retriever, query), inputs * repeat))
+
+
+async def arun_load(retriever, inputs, concurrency, repeat):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(query):
+        async with semaphore:
+            return await timed_ainvoke(retriever, query)
+
+    return await asyncio.gather(*(limited(query) for query in inputs * repeat))
+
+
+def top_k_overlap(fanout_documents, union_documents):
+    fanout_texts = {doc.page_content for doc in fanout_documents}
+    union_texts = {doc.page_content for doc in union_documents}
+    if not fanout_texts and not union_texts:
+        return 1.0
+    return len(fanout_texts & union_texts) / max(len(fanout_texts), len(union_texts))
+
+
+@click.group()
+def cli():
+    """Benchmark of the union search mode against the fan-out search mode."""
+    pass
+
+
+@cli.command()
+@click.option("--database", default="maap_benchmark", show_default=True, help="Scratch database.")
+@click.option("--user-id", required=True, help="User whose uploaded documents are copied.")
+@click.option("--sample", default=5000, show_default=True, help="Documents copied per collection.")
+def setup(database, user_id, sample):
+    """
+    Copy a sample of both data sources and their vector search indexes into the scratch database.
+    """
+    for name in SOURCE_NAMES:
+        source = DATA_SOURCES[name]
+        source_collection = registry.mongo_client[source.database][source.collection]
+        target = registry.mongo_client[database][source.collection]
+        if target.estimated_document_count():
+            raise click.ClickException(f"{target.full_name} is not empty, run teardown first.")
+        match = {"userId": user_id} if "userId" in source.filter_fields else None
+        copied = common.copy_sample(source_collection, target, sample, match)
+        indexes = copy_search_indexes(source_collection, target)
+        print(f"Copied {copied} documents of {name} to {target.full_name}, indexes: {', '.join(indexes)}")
+    registry.shutdown()
+
+
+@cli.command()
+@click.option("--database", default="maap_benchmark", show_default=True, help="Scratch database.")
+@click.option("--user-id", required=True)
+@click.option("--queries", "queries_file", default=common.QUERIES_FILE, show_default=True)
+@click.option("--k", default=10, show_default=True)
+@click.option("--concurrency", "concurrency_values", multiple=True, type=int, default=(1, 8, 32), show_default=True)
+@click.option("--repeat", default=3, show_default=True, help="Runs of the query set per mode and concurrency.")
+@click.option("--use-async", is_flag=True, help="Retrieve with ainvoke on one event loop instead of threads.")
+@click.option("--output", default=None, help="Write the results as JSON.")
+def run(database, user_id, queries_file, k, concurrency_values, repeat, use_async, output):
+    """
+    Compare the latency and the results of the fanout and union modes on the scratch database.
+    """
+    use_database(database)
+    inputs = query_inputs(common.load_queries(queries_file), user_id)
+    retrievers = {mode: MongoDBAtlasCustomRetriever(k=k, search_mode=mode) for mode in MODES}
+
+    async def measure():
+        # The warm-up pass embeds the queries and opens the connections of the measured path
+        results = {}
+        for mode in MODES:
+            if use_async:
+                results[mode] = [await retrievers[mode].ainvoke(query) for query in inputs]
+            else:
+                results[mode] = await asyncio.to_thread(retrieve_all, retrievers[mode], inputs)
+        rows = []
+        for concurrency in concurrency_values:
+            for mode in MODES:
+                if use_async:
+                    timings = await arun_load(retrievers[mode], inputs, concurrency, repeat)
+                else:
+                    timings = await asyncio.to_thread(run_load, retrievers[mode], inputs, concurrency, repeat)
+                latencies = [ms for ms, _ in timings]
+                summary = common.summarize(latencies)
+                rows.append({"mode": mode, "concurrency": concurrency, **summary})
+        await registry.ashutdown()
+        return results, rows
+
+    results, rows = asyncio.run(measure())
+    overlaps = [top_k_overlap(fanout, union) for fanout, union in zip(results["fanout"], results["union"])]
+    identical = sum(
+        [doc.page_content for doc in fanout] == [doc.page_content for doc in union]
+        for fanout, union in zip(results["fanout"], results["union"])
+    )
+    print(
+        f"{len(inputs)} queries, top-{k} overlap of union with fanout: mean "
+        f"{sum(overlaps) / len(overlaps):.3f}, min {min(overlaps):.3f}, identical order for {identical}"
+    )
+    common.print_table(rows, ["mode", "concurrency", "n", "p50_ms", "p95_ms", "p99_ms", "mean_ms", "max_ms"])
+    common.write_results(output, {"overlap": overlaps, "identical": identical, "latency": rows})
+
+
+@cli.command()
+@click.option("--database", default="maap_benchmark", show_default=True, help="Scratch database.")
+@click.confirmation_option(prompt="Drop the scratch database?")
+def teardown(database):
+    """
+    Drop the scratch database.
+    """
+    if database in SOURCE_DATABASES:
+        raise click.ClickException(f"{database} holds a data source, it is not a scratch database.")
+    registry.mongo_client.drop_database(database)
+    print(f"Dropped {database}")
+    registry.shutdown()
+
+
+if __name__ == "__main__":
+    cli()
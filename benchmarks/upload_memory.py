@@ -0,0 +1,216 @@
+"""
+Memory ceiling of a large file upload from the UI to the loader.
+
+`run` writes a test file (500 MB by default) and uploads it over HTTP to a loader stand-in that copies
+the multipart upload to disk, for every combination of client and copy:
+
+- client `requests`: the previous UI code, `requests.post` with the file in `files`, which builds the
+  whole multipart body in memory before sending it.
+- client `httpx`: the current UI code, a streamed `httpx.AsyncClient` multipart request read from disk.
+- copy `copyfileobj`: the previous `UploadFiles`, `shutil.copyfileobj` with its default buffer.
+- copy `copy_upload`: the current `UploadFiles`, `utils.CopyUpload` and its kernel copy.
+
+Each client and each server runs in its own process, and reports its peak resident set size (ru_maxrss)
+and its growth over the resident set size it had before the upload.
+
+    python benchmarks/upload_memory.py run --size-mb 500
+"""
+import asyncio
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+import httpx
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common  # noqa: E402
+
+common.use_service(common.LOADER_DIR)
+load_dotenv()
+
+CLIENTS = ["requests", "httpx"]
+COPIES = ["copyfileobj", "copy_upload"]
+WRITE_BUFFER_SIZE = 8 * 1024 * 1024
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def write_test_file(path, size_mb):
+    block = os.urandom(WRITE_BUFFER_SIZE)
+    remaining = size_mb * 1024 * 1024
+    with open(path, "wb") as file:
+        while remaining > 0:
+            file.write(block[:remaining])
+            remaining -= len(block)
+
+
+def start_server(copy, port, directory):
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "serve", "--copy", copy, "--port", str(port), "--directory", directory]
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/stats").raise_for_status()
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise click.ClickException("The loader stand-in did not start.")
+
+
+@click.group()
+def cli():
+    """Memory ceiling of a large file upload from the UI to the loader."""
+    pass
+
+
+@cli.command()
+@click.option("--size-mb", default=500, show_default=True, help="Size of the uploaded test file.")
+@click.option("--directory", default=None, help="Where the test file and the uploads are written (default: a temporary one).")
+@click.option("--output", default=None, help="Write the results as JSON.")
+def run(size_mb, directory, output):
+    """
+    Upload the test file with every client to a loader stand-in with every copy, and report the memory.
+    """
+    with tempfile.TemporaryDirectory(dir=directory) as work_dir:
+        test_file = os.path.join(work_dir, "upload.bin")
+        write_test_file(test_file, size_mb)
+        rows = []
+        for copy in COPIES:
+            for client in CLIENTS:
+                port = free_port()
+                server = start_server(copy, port, work_dir)
+                try:
+                    result = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), "upload", client, test_file, "--port", str(port)],
+                        check=True,
+                        capture_output=True,
+                        text=True,
+                    )
+                    upload = json.loads(result.stdout.strip().splitlines()[-1])
+                    server_stats = httpx.get(f"http://127.0.0.1:{port}/stats").json()
+                finally:
+                    server.terminate()
+                    server.wait()
+                rows.append(
+                    {
+                        "client": client,
+                        "copy": copy,
+                        "upload_s": upload["seconds"],
+                        "client_peak_mb": upload["peak_rss_mb"],
+                        "client_growth_mb": upload["growth_mb"],
+                        "server_peak_mb": server_stats["peak_rss_mb"],
+                        "server_growth_mb": server_stats["growth_mb"],
+                        "copy_s": server_stats["copy_seconds"],
+                    }
+                )
+    print(f"Uploads of {size_mb} MB")
+    common.print_table(rows)
+    common.write_results(output, rows)
+
+
+@cli.command(hidden=True)
+@click.argument("client", type=click.Choice(CLIENTS))
+@click.argument("file_name")
+@click.option("--port", type=int, required=True)
+def upload(client, file_name, port):
+    """
+    Upload a file with one client and print its time and memory as JSON.
+    """
+    url = f"http://127.0.0.1:{port}/upload"
+    payload = {"userId": "benchmark"}
+    if client == "requests":
+        import requests
+
+        baseline = peak_rss_mb()
+        start = time.perf_counter()
+        with open(file_name, "rb") as file:
+            requests.post(url, data=payload, files=[("files", (os.path.basename(file_name), file))]).raise_for_status()
+    else:
+        baseline = peak_rss_mb()
+        start = time.perf_counter()
+
+        async def stream():
+            async with httpx.AsyncClient(timeout=httpx.Timeout(None, connect=10.0)) as http_client:
+                with open(file_name, "rb") as file:
+                    files = [("files", (os.path.basename(file_name), file, "application/octet-stream"))]
+                    async with http_client.stream("POST", url, data=payload, files=files) as response:
+                        response.raise_for_status()
+                        await response.aread()
+
+        asyncio.run(stream())
+    seconds = time.perf_counter() - start
+    peak = peak_rss_mb()
+    print(json.dumps({"seconds": round(seconds, 2), "peak_rss_mb": round(peak, 1), "growth_mb": round(peak - baseline, 1)}))
+
+
+@cli.command(hidden=True)
+@click.option("--copy", type=click.Choice(COPIES), required=True)
+@click.option("--port", type=int, required=True)
+@click.option("--directory", required=True)
+def serve(copy, port, directory):
+    """
+    Serve a loader stand-in that copies multipart uploads to disk like UploadFiles.
+    """
+    from typing import List
+
+    import uvicorn
+    from fastapi import FastAPI, File, Form, UploadFile
+
+    # The loader logs to ./applogs, the Dockerfile creates it in the working directory
+    os.makedirs(os.path.join(directory, "applogs"), exist_ok=True)
+    os.chdir(directory)
+    from utils import CopyUpload
+
+    app = FastAPI()
+    stats = {"copy_seconds": 0.0}
+    baseline = peak_rss_mb()
+
+    @app.post("/upload")
+    def upload_files(userId: str = Form(...), files: List[UploadFile] = File(...)):
+        for file in files:
+            file_name = os.path.join(directory, f"stored_{file.filename}")
+            start = time.perf_counter()
+            with open(file_name, "wb") as f:
+                if copy == "copy_upload":
+                    CopyUpload(file.file, f)
+                else:
+                    shutil.copyfileobj(file.file, f)
+            stats["copy_seconds"] += time.perf_counter() - start
+            file.file.close()
+            os.remove(file_name)
+        return {"message": "ok"}
+
+    @app.get("/stats")
+    def get_stats():
+        peak = peak_rss_mb()
+        return {
+            "copy_seconds": round(stats["copy_seconds"], 2),
+            "peak_rss_mb": round(peak, 1),
+            "growth_mb": round(peak - baseline, 1),
+        }
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    cli()
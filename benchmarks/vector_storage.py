@@ -0,0 +1,210 @@
+"""
+Benchmark of the storage formats of the chunk embeddings and of the vector index quantization options.
+
+`setup` copies a sample of the uploaded documents into a scratch database three times, with the
+embeddings stored as an array of doubles, as a float32 BSON binary vector and as an int8 BSON binary
+vector (packed like `mongodb_migrate_vectors.py` does), and creates a vector index per quantization
+option on each copy: none, scalar and binary on the float copies, none on the int8 one, as int8
+vectors cannot be quantized further. `report` prints the storage size of every copy from `$collStats`,
+the estimated memory of the vectors in every index, and the query latency and recall@k of every index
+for the fixed query set, against the exact nearest neighbours of the float embeddings. `teardown` drops
+the scratch database.
+
+    python benchmarks/vector_storage.py setup --sample 10000
+    python benchmarks/vector_storage.py report --k 10 --candidates 100
+    python benchmarks/vector_storage.py teardown
+"""
+import os
+import sys
+from dataclasses import replace
+
+import click
+from bson.binary import Binary
+from dotenv import load_dotenv
+from pymongo.operations import SearchIndexModel
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common  # noqa: E402
+
+common.use_service(common.MAIN_DIR)
+sys.path.insert(0, common.ROOT_DIR)
+load_dotenv()
+
+from app.clients import registry  # noqa: E402
+from app.mongodb_atlas_retriever_tools import DATA_SOURCES, vector_search_pipeline  # noqa: E402
+from mongodb_migrate_vectors import encode_embedding  # noqa: E402
+
+SOURCE = DATA_SOURCES["User Uploaded Data"]
+# Storage format of every copy and the quantization options of its indexes
+FORMATS = {
+    "array": ["none", "scalar", "binary"],
+    "float32": ["none", "scalar", "binary"],
+    "int8": ["none"],
+}
+# Bytes per dimension of a vector held by the index
+INDEX_BYTES_PER_DIMENSION = {"none": 4, "scalar": 1, "binary": 1 / 8}
+
+
+def copy_name(embedding_format):
+    return f"{SOURCE.collection}_{embedding_format}"
+
+
+def index_name(quantization):
+    return f"{SOURCE.index_name}_{quantization}"
+
+
+def as_floats(embedding):
+    return embedding.as_vector().data if isinstance(embedding, Binary) else embedding
+
+
+def index_model(quantization, dimensions):
+    field = {"type": "vector", "path": SOURCE.embedding_key, "numDimensions": dimensions, "similarity": "cosine"}
+    if quantization != "none":
+        field["quantization"] = quantization
+    return SearchIndexModel(definition={"fields": [field]}, name=index_name(quantization), type="vectorSearch")
+
+
+def storage_stats(collection):
+    return next(collection.aggregate([{"$collStats": {"storageStats": {}}}]))["storageStats"]
+
+
+@click.group()
+def cli():
+    """Benchmark of the embedding storage formats and of the vector index quantization options."""
+    pass
+
+
+@cli.command()
+@click.option("--database", default="maap_benchmark", show_default=True, help="Scratch database.")
+@click.option("--user-id", default=None, help="Only copy the documents of this user.")
+@click.option("--sample", default=10000, show_default=True, help="Documents copied.")
+@click.option("--batch-size", default=500, show_default=True)
+def setup(database, user_id, sample, batch_size):
+    """
+    Copy a sample of the uploaded documents in every storage format, and create their vector indexes.
+    """
+    source = registry.mongo_client[SOURCE.database][SOURCE.collection]
+    scratch = registry.mongo_client[database]
+    targets = {embedding_format: scratch[copy_name(embedding_format)] for embedding_format in FORMATS}
+    for target in targets.values():
+        if target.estimated_document_count():
+            raise click.ClickException(f"{target.full_name} is not empty, run teardown first.")
+
+    pipeline = [{"$match": {"userId": user_id} if user_id else {}}, {"$sample": {"size": sample}}]
+    batches = {embedding_format: [] for embedding_format in FORMATS}
+    copied = 0
+    dimensions = None
+    for document in source.aggregate(pipeline):
+        embedding = as_floats(document.get(SOURCE.embedding_key))
+        if not embedding:
+            continue
+        dimensions = len(embedding)
+        for embedding_format, batch in batches.items():
+            stored = embedding if embedding_format == "array" else encode_embedding(embedding, embedding_format)
+            batch.append({**document, SOURCE.embedding_key: stored})
+        copied += 1
+        if len(batches["array"]) >= batch_size:
+            for embedding_format, batch in batches.items():
+                targets[embedding_format].insert_many(batch)
+                batch.clear()
+    for embedding_format, batch in batches.items():
+        if batch:
+            targets[embedding_format].insert_many(batch)
+    if not copied:
+        raise click.ClickException(f"No document with an embedding in {source.full_name}.")
+    print(f"Copied {copied} documents of {dimensions} dimensions in {len(FORMATS)} formats.")
+
+    for embedding_format, quantizations in FORMATS.items():
+        for quantization in quantizations:
+            targets[embedding_format].create_search_index(index_model(quantization, dimensions))
+    for embedding_format, quantizations in FORMATS.items():
+        for quantization in quantizations:
+            if not common.wait_for_search_index(targets[embedding_format], index_name(quantization)):
+                raise click.ClickException(f"{index_name(quantization)} of {copy_name(embedding_format)} is not queryable.")
+            print(f"{index_name(quantization)} of {copy_name(embedding_format)} is ready for querying.")
+    registry.shutdown()
+
+
+@cli.command()
+@click.option("--database", default="maap_benchmark", show_default=True, help="Scratch database.")
+@click.option("--queries", "queries_file", default=common.QUERIES_FILE, show_default=True)
+@click.option("--k", default=10, show_default=True)
+@click.option("--candidates", "num_candidates", default=100, show_default=True, help="numCandidates of the ANN queries.")
+@click.option("--repeat", default=3, show_default=True, help="Runs of every query per index.")
+@click.option("--output", default=None, help="Write the results as JSON.")
+def report(database, queries_file, k, num_candidates, repeat, output):
+    """
+    Report the storage size of every format, the index memory estimate, and the latency and recall of every index.
+    """
+    scratch = registry.mongo_client[database]
+    vectors = [registry.embeddings.embed_query(query) for query in common.load_queries(queries_file)]
+
+    def search(embedding_format, quantization, vector, exact=False):
+        source = replace(SOURCE, database=database, collection=copy_name(embedding_format), index_name=index_name(quantization))
+        pipeline = vector_search_pipeline(source, vector, k=k, num_candidates=num_candidates)
+        if exact:
+            vector_search = pipeline[0]["$vectorSearch"]
+            del vector_search["numCandidates"]
+            vector_search["exact"] = True
+        with common.Timer() as timer:
+            results = list(scratch[copy_name(embedding_format)].aggregate(pipeline))
+        return {str(result["_id"]) for result in results}, timer.ms
+
+    # The exact nearest neighbours of the full precision vectors are the reference of the recall
+    truth = [search("array", "none", vector, exact=True)[0] for vector in vectors]
+
+    rows = []
+    for embedding_format, quantizations in FORMATS.items():
+        stats = storage_stats(scratch[copy_name(embedding_format)])
+        count = stats["count"]
+        sample = scratch[copy_name(embedding_format)].find_one({}, {SOURCE.embedding_key: 1})
+        dimensions = len(as_floats(sample[SOURCE.embedding_key]))
+        for quantization in quantizations:
+            for vector in vectors:
+                search(embedding_format, quantization, vector)
+            latencies = []
+            recalls = []
+            for vector, expected in zip(vectors, truth):
+                for _ in range(repeat):
+                    found, ms = search(embedding_format, quantization, vector)
+                    latencies.append(ms)
+                if expected:
+                    recalls.append(len(found & expected) / len(expected))
+            bytes_per_dimension = 1 if embedding_format == "int8" else INDEX_BYTES_PER_DIMENSION[quantization]
+            summary = common.summarize(latencies)
+            rows.append(
+                {
+                    "storage": embedding_format,
+                    "quantization": quantization,
+                    "docs": count,
+                    "data_MB": round(stats["size"] / 2**20, 2),
+                    "storage_MB": round(stats["storageSize"] / 2**20, 2),
+                    "avg_doc_KB": round(stats.get("avgObjSize", 0) / 1024, 2),
+                    "index_vectors_MB": round(count * dimensions * bytes_per_dimension / 2**20, 2),
+                    "recall": round(sum(recalls) / len(recalls), 4) if recalls else "-",
+                    "p50_ms": summary["p50_ms"],
+                    "p95_ms": summary["p95_ms"],
+                }
+            )
+    print(f"{len(vectors)} queries, k={k}, numCandidates={num_candidates}")
+    common.print_table(rows)
+    common.write_results(output, rows)
+    registry.shutdown()
+
+
+@cli.command()
+@click.option("--database", default="maap_benchmark", show_default=True, help="Scratch database.")
+@click.confirmation_option(prompt="Drop the scratch database?")
+def teardown(database):
+    """
+    Drop the scratch database.
+    """
+    if database in {source.database for source in DATA_SOURCES.values()}:
+        raise click.ClickException(f"{database} holds a data source, it is not a scratch database.")
+    registry.mongo_client.drop_database(database)
+    print(f"Dropped {database}")
+    registry.shutdown()
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,90 @@
+import hashlib
+import os
+import re
+import time
+
+import click
+import pymongo
+from dotenv import load_dotenv
+from pymongo.errors import DuplicateKeyError
+from pymongo.mongo_client import MongoClient
+
+# Load environment variables
+load_dotenv()
+
+# Constants
+MONGODB_URI = os.getenv("MONGODB_URI")
+
+
+def content_hash(text):
+    # Same hash as the loader's ingest.ContentHash
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def source_key(source):
+    # Same keys as the loader: the URL of a web page, the upload name of a file without the timestamp
+    # that the loader adds to it (utils.SourceKey)
+    if re.match(r"(?i)https?://", source):
+        return source
+    return re.sub(r"_\d{4}(_\d{2}){5}(?=\.[^.]*$|$)", "", os.path.basename(source))
+
+
+@click.command()
+@click.option("--database", default="maap_data_loader", show_default=True)
+@click.option("--collection", default="document", show_default=True)
+@click.option("--text-field", default="document_text", show_default=True, help="Field holding the chunk text.")
+@click.option("--dry-run", is_flag=True, help="Only count the chunks that would be backfilled.")
+def backfill(database, collection, text_field, dry_run):
+    """
+    Add the content_hash and source_keys of chunks stored before the loader keyed chunks by content, so that
+    later uploads of the same content reuse them instead of storing duplicates. A chunk whose content is
+    already stored with a content_hash for the same user is merged into that chunk and deleted.
+    Chunks that are already hashed are left as they are, so the backfill can be resumed.
+    """
+    client = MongoClient(MONGODB_URI)
+    coll = client[database][collection]
+    # The loader's unique index (ingest.EnsureIndexes), the merge below relies on it
+    coll.create_index(
+        [("userId", 1), ("content_hash", 1)],
+        unique=True,
+        partialFilterExpression={"content_hash": {"$exists": True}},
+    )
+    query = {"content_hash": {"$exists": False}, text_field: {"$type": "string"}}
+    total = coll.count_documents(query)
+    print(f"{total} chunk(s) in {database}.{collection} have no content_hash.")
+    if dry_run or total == 0:
+        client.close()
+        return
+
+    start = time.perf_counter()
+    hashed = 0
+    merged = 0
+    try:
+        for doc in coll.find(query, {text_field: 1, "userId": 1, "source": 1}):
+            digest = content_hash(doc[text_field])
+            sources = [source_key(doc["source"])] if isinstance(doc.get("source"), str) else []
+            try:
+                coll.update_one(
+                    {"_id": doc["_id"]},
+                    {"$set": {"content_hash": digest}, "$addToSet": {"source_keys": {"$each": sources}}},
+                )
+                hashed += 1
+            except DuplicateKeyError:
+                # The unique (userId, content_hash) index already holds this content
+                coll.update_one(
+                    {"userId": doc.get("userId"), "content_hash": digest},
+                    {"$addToSet": {"source_keys": {"$each": sources}}},
+                )
+                coll.delete_one({"_id": doc["_id"]})
+                merged += 1
+            if (hashed + merged) % 500 == 0:
+                print(f"Backfilled {hashed + merged}/{total} chunks.")
+    except pymongo.errors.PyMongoError as e:
+        print(f"Error backfilling content hashes: {e}")
+    finally:
+        client.close()
+    print(f"Hashed {hashed} chunk(s) and merged {merged} duplicate(s) in {time.perf_counter() - start:.1f}s.")
+
+
+if __name__ == "__main__":
+    backfill()
@@ -12,6 +12,21 @@ load_dotenv()
 # Constants
 MONGODB_URI = os.getenv("MONGODB_URI")
 POLL_INTERVAL = 5  # seconds
+# Automatic quantization of the vector indexes: "none", "scalar" (int8) or "binary" (1 bit per dimension)
+VECTOR_INDEX_QUANTIZATION = os.getenv("VECTOR_INDEX_QUANTIZATION", "none")
+
+
+# Helper function to define an indexed vector field
+def vector_field(path):
+    field = {
+        "numDimensions": 1536,
+        "path": path,
+        "similarity": "cosine",
+        "type": "vector"
+    }
+    if VECTOR_INDEX_QUANTIZATION != "none":
+        field["quantization"] = VECTOR_INDEX_QUANTIZATION
+    return field
 
 
 # Helper function to create and wait for a search index
@@ -73,7 +88,8 @@ if data:
 else:
     print("No data to insert. Exiting.")
 
-# Define search index models
+# Define search index models. The full-text indexes only map the searched text, and the fields the
+# hybrid search filters on as tokens, instead of every field of the documents with a dynamic mapping.
 index_models = [
     {
         "database": "travel_agency",
@@ -81,12 +97,7 @@ index_models = [
         "index_model": SearchIndexModel(
             definition={
                 "fields": [
-                    {
-                        "numDimensions": 1536,
-                        "path": "details_embedding",
-                        "similarity": "cosine",
-                        "type": "vector"
-                    }
+                    vector_field("details_embedding")
                 ]
             },
             name="vector_index",
@@ -99,21 +110,75 @@ index_models = [
         "index_model": SearchIndexModel(
             definition={
                 "fields": [
+                    vector_field("document_embedding"),
                     {
-                        "numDimensions": 1536,
-                        "path": "document_embedding",
-                        "similarity": "cosine",
-                        "type": "vector"
+                        "type": "filter",
+                        "path": "userId"
                     },
                     {
                         "type": "filter",
-                        "path": "userId"
+                        "path": "source"
                     }
                 ]
             },
             name="document_vector_index",
             type="vectorSearch",
         ),
+    },
+    {
+        "database": "travel_agency",
+        "collection": "trip_recommendation",
+        "index_model": SearchIndexModel(
+            definition={
+                "mappings": {
+                    "dynamic": False,
+                    "fields": {
+                        "About Place": {"type": "string"}
+                    }
+                }
+            },
+            name="text_index",
+            type="search",
+        ),
+    },
+    {
+        "database": "maap_data_loader",
+        "collection": "document",
+        "index_model": SearchIndexModel(
+            definition={
+                "mappings": {
+                    "dynamic": False,
+                    "fields": {
+                        "document_text": {"type": "string"},
+                        "userId": {"type": "token"},
+                        "source": {"type": "token"}
+                    }
+                }
+            },
+            name="document_text_index",
+            type="search",
+        ),
+    },
+    {
+        "database": "maap_semantic_cache",
+        "collection": "response",
+        "index_model": SearchIndexModel(
+            definition={
+                "fields": [
+                    vector_field("embedding"),
+                    {
+                        "type": "filter",
+                        "path": "userId"
+                    },
+                    {
+                        "type": "filter",
+                        "path": "dataSource"
+                    }
+                ]
+            },
+            name="semantic_cache_vector_index",
+            type="vectorSearch",
+        ),
     }
 ]
 
@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+
+import click
+import pymongo
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+from pymongo.mongo_client import MongoClient
+
+# The loader stores its embeddings with the same shared encoder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "MAAP-AWS-Arcee", "shared"))
+from vector_encoding import encode_embedding  # noqa: E402
+
+# Load environment variables
+load_dotenv()
+
+# Constants
+MONGODB_URI = os.getenv("MONGODB_URI")
+
+
+@click.command()
+@click.option("--database", default="maap_data_loader", show_default=True)
+@click.option("--collection", default="document", show_default=True)
+@click.option("--field", default="document_embedding", show_default=True, help="Embedding field to convert.")
+@click.option(
+    "--format",
+    "embedding_format",
+    type=click.Choice(["float32", "int8"]),
+    default="float32",
+    show_default=True,
+    help="BSON binary vector type to store.",
+)
+@click.option("--batch-size", default=500, show_default=True)
+@click.option("--dry-run", is_flag=True, help="Only count the documents that would be converted.")
+def migrate(database, collection, field, embedding_format, batch_size, dry_run):
+    """
+    Convert embeddings stored as arrays of doubles to packed BSON binary vectors.
+    Documents that already store a binary vector are left as they are, so the migration can be resumed.
+    """
+    client = MongoClient(MONGODB_URI)
+    coll = client[database][collection]
+    query = {field: {"$type": "array"}}
+    total = coll.count_documents(query)
+    print(f"{total} document(s) in {database}.{collection} store '{field}' as an array.")
+    if dry_run or total == 0:
+        client.close()
+        return
+
+    start = time.perf_counter()
+    converted = 0
+    batch = []
+    try:
+        for doc in coll.find(query, {field: 1}):
+            batch.append(UpdateOne({"_id": doc["_id"], **query}, {"$set": {field: encode_embedding(doc[field], embedding_format)}}))
+            if len(batch) >= batch_size:
+                converted += coll.bulk_write(batch, ordered=False).modified_count
+                batch = []
+                print(f"Converted {converted}/{total} documents.")
+        if batch:
+            converted += coll.bulk_write(batch, ordered=False).modified_count
+    except pymongo.errors.PyMongoError as e:
+        print(f"Error converting embeddings: {e}")
+    finally:
+        client.close()
+    print(f"Converted {converted} document(s) to {embedding_format} vectors in {time.perf_counter() - start:.1f}s.")
+
+
+if __name__ == "__main__":
+    migrate()